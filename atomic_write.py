@@ -0,0 +1,27 @@
+import os
+from os.path import isfile
+
+def write_atomically(dest_filepath, write, fsync=False):
+    """Call write on a temporary filepath next to dest_filepath, then rename it to dest_filepath
+
+    The rename being atomic, dest_filepath is either the previous version or the complete new one, never a partial file.
+    If fsync is set, the temporary file is also flushed to disk before the rename, so that this holds after a power loss too.
+
+    Arguments:
+        dest_filepath {str} -- Filepath to write to
+        write {callable} -- Function writing its unique argument (a filepath)
+        fsync {bool} -- Whether to fsync the temporary file before renaming it (e.g. for the small files a crash must not lose)
+    """
+    temp_filepath = '{}.tmp'.format(dest_filepath)
+    try:
+        write(temp_filepath)
+        if fsync:
+            fd = os.open(temp_filepath, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        os.replace(temp_filepath, dest_filepath)
+    finally:
+        if isfile(temp_filepath):
+            os.remove(temp_filepath)
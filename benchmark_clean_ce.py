@@ -0,0 +1,93 @@
+import click
+import numpy as np
+import pandas as pd
+import tempfile
+import time
+from os.path import join
+
+from clean_fingerprints import clean_ce, STOP_SYMBOL
+from generate_fingerprints import generate_ce_data
+
+@click.command()
+@click.option('--filesize', default=200.0, help='Size [MB] of the synthetic ce file to clean')
+@click.option('--legacy_filesize', default=20.0, help='Size [MB] of the prefix cleaned with the legacy per-float loop')
+@click.option('--seed', default=0, help='Seed of the random generator')
+def benchmark_clean_ce(filesize, legacy_filesize, seed):
+    """Benchmark the vectorized clean_ce against the legacy per-float loop on a synthetic ce file
+
+    The legacy loop is only run on the first {legacy_filesize} MB, since it takes minutes on large captures.
+    Both outputs are checked to be identical on that prefix.
+
+    Arguments:
+        filesize {float} -- Size [MB] of the synthetic ce file to clean
+        legacy_filesize {float} -- Size [MB] of the prefix cleaned with the legacy per-float loop
+        seed {int} -- Seed of the random generator
+    """
+
+    with tempfile.TemporaryDirectory() as tmp_folderpath:
+        ce_filepath = join(tmp_folderpath, 'ce_0_raw.txt')
+        legacy_ce_filepath = join(tmp_folderpath, 'ce_1_raw.txt')
+
+        ce_data_1d = generate_ce_data(filesize, seed=seed)
+        ce_data_1d.tofile(ce_filepath)
+        ce_data_1d[:int(legacy_filesize * 1e6 / 4)].tofile(legacy_ce_filepath)
+
+        print('')
+        print('Benchmark clean_ce on {:.1f} MB ({:.1f} MB for the legacy loop)\n'.format(filesize, legacy_filesize))
+
+        start_time = time.perf_counter()
+        legacy_df = clean_ce_legacy(legacy_ce_filepath)
+        legacy_elapsed_time = time.perf_counter() - start_time
+
+        vectorized_df = clean_ce(legacy_ce_filepath)
+        pd.testing.assert_frame_equal(legacy_df, vectorized_df)
+        print('\t Legacy and vectorized outputs are identical ({} records)\n'.format(len(vectorized_df)))
+
+        start_time = time.perf_counter()
+        ce_df = clean_ce(ce_filepath)
+        elapsed_time = time.perf_counter() - start_time
+
+    legacy_throughput = legacy_filesize / legacy_elapsed_time
+    throughput = filesize / elapsed_time
+    print('\t Legacy:     {:8.2f} MB/s ({:.2f}s for {:.1f} MB)'.format(legacy_throughput, legacy_elapsed_time, legacy_filesize))
+    print('\t Vectorized: {:8.2f} MB/s ({:.2f}s for {:.1f} MB, {} records)'.format(throughput, elapsed_time, filesize, len(ce_df)))
+    print('\t Speedup:    {:8.1f}x'.format(throughput / legacy_throughput))
+
+
+def clean_ce_legacy(ce_filepath):
+    """Reference implementation of clean_ce, walking the stream one float at a time"""
+    ce_dt = np.dtype([('TTI', np.float32), ('SC_ID', np.float32),
+               ('CE_0_AMPLITUDE', np.float32), ('CE_0_PHASE', np.float32),
+               ('CE_1_AMPLITUDE', np.float32), ('CE_1_PHASE', np.float32),
+               ('CE_2_AMPLITUDE', np.float32), ('CE_2_PHASE', np.float32),
+               ('CE_3_AMPLITUDE', np.float32), ('CE_3_PHASE', np.float32),
+               ('STOP', np.float32)])
+
+    ce_data = np.fromfile(ce_filepath, dtype=ce_dt)
+    ce_df = pd.DataFrame(ce_data)
+
+    ce_data_1d = ce_df.values.reshape((-1,))
+
+    n_rows = (ce_data_1d == STOP_SYMBOL).sum()
+    cleaned_ce_data = np.full((n_rows, ce_df.shape[1] - 1), fill_value=np.nan)
+
+    row_idx = 0
+    column_idx = 0
+    for i, e in enumerate(ce_data_1d):
+        column_idx += 1
+        if e == STOP_SYMBOL:
+            if column_idx == 11:
+                cleaned_ce_data[row_idx, :] = ce_data_1d[i-10:i]
+                row_idx += 1
+            column_idx = 0
+
+    clean_ce_df = pd.DataFrame(cleaned_ce_data, columns=ce_dt.names[:-1]).dropna()
+
+    for column in ['TTI', 'SC_ID']:
+        clean_ce_df[column] = clean_ce_df[column].astype(np.int64)
+
+    return clean_ce_df
+
+
+if __name__ == '__main__':
+    benchmark_clean_ce() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,124 @@
+import click
+import contextlib
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from os.path import join
+
+from generate_fingerprints import write_fingerprint
+
+CAPTURES_FOLDERNAME = 'captures'
+CAMPAIGNS_FOLDERNAME = 'campaigns'
+COMBINED_FOLDERNAME = 'combined'
+STAGES = ['move', 'clean', 'combine', 'plot']
+
+@click.command()
+@click.option('--n_campaigns', default=2, help='Amount of campaigns (i.e. folders later combined)')
+@click.option('--n_fingerprints', default=10, help='Amount of fingerprints per campaign')
+@click.option('--filesize', default=20.0, help='Size [MB] of each synthetic ce.txt')
+@click.option('--error_rate', default=1e-4, help='Ratio of ce records with a framing error')
+@click.option('--jobs', '-j', default=1, help='Amount of worker processes used to clean the fingerprints')
+@click.option('--streaming', is_flag=True, help='Whether to clean the ce files by chunks')
+@click.option('--workdir', default=None, help='Folder where to run the benchmark (kept afterwards, only its captures, campaigns and combined folders being replaced). A temporary folder if not set')
+def benchmark_pipeline(n_campaigns, n_fingerprints, filesize, error_rate, jobs, streaming, workdir):
+    """Benchmark the post-processing pipeline (move -> clean -> combine -> plot) on synthetic srsue captures
+
+    Each stage runs in its own process, with its output silenced, so that its peak RSS can be measured.
+    The captures are generated beforehand (see generate_fingerprints.py) and are not part of the timings.
+
+    Arguments:
+        n_campaigns {int} -- Amount of campaigns (i.e. folders later combined)
+        n_fingerprints {int} -- Amount of fingerprints per campaign
+        filesize {float} -- Size [MB] of each synthetic ce.txt
+        error_rate {float} -- Ratio of ce records with a framing error
+        jobs {int} -- Amount of worker processes used to clean the fingerprints
+        streaming {bool} -- Whether to clean the ce files by chunks
+        workdir {str} -- Folder where to run the benchmark. Only its CAPTURES_FOLDERNAME, CAMPAIGNS_FOLDERNAME and COMBINED_FOLDERNAME
+                         folders are replaced. A temporary folder if None
+    """
+    with contextlib.ExitStack() as stack:
+        if workdir is None:
+            workdir = stack.enter_context(tempfile.TemporaryDirectory())
+        else: # only clear the folders of a previous benchmark, not the rest of workdir
+            for foldername in [CAPTURES_FOLDERNAME, CAMPAIGNS_FOLDERNAME, COMBINED_FOLDERNAME]:
+                if os.path.isdir(join(workdir, foldername)):
+                    shutil.rmtree(join(workdir, foldername))
+
+        print('')
+        print('Generate {} campaigns of {} fingerprints ({} MB each) in {}/\n'.format(n_campaigns, n_fingerprints, filesize, workdir))
+        n_bytes = 0
+        for campaign_idx in range(n_campaigns):
+            for fingerprint_idx in range(n_fingerprints):
+                capture_folderpath = join(workdir, CAPTURES_FOLDERNAME, str(campaign_idx), str(fingerprint_idx))
+                n_bytes += write_fingerprint(capture_folderpath, filesize, error_rate=error_rate, seed=campaign_idx * n_fingerprints + fingerprint_idx)
+
+        n_total_fingerprints = n_campaigns * n_fingerprints
+        print('Run {} stages\n'.format(len(STAGES)))
+        print('\t {:8s} {:>9s} {:>10s} {:>15s} {:>14s}'.format('Stage', 'Time [s]', 'MB/s', 'Fingerprints/s', 'Peak RSS [MB]'))
+        for stage in STAGES:
+            elapsed_time, peak_rss = run_stage(stage, workdir=workdir, n_campaigns=n_campaigns, n_fingerprints=n_fingerprints, jobs=jobs, streaming=streaming)
+            print('\t {:8s} {:9.2f} {:10.2f} {:15.2f} {:14.1f}'.format(
+                stage, elapsed_time, n_bytes / 1e6 / elapsed_time, n_total_fingerprints / elapsed_time, peak_rss))
+
+
+def run_stage(stage, **kwargs):
+    """Run the stage {stage} in a new process
+
+    Arguments:
+        stage {str} -- One of STAGES
+        kwargs -- Passed to run_stage_in_process
+
+    Returns:
+        elapsed_time [float] -- Time [s] taken by the stage
+        peak_rss [float] -- Peak resident set size [MB] of the process running the stage (and of its own worker processes)
+    """
+    context = multiprocessing.get_context('spawn') # a fresh interpreter, so that the peak RSS is the stage's own
+    queue = context.Queue()
+    process = context.Process(target=run_stage_in_process, args=(stage, queue), kwargs=kwargs)
+    process.start()
+    elapsed_time, peak_rss = queue.get()
+    process.join()
+
+    return elapsed_time, peak_rss
+
+
+def run_stage_in_process(stage, queue, workdir, n_campaigns, n_fingerprints, jobs, streaming):
+    """Run the stage {stage}, then put its elapsed time [s] and peak RSS [MB] in queue"""
+    # Imported here, so that their import time is not attributed to the parent process
+    from move_fingerprint import move_fingerprint
+    from clean_fingerprints import clean_fingerprints
+    from combine_fingerprint_folders import combine_fingerprint_folders
+    from plot_fingerprints import plot_fingerprints
+
+    campaign_folderpaths = [join(workdir, CAMPAIGNS_FOLDERNAME, 'campaign-{}'.format(campaign_idx)) for campaign_idx in range(n_campaigns)]
+    combined_folderpath = join(workdir, COMBINED_FOLDERNAME)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start_time = time.perf_counter()
+
+        if stage == 'move':
+            os.makedirs(join(workdir, CAMPAIGNS_FOLDERNAME))
+            for campaign_idx, campaign_folderpath in enumerate(campaign_folderpaths):
+                for fingerprint_idx in range(n_fingerprints):
+                    capture_folderpath = join(workdir, CAPTURES_FOLDERNAME, str(campaign_idx), str(fingerprint_idx))
+                    move_fingerprint(x=fingerprint_idx, y=campaign_idx, src_folderpath=capture_folderpath, dest_folderpath=campaign_folderpath, verbose=False)
+        elif stage == 'clean':
+            for campaign_folderpath in campaign_folderpaths:
+                clean_fingerprints.callback(src_folderpath=campaign_folderpath, force=False, streaming=streaming,
+                                            chunksize=64.0, jobs=jobs, dense=False, profile=False)
+        elif stage == 'combine':
+            combine_fingerprint_folders.callback(src_folderpath=join(workdir, CAMPAIGNS_FOLDERNAME), dest_folderpath=combined_folderpath, profile=False)
+        elif stage == 'plot':
+            plot_fingerprints.callback(src_folderpath=combined_folderpath, force=True, profile=False)
+
+        elapsed_time = time.perf_counter() - start_time
+
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1e3 # ru_maxrss is in kB
+    queue.put((elapsed_time, peak_rss))
+
+
+if __name__ == '__main__':
+    benchmark_pipeline() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,263 @@
+import ctypes
+import ctypes.util
+import numpy as np
+import os
+import select
+import time
+
+from clean_fingerprints import CE_DT, STOP_SYMBOL, N_RECORDING_PER_SECOND, N_TTIS, resync_ce
+
+MIN_INTERVAL = 0.05 # [s] minimum time between two checks of the filesize, coalescing the many writes of srsue
+POLL_INTERVAL = 0.1 # [s] time between two checks of the filesize when inotify is not available
+MAX_TTI_STEP = 100 # [ms] TTI steps above this are not counted towards the capture's duration
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+class CaptureWatcher(object):
+    def __init__(self, filepath, min_interval=MIN_INTERVAL):
+        """Watch a capture file (e.g. ce.txt) growing, without busy-waiting
+
+        On Linux, the folder holding the file is watched with inotify, so that the process sleeps until srsue writes to it.
+        Elsewhere, the filesize is polled every POLL_INTERVAL seconds.
+
+        Arguments:
+            filepath {str} -- Filepath of the watched file. It does not need to exist yet
+            min_interval {float} -- Minimum time [s] between two checks of the filesize
+        """
+        self.filepath = filepath
+        self.min_interval = min_interval
+        self.growth_rate = None # [B/s] growth rate of the file during the last wait_for_filesize
+        self.inotify_fd = init_inotify(os.path.dirname(os.path.abspath(filepath)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def get_filesize(self):
+        """Return the size [B] of the watched file, 0 if it does not exist"""
+        try:
+            return os.stat(self.filepath).st_size
+        except FileNotFoundError:
+            return 0
+
+    def wait_for_filesize(self, filesize, timeout=None):
+        """Block until the watched file is larger than filesize
+
+        Arguments:
+            filesize {float} -- Size [B] the file must exceed
+            timeout {float} -- Time [s] after which to give up. Never give up if None
+
+        Returns:
+            [int] -- Size [B] of the file, or None if the timeout was reached first
+        """
+        if self.wait_until(lambda size: size > filesize, timeout):
+            return self.get_filesize()
+        return None
+
+    def wait_for_capture(self, n_records=None, n_ttis=None, duration=None, filesize=None, timeout=None, progress=None):
+        """Block until the watched ce file holds enough intact records, parsing it incrementally (see CaptureProgress)
+
+        Returns as soon as one of the given (i.e. not None) criteria is met.
+
+        Arguments:
+            n_records {int} -- Amount of intact ce records to collect
+            n_ttis {int} -- Amount of distinct TTIs to collect
+            duration {float} -- Time [s] spanned by the TTIs of the intact records
+            filesize {float} -- Size [B] the file must exceed, regardless of its content
+            timeout {float} -- Time [s] after which to give up. Never give up if None
+            progress {CaptureProgress} -- Progress of a previous wait to resume from. A new one if None
+
+        Returns:
+            [CaptureProgress] -- Progress of the capture (its reached_criterion is None if the timeout was reached first)
+        """
+        if n_records is None and n_ttis is None and duration is None and filesize is None:
+            raise ValueError('At least one of n_records, n_ttis, duration and filesize is required')
+
+        if progress is None:
+            progress = CaptureProgress(self.filepath)
+        criteria = [('n_records', n_records), ('n_ttis', n_ttis), ('duration', duration), ('filesize', filesize)]
+        def is_reached(size):
+            progress.update()
+            for criterion, threshold in criteria:
+                if threshold is not None and getattr(progress, criterion) >= threshold:
+                    progress.reached_criterion = criterion
+                    return True
+            return False
+
+        self.wait_until(is_reached, timeout)
+        return progress
+
+    def wait_until(self, is_reached, timeout=None):
+        """Block until is_reached(size of the watched file [B]) returns True, checking it whenever the file changes
+
+        Arguments:
+            is_reached {callable} -- Condition to wait for
+            timeout {float} -- Time [s] after which to give up. Never give up if None
+
+        Returns:
+            [bool] -- Whether the condition was reached before the timeout
+        """
+        start_time = time.perf_counter()
+        start_size = self.get_filesize()
+        deadline = None if timeout is None else start_time + timeout
+
+        while True:
+            last_check_time = time.perf_counter()
+            size = self.get_filesize()
+            self.growth_rate = (size - start_size) / max(last_check_time - start_time, 1e-9)
+            if is_reached(size):
+                return True
+
+            if deadline is not None and last_check_time >= deadline:
+                return False
+
+            remaining_time = None if deadline is None else deadline - last_check_time
+            self.wait_for_change(remaining_time)
+
+            # Coalesce the writes happening within min_interval
+            elapsed_time = time.perf_counter() - last_check_time
+            if elapsed_time < self.min_interval:
+                time.sleep(min(self.min_interval - elapsed_time, remaining_time if remaining_time is not None else self.min_interval))
+
+    def wait_for_change(self, timeout):
+        """Sleep until something is written in the watched folder (or until timeout [s], if not None)"""
+        if self.inotify_fd is None:
+            time.sleep(POLL_INTERVAL if timeout is None else min(POLL_INTERVAL, timeout))
+            return
+
+        readable, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self.inotify_fd, 65536): # drain the pending events, only the filesize matters
+                    pass
+            except BlockingIOError:
+                pass
+
+
+def init_inotify(folderpath):
+    """Return an inotify file descriptor watching the writes in folderpath, None if inotify is not available"""
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    if libc.inotify_add_watch(fd, os.fsencode(folderpath), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+class CaptureProgress(object):
+    def __init__(self, ce_filepath):
+        """Parse a growing ce file incrementally, counting what clean_ce would keep of it
+
+        Each update only reads the bytes appended since the previous one, and resynchronizes them on STOP_SYMBOL
+        like clean_ce_streaming does, carrying the floats following the last STOP_SYMBOL over to the next update.
+        If the file is removed or truncated (e.g. rotated out), the counts start over.
+
+        Attributes:
+            n_records {int} -- Amount of intact records (without NaN) so far
+            n_ttis {int} -- Amount of distinct TTIs among them (counted as TTI changes, so that the TTI wrap-around is handled)
+            duration {float} -- Time [s] spanned by those TTIs (ignoring the steps above MAX_TTI_STEP)
+            filesize {int} -- Size [B] of the file parsed so far
+            reached_criterion {str} -- Criterion met by CaptureWatcher.wait_for_capture, None until then
+
+        Arguments:
+            ce_filepath {str} -- Filepath of the ce file (e.g. ce.txt)
+        """
+        self.ce_filepath = ce_filepath
+        self.reached_criterion = None
+        self.reset()
+
+    def reset(self):
+        self.inode = None
+        self.filesize = 0
+        self.n_records = 0
+        self.n_ttis = 0
+        self.duration = 0.0
+        self.last_tti = None
+        self.remainder = b'' # bytes of an incomplete float
+        self.tail_length = 0 # amount of floats following the last STOP_SYMBOL read so far
+        self.carry = np.empty(0, dtype=np.float32) # those floats, as long as they can still be the beginning of an intact record
+
+    def update(self):
+        """Parse the bytes appended to the ce file since the last update
+
+        Returns:
+            [CaptureProgress] -- self
+        """
+        try:
+            with open(self.ce_filepath, 'rb') as fp:
+                stat = os.fstat(fp.fileno())
+                if stat.st_ino != self.inode or stat.st_size < self.filesize: # new or truncated file
+                    self.reset()
+                    self.inode = stat.st_ino
+
+                fp.seek(self.filesize)
+                data = self.remainder + fp.read(stat.st_size - self.filesize)
+        except FileNotFoundError:
+            self.reset()
+            return self
+
+        self.filesize += len(data) - len(self.remainder)
+        n_floats = len(data) // 4
+        self.remainder = data[n_floats * 4:]
+        self.parse(np.frombuffer(data[:n_floats * 4], dtype=np.float32))
+
+        return self
+
+    def parse(self, floats):
+        """Resynchronize floats (following the previously parsed ones) and update the counts with their intact records"""
+        if len(floats) == 0:
+            return
+
+        n_fields = len(CE_DT.names)
+        if self.tail_length < n_fields:
+            floats = np.concatenate((self.carry, floats))
+            previous_stop_idx = -1
+        else: # too long to be the beginning of an intact record, only its length matters
+            previous_stop_idx = -self.tail_length - 1
+
+        records = resync_ce(floats, n_fields=n_fields, previous_stop_idx=previous_stop_idx)
+        records = records[~np.isnan(records).any(axis=1)]
+        self.n_records += len(records)
+
+        if len(records) > 0:
+            ttis = records[:, 0].astype(np.int64)
+            if self.last_tti is not None:
+                ttis = np.concatenate(([self.last_tti], ttis))
+            tti_steps = np.diff(ttis) % N_TTIS # TTIs wrap around every N_TTIS ms
+            tti_steps[tti_steps > MAX_TTI_STEP] = 0 # to or from a misaligned record that happened to look intact
+            self.n_ttis += np.count_nonzero(tti_steps) + (self.last_tti is None)
+            self.duration += tti_steps.sum() / N_RECORDING_PER_SECOND
+            self.last_tti = ttis[-1]
+
+        stop_idx = np.flatnonzero(floats == STOP_SYMBOL)
+        if len(stop_idx) > 0:
+            self.tail_length = len(floats) - stop_idx[-1] - 1
+        elif previous_stop_idx == -1:
+            self.tail_length = len(floats)
+        else:
+            self.tail_length += len(floats)
+        self.carry = floats[len(floats) - self.tail_length:].copy() if self.tail_length < n_fields else np.empty(0, dtype=np.float32)
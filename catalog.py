@@ -0,0 +1,153 @@
+import click
+import json
+from os.path import join, isfile, dirname, abspath, basename, normpath, relpath
+
+from atomic_write import write_atomically
+from consolidate_fingerprints import list_cleaned_filepaths, load_cleaned_fingerprint, CE_FILENAME, ELSE_FILENAME, INFO_FILENAME
+from locations_index import load_locations, LOCATIONS_FILENAME
+from transforms import load_transformed_locations
+
+ID_STRIDE = 1000000 # Amount of global IDs reserved for each campaign, i.e. maximum amount of fingerprints per campaign
+
+@click.command()
+@click.argument('catalog_filepath')
+@click.argument('campaign_folderpaths', nargs=-1)
+def catalog_clickwrapper(catalog_filepath, campaign_folderpaths):
+    """Add the campaign folders to the catalog {catalog_filepath} (created if missing), and print its campaigns
+    """
+    catalog = Catalog(catalog_filepath)
+    for campaign_folderpath in campaign_folderpaths:
+        catalog.add_campaign(campaign_folderpath)
+
+    print('')
+    for campaign in catalog.campaigns:
+        n_fingerprints = len(load_locations(catalog.get_folderpath(campaign), LOCATIONS_FILENAME))
+        print('\t {}: {} fingerprints, global IDs from {} ({})'.format(campaign['name'], n_fingerprints, campaign['id_offset'], campaign['folderpath']))
+
+class Catalog(object):
+    def __init__(self, catalog_filepath):
+        """Several campaign folders (each with its ce, else and info folders and its locations.json), exposed as a single radio map
+        without copying them, unlike combine_fingerprint_folders
+
+        The catalog file is a JSON listing the campaigns, their folderpath being relative to the catalog file:
+            {"campaigns": [{"name": "line-1", "folderpath": "../line-1", "id_offset": 0}, ...]}
+
+        The global ID of a fingerprint is the id_offset of its campaign, plus its ID within the campaign. The id_offsets being
+        ID_STRIDE apart, the global IDs stay unique and stable as campaigns grow or are added.
+
+        Only the catalog file is read when opened: the locations and the fingerprint files are read on demand, from the campaign folders.
+
+        Arguments:
+            catalog_filepath {str} -- Filepath of the catalog file. Created by add_campaign if missing
+        """
+        self.filepath = catalog_filepath
+        self.campaigns = []
+        if isfile(catalog_filepath):
+            with open(catalog_filepath, 'r') as fp:
+                self.campaigns = json.load(fp)['campaigns']
+
+    def add_campaign(self, folderpath, name=None):
+        """Add the campaign folder folderpath to the catalog, and save it
+
+        Arguments:
+            folderpath {str} -- Folder holding the campaign's ce, else and info folders and its locations.json
+            name {str} -- Name of the campaign. The folder's name if None
+
+        Returns:
+            campaign [dict] -- Entry of the campaign in the catalog
+        """
+        name = basename(normpath(folderpath)) if name is None else name
+        folderpath = relpath(abspath(folderpath), dirname(abspath(self.filepath)))
+        for campaign in self.campaigns:
+            if campaign['folderpath'] == folderpath:
+                print('\t {} is already in {}'.format(folderpath, self.filepath))
+                return campaign
+            if campaign['name'] == name:
+                raise ValueError('A campaign named {} ({}) is already in {}'.format(name, campaign['folderpath'], self.filepath))
+
+        id_offset = max([campaign['id_offset'] + ID_STRIDE for campaign in self.campaigns], default=0)
+        campaign = {'name': name, 'folderpath': folderpath, 'id_offset': id_offset}
+        self.campaigns.append(campaign)
+        self.save()
+
+        return campaign
+
+    def save(self):
+        """Atomically save the catalog file"""
+        def dump(filepath):
+            with open(filepath, 'w') as fp:
+                json.dump({'campaigns': self.campaigns}, fp, indent=1)
+
+        write_atomically(self.filepath, dump)
+
+    def get_folderpath(self, campaign):
+        """Return the folderpath of the campaign (an entry of self.campaigns)"""
+        return join(dirname(abspath(self.filepath)), campaign['folderpath'])
+
+    def get_campaign(self, name):
+        for campaign in self.campaigns:
+            if campaign['name'] == name:
+                return campaign
+        raise KeyError('No campaign named {} in {}'.format(name, self.filepath))
+
+    def resolve(self, global_id):
+        """Resolve a global fingerprint ID into its campaign and its ID within the campaign
+
+        Returns:
+            campaign [dict] -- Entry of the campaign in self.campaigns
+            fingerprint_id [int] -- ID of the fingerprint within the campaign
+        """
+        global_id = int(global_id)
+        for campaign in self.campaigns:
+            if campaign['id_offset'] <= global_id < campaign['id_offset'] + ID_STRIDE:
+                return campaign, global_id - campaign['id_offset']
+        raise KeyError('No campaign holds the global ID {} in {}'.format(global_id, self.filepath))
+
+    def load_locations(self, names=None):
+        """Load the locations of the fingerprints of the campaigns, with their transform applied (see transforms.py), under their global IDs
+
+        Arguments:
+            names {list of str} -- Names of the campaigns to load. All of them if None
+
+        Returns:
+            locations [dict] -- The global fingerprint IDs (str) are keys, and the [x,y] coordinates are values
+        """
+        locations = {}
+        for campaign in self.campaigns:
+            if names is not None and campaign['name'] not in names:
+                continue
+
+            campaign_locations = load_transformed_locations(self.get_folderpath(campaign), LOCATIONS_FILENAME)
+            if campaign_locations and max(map(int, campaign_locations.keys())) >= ID_STRIDE:
+                raise ValueError('{} holds more than {} fingerprints, the ID_STRIDE of {}'.format(campaign['name'], ID_STRIDE, self.filepath))
+            for fingerprint_id, location in campaign_locations.items():
+                locations[str(campaign['id_offset'] + int(fingerprint_id))] = location
+
+        return locations
+
+    def load_fingerprint_ids(self, names=None):
+        """Return the sorted global IDs of the fingerprints of the campaigns (all of them if names is None)"""
+        return sorted(map(int, self.load_locations(names).keys()))
+
+    def get_cleaned_filepaths(self, global_id):
+        """Return the filepaths of the cleaned ce, else and info files of the fingerprint {global_id}, within its campaign folder"""
+        campaign, fingerprint_id = self.resolve(global_id)
+        return list_cleaned_filepaths(self.get_folderpath(campaign), fingerprint_id)
+
+    def load_fingerprint(self, global_id, filename=CE_FILENAME, columns=None):
+        """Load one cleaned file of the fingerprint {global_id}, from its campaign folder
+
+        Arguments:
+            global_id {int} -- Global ID of the fingerprint
+            filename {str} -- Which file to load (CE_FILENAME, ELSE_FILENAME or INFO_FILENAME)
+            columns {list of str} -- Columns to load. All of them if None (only those are read from the ce .parquet)
+
+        Returns:
+            [pd.DataFrame]
+        """
+        filepath = self.get_cleaned_filepaths(global_id)[[CE_FILENAME, ELSE_FILENAME, INFO_FILENAME].index(filename)]
+        return load_cleaned_fingerprint(filepath, columns)
+
+
+if __name__ == '__main__':
+    catalog_clickwrapper() # pylint: disable=no-value-for-parameter
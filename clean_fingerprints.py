@@ -2,10 +2,22 @@ import pandas as pd
 import numpy as np
 import shutil
 import click 
+import hashlib
 import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
 from os import listdir 
 from os.path import join, isfile 
 
+from atomic_write import write_atomically
+from instrumentation import measure, profiled, write_records
+from locations_index import load_locations
+
 CE_FOLDERNAME = 'ce'
 CE_FILENAME = 'ce'
 
@@ -16,30 +28,87 @@ INFO_FOLDERNAME = 'info'
 INFO_FILENAME = 'info'
 
 LOCATIONS_FILENAME = 'locations'
+MANIFEST_FILENAME = 'clean_manifest'
+CE_SUMMARY_FILENAME = 'ce_summary'
+ELSE_SUMMARY_FILENAME = 'else_summary'
+
+CLEANER_VERSION = 1 # Bump whenever the cleaned files change, so that the fingerprints cleaned by an older version get recleaned
 
 STOP_SYMBOL = 123
 N_RECORDING_PER_SECOND = 1000
+N_TTIS = 10240 # TTIs wrap around every N_TTIS ms (i.e. 1024 radio frames of 10 subframes)
 N_SUBCARRIERS = 400
+STREAMING_CHUNKSIZE = 64 # Size [MB] of the windows read from ce_N_raw.txt when --streaming is set
+N_PORTS = 4
+ELSE_SUMMARY_COLUMNS = ['RSRP_DBM', 'RSRQ_DB', 'SNR_DB', 'RSSI_DBM'] # columns of else.txt aggregated in {ELSE_SUMMARY_FILENAME}.parquet
+
+CE_DT = np.dtype([('TTI', np.float32), ('SC_ID', np.float32),
+               ('CE_0_AMPLITUDE', np.float32), ('CE_0_PHASE', np.float32), 
+               ('CE_1_AMPLITUDE', np.float32), ('CE_1_PHASE', np.float32), 
+               ('CE_2_AMPLITUDE', np.float32), ('CE_2_PHASE', np.float32), 
+               ('CE_3_AMPLITUDE', np.float32), ('CE_3_PHASE', np.float32),
+               ('STOP', np.float32)])
 
 @click.command()
 @click.option('--src_folderpath', prompt='Folder where the ce, else and info folder are located', default='')
 @click.option('--force', '-f', is_flag=True, help='Whether to reclean already cleaned files')
-def clean_fingerprints(src_folderpath, force):
+@click.option('--streaming', is_flag=True, help='Whether to clean the ce files by chunks, keeping the memory usage flat')
+@click.option('--chunksize', default=STREAMING_CHUNKSIZE, type=float, help='Size [MB] of the chunks read when --streaming is set')
+@click.option('--jobs', '-j', default=1, help='Amount of worker processes cleaning fingerprints in parallel')
+@click.option('--dense', is_flag=True, help='Whether to also save the ce files as dense, memory-mappable .npy arrays')
+@click.option('--profile', is_flag=True, help='Whether to dump a cProfile of the cleaning of each fingerprint')
+def clean_fingerprints(src_folderpath, force, streaming, chunksize, jobs, dense, profile):
     """Load all the fingerprints referenced in {LOCATIONS_FILENAME}.json
     If --force is True, clean all the files from all the fingerprints
-    Else, only clean the files that do not have a "clean" version already
+    Else, only clean the fingerprints whose raw files (or CLEANER_VERSION) changed since they were last cleaned,
+    according to {MANIFEST_FILENAME}.json
+
+    The cleaned files are written atomically, and {MANIFEST_FILENAME}.json is updated after each fingerprint,
+    so that an interrupted run can be resumed safely
 
     Save the cleaned files as
         - .parquet for ce.txt 
         - .pkl for else.txt and info.txt
 
+    If --streaming is set, the ce files are read {chunksize} MB at a time and written as parquet row groups,
+    so that large captures can be cleaned without holding them in memory
+
+    If --jobs is above 1, the fingerprints are spread over a pool of {jobs} processes.
+    Their reports are still printed in ascending fingerprint ID, and a failing fingerprint does not abort the others.
+
+    While cleaning, per-fingerprint features are gathered in two compact tables (see summarize_ce and summarize_else):
+        - {CE_SUMMARY_FILENAME}.parquet: per subcarrier and port, mean amplitude, mean/std amplitude [dB] and circular phase statistics
+        - {ELSE_SUMMARY_FILENAME}.parquet: mean/std/min/max of RSRP, RSRQ, SNR and RSSI
+
+    If --dense is set, the cleaned ce files are also saved as dense arrays (see save_dense_ce), e.g.:
+        - ce_0_raw.txt -> ce_0_csi.npy and ce_0_tti.npy
+
+    The wall time, bytes read/written and peak memory of each stage (e.g. ce_resync, ce_write) of each fingerprint 
+    are appended to instrumentation.jsonl (see instrumentation.py). 
+    If --profile is set, the cleaning of each fingerprint is also profiled to profiles/clean_fingerprint_{ID}.prof
+
     Arguments:
         src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
+        streaming {bool} -- Whether to clean the ce files by chunks
+        chunksize {float} -- Size [MB] of the chunks read when streaming
+        jobs {int} -- Amount of worker processes
+        dense {bool} -- Whether to also save the ce files as dense arrays
+        profile {bool} -- Whether to profile the cleaning of each fingerprint
     """
+    run_fields = {'command': 'clean_fingerprints', 'run_started_at': datetime.now().isoformat(timespec='seconds')}
+    records = []
+    with measure(records, 'total', jobs=jobs, streaming=streaming):
+        reports = clean_fingerprints_measured(src_folderpath, force, streaming, chunksize, jobs, dense, profile, run_fields)
+    records[-1]['n_fingerprints'] = len(reports)
+    write_records(src_folderpath, records, pid=os.getpid(), **run_fields)
+
 
-    src_ce_folderpath = join(src_folderpath, CE_FOLDERNAME)
-    src_else_folderpath = join(src_folderpath, ELSE_FOLDERNAME)
-    src_info_folderpath = join(src_folderpath, INFO_FOLDERNAME)
+def clean_fingerprints_measured(src_folderpath, force, streaming, chunksize, jobs, dense, profile, run_fields):
+    """Body of clean_fingerprints, see its docstring
+
+    Returns:
+        reports [list of dict] -- Reports returned by clean_fingerprint
+    """
 
     # Load fingerprint IDs
     fingerprint_ids = load_fingerprint_ids(src_folderpath, LOCATIONS_FILENAME)
@@ -47,55 +116,327 @@ def clean_fingerprints(src_folderpath, force):
     print('')
     print('Cleaning {} fingerprints\n'.format(len(fingerprint_ids)))
 
+    manifest = load_manifest(src_folderpath)
     if not force:
-        cleaned_fingerprint_ids = get_cleaned_fingerprint_ids(src_ce_folderpath, src_else_folderpath, src_info_folderpath) # get IDs of the fingerprints that already have all three files cleaned
+        cleaned_fingerprint_ids = get_cleaned_fingerprint_ids(src_folderpath, manifest, dense=dense) # get IDs of the fingerprints that are up-to-date in the manifest
+        cleaned_fingerprint_ids = set(cleaned_fingerprint_ids).intersection(*list_summarized_fingerprint_ids(src_folderpath, manifest)) # and summarized (the summaries are only saved at the end of a run)
         print('{}/{} fingerprints already cleaned\n'.format(len(cleaned_fingerprint_ids), len(fingerprint_ids)))
         fingerprint_ids = sorted(list(set(fingerprint_ids) - set(cleaned_fingerprint_ids)))
 
-    for fingerprint_id in fingerprint_ids:
-        print('- Clean fingerprint #{}'.format(fingerprint_id))
+    clean = partial(clean_fingerprint, src_folderpath=src_folderpath, streaming=streaming, chunksize=chunksize, dense=dense, profile=profile)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            reports = report_cleaning(executor.map(clean, fingerprint_ids), src_folderpath, manifest, run_fields) # results are yielded in the order of fingerprint_ids
+    else:
+        reports = report_cleaning(map(clean, fingerprint_ids), src_folderpath, manifest, run_fields)
+
+    save_summaries(src_folderpath, reports)
+    print_cleaning_summary(reports)
+
+    return reports
+
+
+def clean_fingerprint(fingerprint_id, src_folderpath, streaming=False, chunksize=STREAMING_CHUNKSIZE, dense=False, profile=False):
+    """Clean the ce, else and info files of the fingerprint {fingerprint_id}
+
+    Meant to be run in a worker process: nothing is printed, and errors are caught and returned
+    so that one corrupt fingerprint does not abort the others.
+
+    Arguments:
+        fingerprint_id {int} -- ID of the fingerprint to clean
+        src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
+        streaming {bool} -- Whether to clean the ce file by chunks
+        chunksize {float} -- Size [MB] of the chunks read when streaming
+        dense {bool} -- Whether to also save the ce file as dense arrays
+        profile {bool} -- Whether to profile the cleaning to profiles/clean_fingerprint_{fingerprint_id}.prof
+
+    Returns:
+        report [dict] -- fingerprint_id, pid of the worker, lines to print, bytes read, elapsed time [s], 
+                         manifest entry of the cleaned files, summaries of the ce and else files, 
+                         instrumentation records and error (None if successful)
+    """
+    report = {'fingerprint_id': fingerprint_id, 'pid': os.getpid(), 'lines': [], 'n_bytes': 0, 'elapsed_time': 0.0, 
+              'files': {}, 'summaries': {}, 'records': [], 'error': None}
+    start_time = time.perf_counter()
+
+    with profiled(src_folderpath, 'clean_fingerprint_{}'.format(fingerprint_id), enabled=profile):
+        clean_fingerprint_files(fingerprint_id, src_folderpath, streaming, chunksize, dense, report)
+
+    report['elapsed_time'] = time.perf_counter() - start_time
+    return report
+
+
+def clean_fingerprint_files(fingerprint_id, src_folderpath, streaming, chunksize, dense, report):
+    """Body of clean_fingerprint, filling report in-place and measuring each stage in report['records']"""
+    records = report['records']
+    try:
+        for foldername, filename in [(CE_FOLDERNAME, CE_FILENAME), (ELSE_FOLDERNAME, ELSE_FILENAME), (INFO_FOLDERNAME, INFO_FILENAME)]:
+            src_filename = '{}_{}_raw.txt'.format(filename, fingerprint_id)
+            dest_filename = '{}_{}.{}'.format(filename, fingerprint_id, 'parquet' if filename == CE_FILENAME else 'pkl')
+
+            src_filepath = join(src_folderpath, foldername, src_filename)
+            dest_filepath = join(src_folderpath, foldername, dest_filename)
+
+            report['lines'].append('\t {} -> '.format(src_filename))
+            with measure(records, '{}_hash'.format(filename), fingerprint_id=fingerprint_id):
+                raw_file = describe_raw_file(src_filepath) # described before cleaning, so that a concurrent change gets it recleaned next time
+            report['n_bytes'] += raw_file['size']
+
+            if filename == CE_FILENAME and streaming:
+                with measure(records, 'ce_clean_streaming', fingerprint_id=fingerprint_id):
+                    write_atomically(dest_filepath, lambda filepath: clean_ce_streaming(ce_filepath=src_filepath, dest_filepath=filepath, chunksize=chunksize)) # Clean ce_id_raw.txt chunk by chunk
+                with measure(records, 'ce_summarize', fingerprint_id=fingerprint_id):
+                    ce_batches = (batch.to_pandas() for batch in pq.ParquetFile(dest_filepath).iter_batches(columns=list(CE_DT.names[1:-1]))) # summarize it batch by batch as well
+                    report['summaries'][CE_SUMMARY_FILENAME] = summarize_ce(ce_batches, fingerprint_id)
+            elif filename == CE_FILENAME:
+                with measure(records, 'ce_read', fingerprint_id=fingerprint_id):
+                    ce_data_1d = load_raw_ce(ce_filepath=src_filepath)
+                with measure(records, 'ce_resync', fingerprint_id=fingerprint_id): # Clean ce_id_raw.txt
+                    ce_df = to_clean_ce_df(resync_ce(ce_data_1d))
+                    del ce_data_1d
+                with measure(records, 'ce_write', fingerprint_id=fingerprint_id):
+                    write_atomically(dest_filepath, lambda filepath: ce_df.to_parquet(filepath, index=False, compression='gzip'))
+                with measure(records, 'ce_summarize', fingerprint_id=fingerprint_id):
+                    report['summaries'][CE_SUMMARY_FILENAME] = summarize_ce([ce_df], fingerprint_id)
+            elif filename == ELSE_FILENAME:
+                with measure(records, 'else_clean', fingerprint_id=fingerprint_id):
+                    else_df = clean_else(else_filepath=src_filepath) # Clean else_id_raw.txt
+                with measure(records, 'else_write', fingerprint_id=fingerprint_id):
+                    write_atomically(dest_filepath, else_df.to_pickle)
+                with measure(records, 'else_summarize', fingerprint_id=fingerprint_id):
+                    report['summaries'][ELSE_SUMMARY_FILENAME] = summarize_else(else_df, fingerprint_id)
+            else:
+                with measure(records, 'info_clean', fingerprint_id=fingerprint_id):
+                    info_df = clean_info(info_filepath=src_filepath) # Clean info_id_raw.txt
+                with measure(records, 'info_write', fingerprint_id=fingerprint_id):
+                    write_atomically(dest_filepath, info_df.to_pickle)
+
+            report['files'][filename] = {'raw': raw_file, 'cleaned': dest_filename}
+            report['lines'][-1] += dest_filename
+
+            if filename == CE_FILENAME and dense:
+                with measure(records, 'ce_dense', fingerprint_id=fingerprint_id):
+                    if streaming: # the cleaned ce is not held in memory: fill the arrays batch by batch
+                        report['files'][filename]['dense'] = save_dense_ce_streaming(dest_filepath, join(src_folderpath, foldername), fingerprint_id)
+                    else:
+                        report['files'][filename]['dense'] = save_dense_ce(ce_df, join(src_folderpath, foldername), fingerprint_id)
+                report['lines'][-1] += ', ' + ', '.join(report['files'][filename]['dense'])
+    except Exception as e: # pylint: disable=broad-except
+        report['error'] = '{}: {}'.format(type(e).__name__, e)
+        report['lines'][-1] += 'FAILED ({})'.format(report['error'])
+
+
+def report_cleaning(reports, src_folderpath, manifest, run_fields):
+    """Print the reports of clean_fingerprint as they come, record the successful ones in the manifest, and return them
+
+    Arguments:
+        reports {iterable of dict} -- Reports returned by clean_fingerprint, in ascending fingerprint ID
+        src_folderpath {str} -- Folder holding {MANIFEST_FILENAME}.json
+        manifest {dict} -- Manifest loaded with load_manifest, updated in-place
+        run_fields {dict} -- Fields added to the instrumentation records of the reports
+
+    Returns:
+        [list of dict] -- The reports
+    """
+    printed_reports = []
+    for report in reports:
+        print('- Clean fingerprint #{}'.format(report['fingerprint_id']))
+        print('\n'.join(report['lines']), '\n')
+        printed_reports.append(report)
+        record_report(report, src_folderpath, manifest, run_fields)
+
+    return printed_reports
+
+
+def record_report(report, src_folderpath, manifest, run_fields):
+    """Record the report of clean_fingerprint in the manifest (if successful), then save the manifest and the report's instrumentation records
+
+    Arguments:
+        report {dict} -- Report returned by clean_fingerprint
+        src_folderpath {str} -- Folder holding {MANIFEST_FILENAME}.json
+        manifest {dict} -- Manifest loaded with load_manifest, updated in-place
+        run_fields {dict} -- Fields added to the instrumentation records of the report
+    """
+    if report['error'] is None:
+        manifest[str(report['fingerprint_id'])] = {'cleaner_version': CLEANER_VERSION, 'files': report['files']}
+    else:
+        manifest.pop(str(report['fingerprint_id']), None)
+    save_manifest(src_folderpath, manifest)
+    write_records(src_folderpath, report['records'], pid=report['pid'], **run_fields)
+
+
+def print_cleaning_summary(reports):
+    """Print the failed fingerprints, and the throughput of each worker process
+
+    Arguments:
+        reports {list of dict} -- Reports returned by clean_fingerprint
+    """
+    failed_reports = [report for report in reports if report['error'] is not None]
+    print('{}/{} fingerprints cleaned'.format(len(reports) - len(failed_reports), len(reports)))
+    if failed_reports:
+        print('\nFailed fingerprints:')
+        for report in failed_reports:
+            print('\t #{}: {}'.format(report['fingerprint_id'], report['error']))
+
+    if not reports:
+        return
+
+    print('\nThroughput per worker:')
+    pids = list(dict.fromkeys(report['pid'] for report in reports if report['pid'] is not None)) # workers ordered by the first fingerprint they cleaned
+    for worker_idx, pid in enumerate(pids):
+        worker_reports = [report for report in reports if report['pid'] == pid]
+        n_bytes = sum(report['n_bytes'] for report in worker_reports)
+        elapsed_time = sum(report['elapsed_time'] for report in worker_reports)
+        print('\t Worker #{}: {} fingerprints, {:.2f} MB in {:.2f}s ({:.2f} MB/s)'.format(
+            worker_idx, len(worker_reports), n_bytes / 1e6, elapsed_time, n_bytes / 1e6 / max(elapsed_time, 1e-9)))
+
+
+def summarize_ce(ce_batches, fingerprint_id):
+    """Summarize a cleaned ce, per subcarrier and port, over all its TTIs
+
+    The ce can be given in several batches of rows, only one of them being held in memory at a time.
+
+    Arguments:
+        ce_batches {iterable of pd.DataFrame} -- Batches of rows of the cleaned ce, as returned by clean_ce
+        fingerprint_id {int} -- ID of the fingerprint, added as a column
+
+    Returns:
+        [pd.DataFrame] -- One row per (SC_ID, PORT), with the columns
+            - N: amount of records with a finite amplitude [dB] and phase
+            - AMPLITUDE_MEAN: mean of the (linear) amplitude, over the same N records
+            - AMPLITUDE_DB_MEAN, AMPLITUDE_DB_STD: mean and std (ddof=1) of 20*log10(amplitude)
+            - PHASE_MEAN: circular mean of the phase [rad]
+            - PHASE_RESULTANT_LENGTH: mean resultant length of the phase, in [0, 1]
+            - PHASE_STD: circular std of the phase, i.e. sqrt(-2*log(PHASE_RESULTANT_LENGTH))
+    """
+    sums = None
+    for ce_df in ce_batches:
+        batch_sums = sum_ce_features(ce_df)
+        sums = batch_sums if sums is None else sums.add(batch_sums, fill_value=0)
+
+    if sums is None:
+        sums = sum_ce_features(to_clean_ce_df(np.empty((0, len(CE_DT.names) - 1))))
+
+    summary_df = pd.DataFrame(index=sums.index)
+    summary_df['N'] = sums.N.astype(np.int64)
+    summary_df['AMPLITUDE_MEAN'] = sums.SUM_AMPLITUDE / sums.N
+    summary_df['AMPLITUDE_DB_MEAN'] = sums.SUM_DB / sums.N
+    summary_df['AMPLITUDE_DB_STD'] = np.sqrt(((sums.SUM_DB2 - sums.SUM_DB**2 / sums.N) / (sums.N - 1)).clip(lower=0).where(sums.N > 1))
+    summary_df['PHASE_MEAN'] = np.arctan2(sums.SUM_SIN, sums.SUM_COS)
+    summary_df['PHASE_RESULTANT_LENGTH'] = np.hypot(sums.SUM_SIN, sums.SUM_COS) / sums.N
+    summary_df['PHASE_STD'] = np.sqrt(-2 * np.log(summary_df.PHASE_RESULTANT_LENGTH.clip(upper=1)))
 
-        # Clean and save ce_{id}_raw.txt
-        src_ce_filename = '{}_{}_raw.txt'.format(CE_FILENAME, fingerprint_id)
-        dest_ce_filename = '{}_{}.parquet'.format(CE_FILENAME, fingerprint_id)
+    summary_df = summary_df.reset_index()
+    summary_df.insert(0, 'FINGERPRINT_ID', np.int64(fingerprint_id))
 
-        src_ce_filepath = join(src_ce_folderpath, src_ce_filename)
-        dest_ce_filepath = join(src_ce_folderpath, dest_ce_filename)
+    return summary_df
+
+
+def sum_ce_features(ce_df):
+    """Return the sums needed by summarize_ce, per (SC_ID, PORT), for a batch of rows of a cleaned ce"""
+    sums_dfs = []
+    for port in range(N_PORTS):
+        amplitude = ce_df['CE_{}_AMPLITUDE'.format(port)].to_numpy(np.float64)
+        amplitude_db = 20 * np.log10(amplitude)
+        phase = ce_df['CE_{}_PHASE'.format(port)].to_numpy(np.float64)
+        is_valid = np.isfinite(amplitude_db) & np.isfinite(phase)
+
+        sums_dfs.append(pd.DataFrame({'SC_ID': ce_df.SC_ID.to_numpy(np.int64)[is_valid],
+                                      'PORT': np.int64(port),
+                                      'N': np.float64(1),
+                                      'SUM_AMPLITUDE': amplitude[is_valid],
+                                      'SUM_DB': amplitude_db[is_valid],
+                                      'SUM_DB2': amplitude_db[is_valid]**2,
+                                      'SUM_COS': np.cos(phase[is_valid]),
+                                      'SUM_SIN': np.sin(phase[is_valid])}))
+
+    return pd.concat(sums_dfs).groupby(['SC_ID', 'PORT']).sum()
+
+
+def summarize_else(else_df, fingerprint_id):
+    """Summarize a cleaned else over all its TTIs
+
+    Arguments:
+        else_df {pd.DataFrame} -- Cleaned else, as returned by clean_else
+        fingerprint_id {int} -- ID of the fingerprint, added as a column
+
+    Returns:
+        [pd.DataFrame] -- A single row, with N_TTI and the mean/std/min/max of each of ELSE_SUMMARY_COLUMNS (e.g. RSRP_DBM_MEAN)
+    """
+    values_df = else_df[ELSE_SUMMARY_COLUMNS].astype(np.float64).replace([np.inf, -np.inf], np.nan)
 
-        print('\t {} -> '.format(src_ce_filename), end='')
-        ce_df = clean_ce(ce_filepath=src_ce_filepath) # Clean ce_id_raw.txt
-        ce_df.to_parquet(dest_ce_filepath, index=False, compression='gzip')
-        print(dest_ce_filename)
+    summary = {'FINGERPRINT_ID': np.int64(fingerprint_id), 'N_TTI': np.int64(len(else_df))}
+    for column in ELSE_SUMMARY_COLUMNS:
+        for stat in ['mean', 'std', 'min', 'max']:
+            summary['{}_{}'.format(column, stat.upper())] = getattr(values_df[column], stat)()
 
-        
-        # Clean and save else_{id}_raw.txt
-        src_else_filename = '{}_{}_raw.txt'.format(ELSE_FILENAME, fingerprint_id)
-        dest_else_filename = '{}_{}.pkl'.format(ELSE_FILENAME, fingerprint_id)
+    return pd.DataFrame([summary])
 
-        src_else_filepath = join(src_else_folderpath, src_else_filename)
-        dest_else_filepath = join(src_else_folderpath, dest_else_filename)
 
-        print('\t {} -> '.format(src_else_filename), end='')
-        else_df = clean_else(else_filepath=src_else_filepath) # Clean else_id_raw.txt
-        else_df.to_pickle(dest_else_filepath)
-        print(dest_else_filename)
+def load_summary(src_folderpath, summary_filename):
+    """Load {summary_filename}.parquet (i.e. {CE_SUMMARY_FILENAME} or {ELSE_SUMMARY_FILENAME}), None if it does not exist yet"""
+    summary_filepath = join(src_folderpath, '{}.parquet'.format(summary_filename))
+    if not isfile(summary_filepath):
+        return None
 
+    return pd.read_parquet(summary_filepath)
 
-        # Clean and save info_{id}_raw.txt
-        src_info_filename = '{}_{}_raw.txt'.format(INFO_FILENAME, fingerprint_id)
-        dest_info_filename = '{}_{}.pkl'.format(INFO_FILENAME, fingerprint_id)
 
-        src_info_filepath = join(src_info_folderpath, src_info_filename)
-        dest_info_filepath = join(src_info_folderpath, dest_info_filename)
+def list_summarized_fingerprint_ids(src_folderpath, manifest=None):
+    """Return the sets of fingerprint IDs found in {CE_SUMMARY_FILENAME}.parquet and {ELSE_SUMMARY_FILENAME}.parquet,
+    along with the ones whose summary is empty according to the manifest (see save_summaries)"""
+    summarized_fingerprint_ids = []
+    for summary_filename in [CE_SUMMARY_FILENAME, ELSE_SUMMARY_FILENAME]:
+        summary_filepath = join(src_folderpath, '{}.parquet'.format(summary_filename))
+        if isfile(summary_filepath):
+            summarized_fingerprint_ids.append(set(pd.read_parquet(summary_filepath, columns=['FINGERPRINT_ID']).FINGERPRINT_ID.tolist()))
+        else:
+            summarized_fingerprint_ids.append(set())
+        summarized_fingerprint_ids[-1].update(int(fingerprint_id) for fingerprint_id, entry in (manifest or {}).items()
+                                              if summary_filename in entry.get('empty_summaries', []))
 
-        print('\t {} -> '.format(src_info_filename), end='')
-        info_df = clean_info(info_filepath=src_info_filepath) # Clean info_id_raw.txt
-        info_df.to_pickle(dest_info_filepath)
-        print(dest_info_filename, '\n')
+    return summarized_fingerprint_ids
+
+
+def save_summaries(src_folderpath, reports):
+    """Update {CE_SUMMARY_FILENAME}.parquet and {ELSE_SUMMARY_FILENAME}.parquet with the summaries of the reports
+
+    The previous rows of the reported fingerprints (successful or not) are replaced. A successful fingerprint without any summary row
+    (e.g. an empty ce, or one without any finite amplitude) has its empty summaries listed in {MANIFEST_FILENAME}.json,
+    so that it is not recleaned at each run for missing from them.
+
+    Arguments:
+        src_folderpath {str} -- Folder holding the summaries
+        reports {list of dict} -- Reports returned by clean_fingerprint
+    """
+    reported_fingerprint_ids = [report['fingerprint_id'] for report in reports]
+    for summary_filename in [CE_SUMMARY_FILENAME, ELSE_SUMMARY_FILENAME]:
+        summary_dfs = [report['summaries'][summary_filename] for report in reports
+                       if report['error'] is None and summary_filename in report['summaries']]
+
+        summary_df = load_summary(src_folderpath, summary_filename)
+        if summary_df is not None:
+            summary_dfs.insert(0, summary_df[~summary_df.FINGERPRINT_ID.isin(reported_fingerprint_ids)])
+
+        if not summary_dfs:
+            continue
+
+        summary_df = pd.concat(summary_dfs, ignore_index=True).sort_values(['FINGERPRINT_ID'], kind='stable').reset_index(drop=True)
+        write_atomically(join(src_folderpath, '{}.parquet'.format(summary_filename)), lambda filepath: summary_df.to_parquet(filepath, index=False))
+
+    empty_summaries = {str(report['fingerprint_id']): [summary_filename for summary_filename, summary_df in report['summaries'].items() if summary_df.empty]
+                       for report in reports if report['error'] is None}
+    empty_summaries = {fingerprint_id: summary_filenames for fingerprint_id, summary_filenames in empty_summaries.items() if summary_filenames}
+    if empty_summaries:
+        manifest = load_manifest(src_folderpath) # as saved by record_report after each fingerprint
+        for fingerprint_id, summary_filenames in empty_summaries.items():
+            if fingerprint_id in manifest:
+                manifest[fingerprint_id]['empty_summaries'] = summary_filenames
+        save_manifest(src_folderpath, manifest)
 
 
 def load_fingerprint_ids(src_folderpath, location_filename):
-    """Load the fingerprint IDs located in src_folderpath/location_filename.JSON
+    """Load the fingerprint IDs located in src_folderpath/location_filename.JSON (and its journal, see load_locations)
 
     Arguments:
         src_folderpath {str} -- Path to the folder holding the location_filename
@@ -105,67 +446,196 @@ def load_fingerprint_ids(src_folderpath, location_filename):
         fingerprint_ids [list] -- Sorted (ascending) list of the fingerprint IDs located in src_folderpath/location_filename.JSON
     """
 
-    locations_filepath = join(src_folderpath, '{}.json'.format(LOCATIONS_FILENAME))
-    fingerprint_ids = []
-    
-    with open(locations_filepath, 'r') as fp:
-        locations = json.load(fp)
-        fingerprint_ids = sorted(map(int, list(locations.keys())))
+    locations = load_locations(src_folderpath, location_filename)
+    fingerprint_ids = sorted(map(int, list(locations.keys())))
 
     return fingerprint_ids
 
 
-def get_cleaned_fingerprint_ids(ce_folderpath, else_folderpath, info_folderpath):
-    """Return the fingerprints IDs of the fingerprints that have all three files cleaned (ce, else and info)
+def get_cleaned_fingerprint_ids(src_folderpath, manifest, dense=False):
+    """Return the fingerprints IDs of the fingerprints that are up-to-date in the manifest
+
+    That is, cleaned by the current CLEANER_VERSION, with all three cleaned files (ce, else and info) present,
+    and with raw files that did not change since. A raw file whose size or mtime changed is hashed, so that a file 
+    which was only touched is not recleaned (its mtime is then updated in the manifest).
 
     Arguments:
-        ce_folderpath {str} -- Path to the folder holding the cleaned ce files (.parquet)
-        else_folderpath {str} -- Path to the folder holding the cleaned else files (.pkl)
-        info_folderpath {str} -- Path to the folder holding the cleaned info files (.pkl)
+        src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
+        manifest {dict} -- Manifest loaded with load_manifest
+        dense {bool} -- Whether the dense ce arrays are required as well
 
     Returns:
-        [list] -- [Fingerprints IDs of the fingerprints that have all three files cleaned (ce, else and info)]
+        [list] -- [Fingerprints IDs of the up-to-date fingerprints]
     """
-    cleaned_ce_files = [f.split('.')[0] for f in listdir(ce_folderpath) if f.split('.')[-1] == 'parquet'] # list all .parquet file in ce_folderpath
-    cleaned_ce_fingerprint_ids = [f.split('_')[-1] for f in cleaned_ce_files] # extract fingerprint ID from .parquet filename (e.g ce_123 --> 123)
+    cleaned_fingerprint_ids = []
+    for fingerprint_id, entry in manifest.items():
+        if entry['cleaner_version'] != CLEANER_VERSION:
+            continue
+
+        is_up_to_date = True
+        for foldername, filename in [(CE_FOLDERNAME, CE_FILENAME), (ELSE_FOLDERNAME, ELSE_FILENAME), (INFO_FOLDERNAME, INFO_FILENAME)]:
+            if filename not in entry['files'] or (dense and filename == CE_FILENAME and 'dense' not in entry['files'][filename]):
+                is_up_to_date = False
+                break
+
+            raw_filepath = join(src_folderpath, foldername, '{}_{}_raw.txt'.format(filename, fingerprint_id))
+            cleaned_filenames = [entry['files'][filename]['cleaned']] + entry['files'][filename].get('dense', [])
+            if not isfile(raw_filepath) or not all(isfile(join(src_folderpath, foldername, f)) for f in cleaned_filenames):
+                is_up_to_date = False
+                break
+
+            raw_file = entry['files'][filename]['raw']
+            stat = os.stat(raw_filepath)
+            if (stat.st_size, stat.st_mtime) == (raw_file['size'], raw_file['mtime']):
+                continue
+            if stat.st_size != raw_file['size'] or hash_file(raw_filepath) != raw_file['sha256']:
+                is_up_to_date = False
+                break
+            raw_file['mtime'] = stat.st_mtime # only touched: avoid rehashing it next time the manifest is saved
+
+        if is_up_to_date:
+            cleaned_fingerprint_ids.append(int(fingerprint_id))
+
+    return cleaned_fingerprint_ids
+
+
+def load_manifest(src_folderpath):
+    """Load {MANIFEST_FILENAME}.json, mapping each cleaned fingerprint ID to the CLEANER_VERSION used,
+    and to the size, mtime and sha256 of its raw files
 
-    cleaned_else_files = [f.split('.')[0] for f in listdir(else_folderpath) if f.split('.')[-1] == 'pkl'] # list all .pkl file in else_folderpath
-    cleaned_else_fingerprint_ids = [f.split('_')[-1] for f in cleaned_else_files] # extract fingerprint ID from .parquet filename (e.g else_123 --> 123)
-    
-    cleaned_info_files = [f.split('.')[0] for f in listdir(info_folderpath) if f.split('.')[-1] == 'pkl'] # list all .pkl file in info_folderpath
-    cleaned_info_fingerprint_ids = [f.split('_')[-1] for f in cleaned_info_files] # extract fingerprint ID from .parquet filename (e.g info_123 --> 123)
+    Arguments:
+        src_folderpath {str} -- Folder holding {MANIFEST_FILENAME}.json
 
-    return list(map(int, set(cleaned_ce_fingerprint_ids).intersection(set(cleaned_else_fingerprint_ids)).intersection(set(cleaned_info_fingerprint_ids))))
+    Returns:
+        manifest [dict] -- Empty if {MANIFEST_FILENAME}.json does not exist yet
+    """
+    manifest_filepath = join(src_folderpath, '{}.json'.format(MANIFEST_FILENAME))
+    if not isfile(manifest_filepath):
+        return {}
+
+    with open(manifest_filepath, 'r') as fp:
+        return json.load(fp)
+
+
+def save_manifest(src_folderpath, manifest):
+    """Atomically save the manifest to {MANIFEST_FILENAME}.json
+
+    Arguments:
+        src_folderpath {str} -- Folder holding {MANIFEST_FILENAME}.json
+        manifest {dict} -- Manifest to save
+    """
+    def dump(filepath):
+        with open(filepath, 'w') as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+
+    write_atomically(join(src_folderpath, '{}.json'.format(MANIFEST_FILENAME)), dump)
+
+
+def describe_raw_file(filepath):
+    """Return the size [B], mtime and sha256 of filepath, as stored in the manifest"""
+    stat = os.stat(filepath)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': hash_file(filepath)}
+
+
+def hash_file(filepath, blocksize=2**20):
+    """Return the hex sha256 of filepath, read {blocksize} B at a time"""
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as fp:
+        for block in iter(lambda: fp.read(blocksize), b''):
+            sha256.update(block)
+
+    return sha256.hexdigest()
 
 
 def clean_ce(ce_filepath):
-    ce_dt = np.dtype([('TTI', np.float32), ('SC_ID', np.float32),
-               ('CE_0_AMPLITUDE', np.float32), ('CE_0_PHASE', np.float32), 
-               ('CE_1_AMPLITUDE', np.float32), ('CE_1_PHASE', np.float32), 
-               ('CE_2_AMPLITUDE', np.float32), ('CE_2_PHASE', np.float32), 
-               ('CE_3_AMPLITUDE', np.float32), ('CE_3_PHASE', np.float32),
-               ('STOP', np.float32)])
+    """Load the raw ce file and only keep the records whose framing is intact
 
-    ce_data = np.fromfile(ce_filepath, dtype=ce_dt)
-    ce_df = pd.DataFrame(ce_data)
+    Arguments:
+        ce_filepath {str} -- Path to the raw ce file (e.g. ce_0_raw.txt)
+
+    Returns:
+        clean_ce_df [pd.DataFrame] -- One row per (TTI, SC_ID), without the STOP column
+    """
+    ce_data_1d = load_raw_ce(ce_filepath)
 
     # Clean the dataset because of recording errors
-    ce_data_1d = ce_df.values.reshape((-1,))
+    cleaned_ce_data = resync_ce(ce_data_1d)
+
+    return to_clean_ce_df(cleaned_ce_data)
+
 
-    n_rows = (ce_data_1d == STOP_SYMBOL).sum() # 1 row per occurence of STOP_SYMBOL
-    cleaned_ce_data = np.full((n_rows, ce_df.shape[1] - 1), fill_value=np.nan) # minus 1 since we discard the STOP column
+def load_raw_ce(ce_filepath):
+    """Load the raw ce file as a flat float32 array, dropping the trailing bytes of an incomplete record"""
+    ce_data = np.fromfile(ce_filepath, dtype=CE_DT)
+    return ce_data.view(np.float32).reshape((-1,))
 
-    row_idx = 0
-    column_idx = 0
-    for i, e in enumerate(ce_data_1d):
-        column_idx += 1
-        if e == STOP_SYMBOL:
-            if column_idx == 11:
-                cleaned_ce_data[row_idx, :] = ce_data_1d[i-10:i]
-                row_idx += 1
-            column_idx = 0
 
-    clean_ce_df = pd.DataFrame(cleaned_ce_data, columns=ce_dt.names[:-1]).dropna()
+def clean_ce_streaming(ce_filepath, dest_filepath, chunksize=STREAMING_CHUNKSIZE):
+    """Clean the raw ce file {chunksize} MB at a time, and write each cleaned chunk as a row group of dest_filepath
+
+    The raw file is memory-mapped, and the floats following the last STOP_SYMBOL of a chunk are carried over to the next one,
+    so that the output is identical to clean_ce's while the memory usage stays bounded by {chunksize}.
+
+    Arguments:
+        ce_filepath {str} -- Path to the raw ce file (e.g. ce_0_raw.txt)
+        dest_filepath {str} -- Path to the cleaned .parquet file
+        chunksize {float} -- Size [MB] of the chunks read from ce_filepath
+
+    Returns:
+        n_rows [int] -- Amount of rows written to dest_filepath
+    """
+    n_fields = len(CE_DT.names)
+    n_floats = (os.stat(ce_filepath).st_size // CE_DT.itemsize) * n_fields # only consider complete records, like np.fromfile does
+    n_floats_per_chunk = max(int(chunksize * 1e6 / 4), n_fields)
+
+    schema = pa.Schema.from_pandas(to_clean_ce_df(np.empty((0, n_fields - 1))), preserve_index=False)
+
+    n_rows = 0
+    tail_length = 0 # amount of floats following the last STOP_SYMBOL read so far
+    carry = np.empty(0, dtype=np.float32) # those floats, as long as they can still be the beginning of an intact record
+    with pq.ParquetWriter(dest_filepath, schema, compression='gzip') as writer:
+        if n_floats == 0:
+            return n_rows
+
+        ce_data_1d = np.memmap(ce_filepath, dtype=np.float32, mode='r', shape=(n_floats,))
+        for start in range(0, n_floats, n_floats_per_chunk):
+            chunk = np.array(ce_data_1d[start:start + n_floats_per_chunk])
+
+            if tail_length < n_fields:
+                chunk = np.concatenate((carry, chunk))
+                previous_stop_idx = -1
+            else: # too long to be the beginning of an intact record, only its length matters
+                previous_stop_idx = -tail_length - 1
+
+            cleaned_ce_data = resync_ce(chunk, n_fields=n_fields, previous_stop_idx=previous_stop_idx)
+            clean_ce_df = to_clean_ce_df(cleaned_ce_data)
+            writer.write_table(pa.Table.from_pandas(clean_ce_df, schema=schema, preserve_index=False))
+            n_rows += len(clean_ce_df)
+
+            stop_idx = np.flatnonzero(chunk == STOP_SYMBOL)
+            if len(stop_idx) > 0:
+                tail_length = len(chunk) - stop_idx[-1] - 1
+            elif previous_stop_idx == -1:
+                tail_length = len(chunk)
+            else:
+                tail_length += len(chunk)
+            carry = chunk[len(chunk) - tail_length:] if tail_length < n_fields else np.empty(0, dtype=np.float32)
+
+        del ce_data_1d
+
+    return n_rows
+
+
+def to_clean_ce_df(cleaned_ce_data):
+    """Wrap the intact ce records into a DataFrame, dropping the ones holding NaNs
+
+    Arguments:
+        cleaned_ce_data {np.ndarray} -- Array of shape [n_records, 10], as returned by resync_ce
+
+    Returns:
+        clean_ce_df [pd.DataFrame] -- One row per (TTI, SC_ID), without the STOP column
+    """
+    clean_ce_df = pd.DataFrame(cleaned_ce_data.astype(np.float64), columns=CE_DT.names[:-1]).dropna()
 
     # Convert to appropriate types
     for column in ['TTI', 'SC_ID']:
@@ -174,6 +644,138 @@ def clean_ce(ce_filepath):
     return clean_ce_df
 
 
+def resync_ce(ce_data_1d, n_fields=11, previous_stop_idx=-1):
+    """Resynchronize a flat stream of ce floats on STOP_SYMBOL
+
+    A record is kept only if exactly {n_fields}-1 values separate its STOP_SYMBOL from the previous one
+    (or from the start of the stream), which is what the recording is supposed to produce.
+
+    Arguments:
+        ce_data_1d {np.ndarray} -- Flat float32 array, as written by srsue in ce.txt
+        n_fields {int} -- Amount of fields in a record, STOP included
+        previous_stop_idx {int} -- Index (relative to ce_data_1d) of the STOP_SYMBOL preceding the stream
+
+    Returns:
+        [np.ndarray] -- Array of shape [n_intact_records, n_fields-1] holding the intact records (STOP discarded)
+    """
+    stop_idx = np.flatnonzero(ce_data_1d == STOP_SYMBOL)
+    previous_stop_idx = np.concatenate(([previous_stop_idx], stop_idx[:-1])) # by default, the stream starts as if a STOP_SYMBOL preceded it
+    intact_stop_idx = stop_idx[stop_idx - previous_stop_idx == n_fields]
+
+    return ce_data_1d[intact_stop_idx[:, None] + np.arange(-(n_fields - 1), 0)]
+
+
+def to_dense_ce(ce_df, n_subcarriers=N_SUBCARRIERS):
+    """Convert a cleaned ce DataFrame (one row per (TTI, SC_ID)) to a dense array
+
+    Arguments:
+        ce_df {pd.DataFrame} -- Cleaned ce, as returned by clean_ce
+        n_subcarriers {int} -- Amount of subcarriers. Rows with an SC_ID outside of [0, n_subcarriers) are discarded
+
+    Returns:
+        csi [np.ndarray] -- float32 array of shape [n_TTIs, n_subcarriers, N_PORTS, 2], the last axis being (amplitude, phase).
+                            NaN where a (TTI, SC_ID) was not recorded
+        ttis [np.ndarray] -- int64 array of shape [n_TTIs], the sorted TTIs indexing the first axis of csi
+    """
+    ce_df = ce_df[(ce_df.SC_ID >= 0) & (ce_df.SC_ID < n_subcarriers)]
+
+    ttis, tti_idx = np.unique(ce_df.TTI.to_numpy(np.int64), return_inverse=True)
+    csi = np.full((len(ttis), n_subcarriers, N_PORTS, 2), np.nan, dtype=np.float32)
+    csi[tti_idx, ce_df.SC_ID.to_numpy(np.int64)] = ce_df[list(CE_DT.names[2:-1])].to_numpy(np.float32).reshape((-1, N_PORTS, 2))
+
+    return csi, ttis
+
+
+def save_dense_ce(ce_df, ce_folderpath, fingerprint_id):
+    """Save the cleaned ce of the fingerprint {fingerprint_id} as two .npy files (see to_dense_ce):
+        - {CE_FILENAME}_{fingerprint_id}_csi.npy
+        - {CE_FILENAME}_{fingerprint_id}_tti.npy
+
+    Arguments:
+        ce_df {pd.DataFrame} -- Cleaned ce, as returned by clean_ce
+        ce_folderpath {str} -- Folder where to save the .npy files
+        fingerprint_id {int} -- ID of the fingerprint
+
+    Returns:
+        [list of str] -- Filenames of the saved .npy files
+    """
+    dense_filenames = []
+    for array, suffix in zip(to_dense_ce(ce_df), ['csi', 'tti']):
+        dense_filename = '{}_{}_{}.npy'.format(CE_FILENAME, fingerprint_id, suffix)
+
+        def save(filepath, array=array):
+            with open(filepath, 'wb') as fp: # np.save would append .npy to the temporary filepath
+                np.save(fp, array)
+
+        write_atomically(join(ce_folderpath, dense_filename), save)
+        dense_filenames.append(dense_filename)
+
+    return dense_filenames
+
+
+def save_dense_ce_streaming(ce_filepath, ce_folderpath, fingerprint_id, n_subcarriers=N_SUBCARRIERS):
+    """Save the cleaned ce .parquet ce_filepath as the same two .npy files as save_dense_ce, without loading it in memory
+
+    The .parquet is read twice, batch by batch: once for its TTIs, then to fill the csi array, memory-mapped on its .npy file.
+
+    Arguments:
+        ce_filepath {str} -- Filepath of the cleaned ce .parquet (e.g. written by clean_ce_streaming)
+        ce_folderpath {str} -- Folder where to save the .npy files
+        fingerprint_id {int} -- ID of the fingerprint
+        n_subcarriers {int} -- Amount of subcarriers. Rows with an SC_ID outside of [0, n_subcarriers) are discarded
+
+    Returns:
+        [list of str] -- Filenames of the saved .npy files
+    """
+    def iter_batches(columns):
+        for batch in pq.ParquetFile(ce_filepath).iter_batches(columns=columns):
+            ce_df = batch.to_pandas()
+            yield ce_df[(ce_df.SC_ID >= 0) & (ce_df.SC_ID < n_subcarriers)]
+
+    ttis = np.unique(np.concatenate([np.unique(ce_df.TTI.to_numpy(np.int64)) for ce_df in iter_batches(['TTI', 'SC_ID'])] + [np.empty(0, np.int64)]))
+
+    def save_csi(filepath):
+        csi = np.lib.format.open_memmap(filepath, mode='w+', dtype=np.float32, shape=(len(ttis), n_subcarriers, N_PORTS, 2))
+        csi[:] = np.nan
+        for ce_df in iter_batches(list(CE_DT.names[:-1])):
+            csi[np.searchsorted(ttis, ce_df.TTI.to_numpy(np.int64)), ce_df.SC_ID.to_numpy(np.int64)] = ce_df[list(CE_DT.names[2:-1])].to_numpy(np.float32).reshape((-1, N_PORTS, 2))
+        csi.flush()
+        del csi
+
+    def save_ttis(filepath):
+        with open(filepath, 'wb') as fp: # np.save would append .npy to the temporary filepath
+            np.save(fp, ttis)
+
+    dense_filenames = []
+    for save, suffix in [(save_csi, 'csi'), (save_ttis, 'tti')]:
+        dense_filename = '{}_{}_{}.npy'.format(CE_FILENAME, fingerprint_id, suffix)
+        write_atomically(join(ce_folderpath, dense_filename), save)
+        dense_filenames.append(dense_filename)
+
+    return dense_filenames
+
+
+def load_dense_ce(ce_folderpath, fingerprint_id, mmap_mode='r'):
+    """Load the dense ce of the fingerprint {fingerprint_id}, saved with save_dense_ce
+
+    With the default mmap_mode, nothing is read until sliced, e.g. csi[:, 100:200, 0, 0] only reads 
+    the amplitude of subcarriers 100 to 199 of the first port.
+
+    Arguments:
+        ce_folderpath {str} -- Folder holding the .npy files
+        fingerprint_id {int} -- ID of the fingerprint
+        mmap_mode {str} -- Passed to np.load. None to load the arrays in memory
+
+    Returns:
+        csi [np.ndarray] -- float32 array of shape [n_TTIs, n_subcarriers, N_PORTS, 2], the last axis being (amplitude, phase)
+        ttis [np.ndarray] -- int64 array of shape [n_TTIs]
+    """
+    csi = np.load(join(ce_folderpath, '{}_{}_csi.npy'.format(CE_FILENAME, fingerprint_id)), mmap_mode=mmap_mode)
+    ttis = np.load(join(ce_folderpath, '{}_{}_tti.npy'.format(CE_FILENAME, fingerprint_id)), mmap_mode=mmap_mode)
+
+    return csi, ttis
+
+
 def clean_else(else_filepath):
     else_dt = np.dtype([('TTI', np.float32), ('NOISE_ESTIMATE_DBM', np.float32),
                ('SNR_DB', np.float32), ('SNR_DB_0', np.float32), ('SNR_DB_1', np.float32), ('SNR_DB_2', np.float32), ('SNR_DB_3', np.float32), 
@@ -6,6 +6,17 @@ import json
 from os import listdir, mkdir, rename
 from os.path import join, isfile, isdir
 import glob
+import os
+import errno
+import fcntl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from atomic_write import write_atomically
+from instrumentation import measure, profiled, write_records
+from locations_index import load_locations, save_locations
+from transforms import load_transformed_locations
 
 CE_FOLDERNAME = 'ce'
 CE_FILENAME_PREFIX = 'ce'
@@ -16,16 +27,21 @@ ELSE_FILENAME_PREFIX = 'else'
 INFO_FOLDERNAME = 'info'
 INFO_FILENAME_PREFIX = 'info'
 
-CE_TEMP_FILENAME = 'ce_temp.parquet'
-ELSE_TEMP_FILENAME = 'else_temp.pkl'
-INFO_TEMP_FILENAME = 'info_temp.pkl'
-
 LOCATIONS_FILENAME = 'locations'
+MANIFEST_FILENAME = 'combine_manifest'
+
+LINK = 'auto' # How the files are placed in dest_folderpath: 'auto' (reflink, else hardlink, else copy), 'reflink', 'hardlink' or 'copy'
+LINK_METHODS = {'auto': ['reflink', 'hardlink', 'copy'], 'reflink': ['reflink', 'copy'], 'hardlink': ['hardlink', 'copy'], 'copy': ['copy']}
+THREADS = 8 # Amount of threads placing the files
+FICLONE = 0x40049409 # ioctl sharing the extents of a file with another (i.e. a reflink), on btrfs, XFS, ...
 
 @click.command()
 @click.option('--src_folderpath', prompt='Folder where the folders to combine (i.e. the ones holding the ce folder) are located', default='')
 @click.option('--dest_folderpath', prompt='Name of the folder to hold the combined data', default='')
-def combine_fingerprint_folders(src_folderpath, dest_folderpath):
+@click.option('--profile', is_flag=True, help='Whether to dump a cProfile of the combination')
+@click.option('--link', default=LINK, type=click.Choice(list(LINK_METHODS)), help='How to place the files: reflink, else hardlink, else copy if auto')
+@click.option('--threads', default=THREADS, help='Amount of threads placing the files')
+def combine_fingerprint_folders(src_folderpath, dest_folderpath, profile, link=LINK, threads=THREADS):
     """Combine several folders (contained in src_folderpath) of the shape:
 
         src_folderpath/
@@ -50,9 +66,25 @@ def combine_fingerprint_folders(src_folderpath, dest_folderpath):
 
     The ce_*.parquet, else_*.pkl and info_*.pkl files are renamed to have the shape *_{UNIQUE_FINGEPRINT_ID}.*
 
+    The combination is incremental: dest_folderpath/{MANIFEST_FILENAME}.json maps each (fingerprint folder, original ID)
+    to its combined ID, and to the size and mtime of its files. Re-running only places the new fingerprints (under new IDs)
+    and the changed ones (under their previous ID), and leaves the others untouched. The locations are updated for all of them.
+    A fingerprint removed from its folder keeps its combined ID and files.
+
+    Rather than being copied, the files are reflinked (copy-on-write) or hardlinked when dest_folderpath is on the same filesystem
+    (see place_file), which takes no extra space. They are placed by {threads} threads, and the bytes saved are reported at the end.
+    As the cleaned files are only ever replaced (never modified in place), a hardlinked file is not altered by a later re-cleaning.
+
+    The wall time, bytes placed and saved, and methods of the handling of each fingerprint, as well as the measure of the whole
+    combination, are appended to dest_folderpath/instrumentation.jsonl (see instrumentation.py).
+    If --profile is set, the combination is also profiled to dest_folderpath/profiles/combine_fingerprint_folders.prof
+
     Arguments:
         src_folderpath {str} -- Folder where the folders to combine (i.e. the ones holding the ce folder) are located
         dest_folderpath {str} -- Destination folder
+        profile {bool} -- Whether to profile the combination
+        link {str} -- How the files are placed: 'auto' (reflink, else hardlink, else copy), 'reflink', 'hardlink' or 'copy'
+        threads {int} -- Amount of threads placing the files
     """
 
     fingerprint_folders = sorted(listdir(src_folderpath))
@@ -76,15 +108,39 @@ def combine_fingerprint_folders(src_folderpath, dest_folderpath):
     print(f'- Combine {len(fingerprint_folders)} fingerprint folders')
     print('')
 
-    all_locations = {}
-    new_fingerprint_id = 0
+    records = []
+    with measure(records, 'total'), profiled(dest_folderpath, 'combine_fingerprint_folders', enabled=profile):
+        n_unchanged = combine(src_folderpath, dest_folderpath, fingerprint_folders, records, link=link, threads=threads)
+    records[-1]['n_fingerprints'] = sum(1 for record in records if record['stage'] == 'combine_fingerprint')
+    records[-1]['n_unchanged'] = n_unchanged
+    records[-1]['bytes_placed'] = sum(record['bytes_placed'] for record in records if record['stage'] == 'combine_fingerprint')
+    records[-1]['bytes_saved'] = sum(record['bytes_saved'] for record in records if record['stage'] == 'combine_fingerprint')
+    print_combination_summary(records[-1])
+
+    write_records(dest_folderpath, records, command='combine_fingerprint_folders', run_started_at=datetime.now().isoformat(timespec='seconds'), pid=os.getpid())
+
+def combine(src_folderpath, dest_folderpath, fingerprint_folders, records, link=LINK, threads=THREADS):
+    """Body of combine_fingerprint_folders, recording the handling of each new or changed fingerprint in records
+
+    Returns:
+        n_unchanged [int] -- Amount of fingerprints left untouched, as already combined
+    """
+    dest_ce_folderpath = join(dest_folderpath, CE_FOLDERNAME)
+    dest_else_folderpath = join(dest_folderpath, ELSE_FOLDERNAME)
+    dest_info_folderpath = join(dest_folderpath, INFO_FOLDERNAME)
+
+    manifest = load_manifest(dest_folderpath)
+    all_locations = load_locations(dest_folderpath, LOCATIONS_FILENAME) if manifest['fingerprints'] else {}
+    executor = ThreadPoolExecutor(max_workers=threads)
+    futures = []
+    n_unchanged = 0
     for fingerprint_folder in fingerprint_folders:
         print('\tFingerprint folder:', fingerprint_folder)
         
         fingerprint_folderpath = join(src_folderpath, fingerprint_folder)
 
-        # Load the locations.JSON associated with this fingerprint_folder
-        locations = load_locations(fingerprint_folderpath, LOCATIONS_FILENAME)
+        # Load the locations.JSON associated with this fingerprint_folder, in the combined frame (see transforms.py)
+        locations = load_transformed_locations(fingerprint_folderpath, LOCATIONS_FILENAME)
         print(f'\t\t {len(locations)} RPs found in locations.JSON')
 
         ce_folderpath = join(fingerprint_folderpath, CE_FOLDERNAME)
@@ -95,37 +151,77 @@ def combine_fingerprint_folders(src_folderpath, dest_folderpath):
         fingerprint_ids = list_fingerprint_ids(ce_folderpath)
         print(f'\t\t {len(fingerprint_ids)} .parquet files found in ce/\n')
 
+        n_new, n_changed = 0, 0
         for fingerprint_id in fingerprint_ids:
+            key = '{}/{}'.format(fingerprint_folder, fingerprint_id)
+            entry = manifest['fingerprints'].get(key)
+            files = [describe_file(join(folderpath, filename))
+                     for folderpath, filename in zip([ce_folderpath, else_folderpath, info_folderpath], get_filenames(fingerprint_id))]
+            if entry is None:
+                new_fingerprint_id = manifest['next_fingerprint_id']
+                manifest['next_fingerprint_id'] += 1
+                n_new += 1
+            else:
+                new_fingerprint_id = entry['fingerprint_id']
+
+            # Save its (new_fingerprint_id, [x,y]) pair, even if its files did not change
+            all_locations[str(new_fingerprint_id)] = locations[str(fingerprint_id)]
 
-            handle_fingerprint(fingerprint_id, new_fingerprint_id, ce_folderpath, else_folderpath, info_folderpath, dest_ce_folderpath, dest_else_folderpath, dest_info_folderpath)
+            dest_filepaths = [join(folderpath, filename)
+                              for folderpath, filename in zip([dest_ce_folderpath, dest_else_folderpath, dest_info_folderpath], get_filenames(new_fingerprint_id))]
+            if entry is not None and entry['files'] == files and all(isfile(filepath) for filepath in dest_filepaths):
+                n_unchanged += 1
+                continue
+            n_changed += 0 if entry is None else 1
 
-            # Save its (new_fingerprint_id, [x,y]) pair
-            all_locations[str(new_fingerprint_id)] = locations[str(fingerprint_id)]
+            record = {'stage': 'combine_fingerprint', 'fingerprint_folder': fingerprint_folder, 'fingerprint_id': fingerprint_id, 'new_fingerprint_id': new_fingerprint_id}
+            futures.append((record, key, files, executor.submit(handle_fingerprint, fingerprint_id, new_fingerprint_id, ce_folderpath, else_folderpath, info_folderpath,
+                                                                dest_ce_folderpath, dest_else_folderpath, dest_info_folderpath, link=link)))
+
+        print(f'\t\t {n_new} new, {n_changed} changed, {len(fingerprint_ids) - n_new - n_changed} unchanged\n')
 
-            new_fingerprint_id += 1
+    # Wait for the files to be placed (measure is per process, so the threads report their own timings)
+    for record, key, files, future in futures:
+        record.update(future.result())
+        records.append(record)
+        manifest['fingerprints'][key] = {'fingerprint_id': record['new_fingerprint_id'], 'files': files}
+    executor.shutdown()
 
-    # Save the new locations.json
-    with open(join(dest_folderpath, f'{LOCATIONS_FILENAME}.json'), 'w') as fp:
-        json.dump(all_locations, fp)
+    # Save the new locations.json, then the manifest (a fingerprint is only in the manifest once its files and location are in place)
+    save_locations(dest_folderpath, all_locations, LOCATIONS_FILENAME)
+    save_manifest(dest_folderpath, manifest)
 
-def load_locations(src_folderpath, location_filename):
-    """Load the fingerprint IDs located in src_folderpath/location_filename.JSON
+    return n_unchanged
+
+def load_manifest(dest_folderpath):
+    """Load {MANIFEST_FILENAME}.json, mapping each combined fingerprint ("{fingerprint folder}/{original ID}")
+    to its combined ID, and to the size and mtime of its files
 
     Arguments:
-        src_folderpath {str} -- Path to the folder holding the location_filename
-        location_filename {str} -- Name of the JSON file holding the "Fingerprint ID" -> [x,y] mapping
+        dest_folderpath {str} -- Folder holding {MANIFEST_FILENAME}.json
 
     Returns:
-        locations [dict] -- Dict stored in src_folderpath/location_filename.JSON. The fingerprint IDs are key, and the [x,y] coordinates are values.
+        manifest [dict] -- {'next_fingerprint_id': 0, 'fingerprints': {}} if {MANIFEST_FILENAME}.json does not exist yet
     """
+    manifest_filepath = join(dest_folderpath, '{}.json'.format(MANIFEST_FILENAME))
+    if not isfile(manifest_filepath):
+        return {'next_fingerprint_id': 0, 'fingerprints': {}}
+
+    with open(manifest_filepath, 'r') as fp:
+        return json.load(fp)
 
-    locations_filepath = join(src_folderpath, '{}.json'.format(location_filename))
-    locations = []
+def save_manifest(dest_folderpath, manifest):
+    """Atomically save the manifest to {MANIFEST_FILENAME}.json"""
+    def dump(filepath):
+        with open(filepath, 'w') as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
 
-    with open(locations_filepath, 'r') as fp:
-        locations = json.load(fp)
+    write_atomically(join(dest_folderpath, '{}.json'.format(MANIFEST_FILENAME)), dump)
 
-    return locations
+def describe_file(filepath):
+    """Return the size [B] and mtime of filepath, as stored in the manifest (cheap enough to be checked for every fingerprint at each run)"""
+    stat = os.stat(filepath)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
 
 def list_fingerprint_ids(src_folderpath):
     '''List the fingerprint IDs of all the .parquet files in src_folderpath
@@ -139,11 +235,11 @@ def list_fingerprint_ids(src_folderpath):
 
     return sorted(fingerprint_ids)
 
-def handle_fingerprint(fingerprint_id, new_fingerprint_id, ce_folderpath, else_folderpath, info_folderpath, dest_ce_folderpath, dest_else_folderpath, dest_info_folderpath):
+def handle_fingerprint(fingerprint_id, new_fingerprint_id, ce_folderpath, else_folderpath, info_folderpath, dest_ce_folderpath, dest_else_folderpath, dest_info_folderpath, link=LINK):
     """Handle the fingerprint with the ID {fingerprint_id}.
 
-    That is, copy the files related to that fingerprint_id (ce.parquet, else.pkl and info.pkl)
-    Then, rename them so that they have the ID {new_fingerprint_id}
+    That is, place (see place_file) the files related to that fingerprint_id (ce.parquet, else.pkl and info.pkl)
+    so that they have the ID {new_fingerprint_id}
 
     Args:
         fingerprint_id (int): ID of the fingerprint to handle
@@ -154,29 +250,91 @@ def handle_fingerprint(fingerprint_id, new_fingerprint_id, ce_folderpath, else_f
         dest_ce_folderpath ([type]): [description]
         dest_else_folderpath ([type]): [description]
         dest_info_folderpath ([type]): [description]
+        link (str): How the files are placed (see LINK_METHODS)
+
+    Returns:
+        [dict]: wall_time [s], bytes_placed, bytes_saved (i.e. not copied) and the methods used (e.g. ['hardlink', 'hardlink', 'hardlink'])
     """
 
     src_folderpaths = [ce_folderpath, else_folderpath, info_folderpath]
     dest_folderpaths = [dest_ce_folderpath, dest_else_folderpath, dest_info_folderpath]
 
+    filenames = get_filenames(fingerprint_id)
+    new_filenames = get_filenames(new_fingerprint_id)
+    
+    # Place the files under their new name
+    start_time = time.perf_counter()
+    result = {'bytes_placed': 0, 'bytes_saved': 0, 'methods': []}
+    for filename, new_filename, folderpath, dest_folderpath in zip(filenames, new_filenames, src_folderpaths, dest_folderpaths):
+        src_filepath = join(folderpath, filename)
+        dest_filepath = join(dest_folderpath, new_filename)
+
+        method = place_file(src_filepath, dest_filepath, link=link)
+        size = os.path.getsize(src_filepath)
+        result['bytes_placed'] += size
+        result['bytes_saved'] += 0 if method == 'copy' else size
+        result['methods'].append(method)
+    result['wall_time'] = time.perf_counter() - start_time
+
+    return result
+
+def get_filenames(fingerprint_id):
+    """Return the filenames of the cleaned ce, else and info files of the fingerprint {fingerprint_id}"""
     ce_filename = f'{CE_FILENAME_PREFIX}_{fingerprint_id}.parquet' 
     else_filename = f'{ELSE_FILENAME_PREFIX}_{fingerprint_id}.pkl' 
     info_filename = f'{INFO_FILENAME_PREFIX}_{fingerprint_id}.pkl' 
-    filenames = [ce_filename, else_filename, info_filename]
 
-    new_ce_filename = f'{CE_FILENAME_PREFIX}_{new_fingerprint_id}.parquet' 
-    new_else_filename = f'{ELSE_FILENAME_PREFIX}_{new_fingerprint_id}.pkl' 
-    new_info_filename = f'{INFO_FILENAME_PREFIX}_{new_fingerprint_id}.pkl' 
-    new_filenames = [new_ce_filename, new_else_filename, new_info_filename]
-    
-    # Copy and rename the files 
-    for filename, new_filename, temp_filename, folderpath, dest_folderpath in zip(filenames, new_filenames, [CE_TEMP_FILENAME, ELSE_TEMP_FILENAME, INFO_TEMP_FILENAME], src_folderpaths, dest_folderpaths):
-        src_filepath = join(folderpath, filename)
-        dest_temp_filepath = join(dest_folderpath, temp_filename) # temporary filepath before renaming the file
-        dest_filepath = join(dest_folderpath, new_filename)
+    return [ce_filename, else_filename, info_filename]
+
+def place_file(src_filepath, dest_filepath, link=LINK):
+    """Make src_filepath available at dest_filepath, trying the methods of LINK_METHODS[link] in turn:
+        - 'reflink': share the data blocks, copy-on-write (same btrfs/XFS/... filesystem only)
+        - 'hardlink': share the inode (same filesystem only)
+        - 'copy': copy the data
 
-        shutil.copy(src_filepath, dest_temp_filepath)
-        rename(dest_temp_filepath, dest_filepath)
+    The file is placed under a temporary name, then renamed to dest_filepath, so that dest_filepath is never a partial file.
+
+    Arguments:
+        src_filepath {str} -- File to place
+        dest_filepath {str} -- Where to place it
+        link {str} -- Key of LINK_METHODS
+
+    Returns:
+        method [str] -- Method which succeeded
+    """
+    temp_filepath = '{}.tmp'.format(dest_filepath) # temporary filepath before renaming the file
+    for method in LINK_METHODS[link]:
+        if os.path.lexists(temp_filepath):
+            os.remove(temp_filepath)
+        try:
+            if method == 'reflink':
+                reflink(src_filepath, temp_filepath)
+            elif method == 'hardlink':
+                os.link(src_filepath, temp_filepath)
+            else:
+                shutil.copy(src_filepath, temp_filepath)
+            break
+        except OSError as e:
+            if method == 'copy' or e.errno not in [errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.EMLINK]:
+                raise
+
+    rename(temp_filepath, dest_filepath)
+    return method
+
+def reflink(src_filepath, dest_filepath):
+    """Create dest_filepath sharing the data blocks of src_filepath (FICLONE). Raises OSError if the filesystem does not support it"""
+    with open(src_filepath, 'rb') as src_fp, open(dest_filepath, 'wb') as dest_fp:
+        fcntl.ioctl(dest_fp.fileno(), FICLONE, src_fp.fileno())
+
+def print_combination_summary(record):
+    """Print the throughput of the combination, and the bytes saved by linking rather than copying"""
+    wall_time = max(record['wall_time'], 1e-9)
+    print('')
+    print('- {} new or changed fingerprints ({:.2f} MB) combined in {:.2f}s: {:.2f} MB/s, {:.1f} fingerprints/s'.format(
+        record['n_fingerprints'], record['bytes_placed'] / 1e6, record['wall_time'], record['bytes_placed'] / 1e6 / wall_time, record['n_fingerprints'] / wall_time))
+    print('- {:.2f} MB saved by linking rather than copying ({:.0f}%)'.format(
+        record['bytes_saved'] / 1e6, 100 * record['bytes_saved'] / max(record['bytes_placed'], 1)))
+    print('- {} fingerprints already combined, left untouched'.format(record['n_unchanged']))
 
 if __name__ == '__main__':
     combine_fingerprint_folders() # pylint: disable=no-value-for-parameter
\ No newline at end of file
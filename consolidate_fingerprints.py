@@ -0,0 +1,156 @@
+import pandas as pd
+import numpy as np
+import click
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from os import mkdir
+from os.path import join, isdir, isfile
+
+from atomic_write import write_atomically
+from transforms import load_transformed_locations
+
+CE_FOLDERNAME = 'ce'
+CE_FILENAME = 'ce'
+
+ELSE_FOLDERNAME = 'else'
+ELSE_FILENAME = 'else'
+
+INFO_FOLDERNAME = 'info'
+INFO_FILENAME = 'info'
+
+LOCATIONS_FILENAME = 'locations'
+
+RADIO_MAP_FOLDERNAME = 'radio_map'
+RADIO_MAP_COMPRESSION = 'gzip'
+LOCATIONS_METADATA_KEY = b'locations'
+
+@click.command()
+@click.option('--src_folderpath', prompt='Folder where the ce, else and info folder are located', default='')
+def consolidate_fingerprints(src_folderpath):
+    """Consolidate the cleaned fingerprints referenced in {LOCATIONS_FILENAME}.json into a single radio map:
+
+        src_folderpath/
+            radio_map/
+                ce.parquet
+                else.parquet
+                info.parquet
+
+    Each .parquet holds all the fingerprints, with their FINGERPRINT_ID and (X, Y) location as columns.
+    Fingerprints are stored in ascending ID, one row group each, sorted by TTI (and SC_ID for ce).
+    This allows reading only some columns and/or fingerprints (see load_radio_map),
+    and listing the fingerprints from the files' footer (see load_radio_map_locations).
+
+    Arguments:
+        src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
+    """
+
+    locations = load_transformed_locations(src_folderpath, LOCATIONS_FILENAME) # a single read, so that the IDs and their locations match
+    fingerprint_ids = sorted(map(int, locations.keys()))
+
+    # Only keep the fingerprints having all three files cleaned
+    fingerprint_ids = [fingerprint_id for fingerprint_id in fingerprint_ids
+                       if all(isfile(filepath) for filepath in list_cleaned_filepaths(src_folderpath, fingerprint_id))]
+    locations = {str(fingerprint_id): locations[str(fingerprint_id)] for fingerprint_id in fingerprint_ids}
+
+    dest_folderpath = join(src_folderpath, RADIO_MAP_FOLDERNAME)
+    if not isdir(dest_folderpath):
+        mkdir(dest_folderpath)
+
+    print('')
+    print('Consolidate {} fingerprints into {}/\n'.format(len(fingerprint_ids), dest_folderpath))
+
+    for i, (filename, sort_columns) in enumerate([(CE_FILENAME, ['TTI', 'SC_ID']), (ELSE_FILENAME, ['TTI']), (INFO_FILENAME, ['TTI'])]):
+        dest_filepath = join(dest_folderpath, '{}.parquet'.format(filename))
+        print('\t {}: '.format(dest_filepath), end='')
+
+        dfs = (load_cleaned_fingerprint(list_cleaned_filepaths(src_folderpath, fingerprint_id)[i]) for fingerprint_id in fingerprint_ids)
+        write_atomically(dest_filepath, lambda filepath: write_radio_map_file(filepath, fingerprint_ids, dfs, locations, sort_columns))
+        print('Done')
+
+
+def list_cleaned_filepaths(src_folderpath, fingerprint_id):
+    """Return the filepaths of the cleaned ce, else and info files of the fingerprint {fingerprint_id}"""
+    return [join(src_folderpath, CE_FOLDERNAME, '{}_{}.parquet'.format(CE_FILENAME, fingerprint_id)),
+            join(src_folderpath, ELSE_FOLDERNAME, '{}_{}.pkl'.format(ELSE_FILENAME, fingerprint_id)),
+            join(src_folderpath, INFO_FOLDERNAME, '{}_{}.pkl'.format(INFO_FILENAME, fingerprint_id))]
+
+
+def load_cleaned_fingerprint(filepath, columns=None):
+    """Load a cleaned .parquet or .pkl file, only keeping columns (only reading them, for a .parquet). All of them if None"""
+    if filepath.endswith('.parquet'):
+        return pd.read_parquet(filepath, columns=columns)
+    df = pd.read_pickle(filepath)
+    return df if columns is None else df[columns]
+
+
+def write_radio_map_file(dest_filepath, fingerprint_ids, dfs, locations, sort_columns):
+    """Write the fingerprints' DataFrames into a single .parquet, one row group per fingerprint
+
+    Arguments:
+        dest_filepath {str} -- Filepath of the .parquet to write
+        fingerprint_ids {list of int} -- Fingerprint IDs, in ascending order
+        dfs {iterable of pd.DataFrame} -- Cleaned DataFrames, in the same order as fingerprint_ids
+        locations {dict} -- "Fingerprint ID" -> [x,y] mapping, stored in the file's metadata
+        sort_columns {list of str} -- Columns to sort each fingerprint by
+    """
+    writer = None
+    schema = None
+    try:
+        for fingerprint_id, df in zip(fingerprint_ids, dfs):
+            x, y = locations[str(fingerprint_id)]
+            df = df.sort_values(sort_columns, kind='stable').reset_index(drop=True)
+            df.insert(0, 'Y', np.float64(y))
+            df.insert(0, 'X', np.float64(x))
+            df.insert(0, 'FINGERPRINT_ID', np.int64(fingerprint_id))
+
+            table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            if writer is None:
+                schema = table.schema.with_metadata({LOCATIONS_METADATA_KEY: json.dumps(locations)})
+                writer = pq.ParquetWriter(dest_filepath, schema, compression=RADIO_MAP_COMPRESSION)
+
+            writer.write_table(table.cast(schema), row_group_size=max(len(table), 1)) # one row group per fingerprint
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None: # no fingerprint: still write an empty file holding the locations
+        pq.write_table(pa.table({'FINGERPRINT_ID': pa.array([], pa.int64())}).replace_schema_metadata({LOCATIONS_METADATA_KEY: json.dumps(locations)}), dest_filepath)
+
+
+def load_radio_map(src_folderpath, filename=CE_FILENAME, fingerprint_ids=None, columns=None):
+    """Load the radio map file {filename}.parquet, only reading the requested fingerprints and columns
+
+    Arguments:
+        src_folderpath {str} -- Folder holding the RADIO_MAP_FOLDERNAME folder
+        filename {str} -- Which file to load (CE_FILENAME, ELSE_FILENAME or INFO_FILENAME)
+        fingerprint_ids {list of int} -- Fingerprints to load. All of them if None
+        columns {list of str} -- Columns to load. All of them if None
+
+    Returns:
+        [pd.DataFrame] -- One row per record, with the FINGERPRINT_ID, X and Y columns
+    """
+    filepath = join(src_folderpath, RADIO_MAP_FOLDERNAME, '{}.parquet'.format(filename))
+    filters = None
+    if fingerprint_ids is not None:
+        filters = [('FINGERPRINT_ID', 'in', list(map(int, fingerprint_ids)))] # row groups of other fingerprints are skipped from their statistics
+
+    return pq.read_table(filepath, columns=columns, filters=filters).to_pandas()
+
+
+def load_radio_map_locations(src_folderpath, filename=CE_FILENAME):
+    """Load the "Fingerprint ID" -> [x,y] mapping from the footer of the radio map file {filename}.parquet
+
+    Arguments:
+        src_folderpath {str} -- Folder holding the RADIO_MAP_FOLDERNAME folder
+        filename {str} -- Which file to read the footer of (CE_FILENAME, ELSE_FILENAME or INFO_FILENAME)
+
+    Returns:
+        locations [dict] -- The fingerprint IDs are key, and the [x,y] coordinates are values.
+    """
+    filepath = join(src_folderpath, RADIO_MAP_FOLDERNAME, '{}.parquet'.format(filename))
+    return json.loads(pq.read_schema(filepath).metadata[LOCATIONS_METADATA_KEY])
+
+
+if __name__ == '__main__':
+    consolidate_fingerprints() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,155 @@
+import click
+import numpy as np
+import os
+
+from clean_fingerprints import STOP_SYMBOL, N_SUBCARRIERS, N_PORTS, N_TTIS, CE_DT
+
+CE_FILENAME = 'ce'
+ELSE_FILENAME = 'else'
+INFO_FILENAME = 'info'
+
+N_ELSE_FIELDS = 21 # TTI, noise, 5x SNR, 6x RSRP, 5x RSRQ, RSSI, CFO, SYNC_ERROR
+N_INFO_FIELDS = 5 # PCI, NOF_PRB, NOF_PORTS, NOF_RX_ANTENNAS, TTI
+N_PATHS = 6 # amount of multipath components of the synthetic channel
+SUBCARRIER_SPACING = 15e3 # [Hz]
+PCI = 1
+NOF_PRB = 50
+
+@click.command()
+@click.option('--dest_folderpath', default='./', help='Folder where to write ce.txt, else.txt and info.txt')
+@click.option('--filesize', default=20.0, help='Size [MB] of ce.txt')
+@click.option('--n_subcarriers', default=N_SUBCARRIERS, help='Amount of subcarriers recorded per TTI')
+@click.option('--error_rate', default=1e-4, help='Ratio of ce records with a framing error')
+@click.option('--seed', default=0, help='Seed of the random generator')
+def generate_fingerprints(dest_folderpath, filesize, n_subcarriers, error_rate, seed):
+    """Write a synthetic fingerprint (ce.txt, else.txt and info.txt), with the same binary layout as the ones written by srsue
+
+    ce.txt holds the channel of a static multipath environment seen by N_PORTS ports, with some noise,
+    and {error_rate} of its records hold a framing error (see generate_ce_data).
+
+    Arguments:
+        dest_folderpath {str} -- Folder where to write ce.txt, else.txt and info.txt
+        filesize {float} -- Size [MB] of ce.txt
+        n_subcarriers {int} -- Amount of subcarriers recorded per TTI
+        error_rate {float} -- Ratio of ce records with a framing error
+        seed {int} -- Seed of the random generator
+    """
+    n_bytes = write_fingerprint(dest_folderpath, filesize, n_subcarriers=n_subcarriers, error_rate=error_rate, seed=seed)
+    print('{:.2f} MB written to {}'.format(n_bytes / 1e6, dest_folderpath))
+
+
+def write_fingerprint(dest_folderpath, filesize, n_subcarriers=N_SUBCARRIERS, error_rate=1e-4, seed=0):
+    """Write a synthetic ce.txt, else.txt and info.txt to dest_folderpath
+
+    Arguments:
+        dest_folderpath {str} -- Folder where to write the files
+        filesize {float} -- Size [MB] of ce.txt
+        n_subcarriers {int} -- Amount of subcarriers recorded per TTI
+        error_rate {float} -- Ratio of ce records with a framing error
+        seed {int} -- Seed of the random generator
+
+    Returns:
+        n_bytes [int] -- Amount of bytes written
+    """
+    if not os.path.isdir(dest_folderpath):
+        os.makedirs(dest_folderpath)
+
+    ce_data_1d = generate_ce_data(filesize, n_subcarriers=n_subcarriers, error_rate=error_rate, seed=seed)
+    n_ttis = -(-int(filesize * 1e6 / CE_DT.itemsize) // n_subcarriers) # same amount of TTIs as ce.txt
+    else_data = generate_else_data(n_ttis, seed=seed)
+    info_data = generate_info_data(n_ttis)
+
+    n_bytes = 0
+    for data, filename in [(ce_data_1d, CE_FILENAME), (else_data, ELSE_FILENAME), (info_data, INFO_FILENAME)]:
+        data.tofile(os.path.join(dest_folderpath, '{}.txt'.format(filename)))
+        n_bytes += data.nbytes
+
+    return n_bytes
+
+
+def generate_ce_data(filesize, n_subcarriers=N_SUBCARRIERS, error_rate=1e-4, seed=0, first_tti=0):
+    """Generate a flat float32 ce stream of roughly {filesize} MB
+
+    Records follow each other TTI by TTI, subcarrier by subcarrier. {error_rate} of them hold one of the framing errors
+    that clean_ce has to resynchronize from, equally likely:
+        - a float is dropped
+        - a float is duplicated
+        - a value is replaced by STOP_SYMBOL
+
+    Arguments:
+        filesize {float} -- Size [MB] of the stream
+        n_subcarriers {int} -- Amount of subcarriers recorded per TTI
+        error_rate {float} -- Ratio of records with a framing error
+        seed {int} -- Seed of the random generator
+        first_tti {int} -- TTI of the first record (TTIs wrap around every N_TTIS)
+
+    Returns:
+        [np.ndarray] -- Flat float32 array, as written by srsue in ce.txt
+    """
+    rng = np.random.default_rng(seed)
+    n_fields = len(CE_DT.names)
+    n_records = int(filesize * 1e6 / CE_DT.itemsize)
+    n_ttis = -(-n_records // n_subcarriers)
+
+    # Static multipath channel, per port: H(f) = sum_k a_k * exp(-j*2*pi*f*tau_k)
+    frequencies = (np.arange(n_subcarriers) - n_subcarriers / 2) * SUBCARRIER_SPACING
+    gains = rng.rayleigh(0.5, size=(N_PORTS, N_PATHS)) * np.exp(1j * rng.uniform(-np.pi, np.pi, size=(N_PORTS, N_PATHS)))
+    delays = rng.exponential(200e-9, size=(N_PORTS, N_PATHS))
+    channel = (gains[:, :, None] * np.exp(-2j * np.pi * frequencies[None, None, :] * delays[:, :, None])).sum(axis=1) # shape [N_PORTS, n_subcarriers]
+
+    records = np.empty((n_records, n_fields), dtype=np.float32)
+    records[:, 0] = (first_tti + np.arange(n_records) // n_subcarriers) % N_TTIS # TTI
+    records[:, 1] = np.arange(n_records) % n_subcarriers # SC_ID
+    for port in range(N_PORTS):
+        noise = rng.normal(0, 0.05, size=n_records) + 1j * rng.normal(0, 0.05, size=n_records)
+        estimate = np.tile(channel[port], n_ttis)[:n_records] + noise
+        records[:, 2 + 2 * port] = np.abs(estimate)
+        records[:, 3 + 2 * port] = np.angle(estimate)
+    records[:, -1] = STOP_SYMBOL
+
+    # Inject framing errors
+    corrupted_records = rng.choice(n_records, size=int(n_records * error_rate), replace=False)
+    corrupted_fields = rng.integers(0, n_fields - 1, size=len(corrupted_records))
+    error_types = rng.integers(0, 3, size=len(corrupted_records))
+
+    spurious_stops = error_types == 2
+    records[corrupted_records[spurious_stops], corrupted_fields[spurious_stops]] = STOP_SYMBOL
+
+    repeats = np.ones(records.shape, dtype=np.int64)
+    repeats[corrupted_records[error_types == 0], corrupted_fields[error_types == 0]] = 0 # dropped
+    repeats[corrupted_records[error_types == 1], corrupted_fields[error_types == 1]] = 2 # duplicated
+
+    return np.repeat(records.reshape((-1,)), repeats.reshape((-1,)))
+
+
+def generate_else_data(n_ttis, seed=0, first_tti=0):
+    """Generate n_ttis records of else.txt (RSRP, RSRQ, SNR, ...), starting at first_tti, as a flat float32 array"""
+    rng = np.random.default_rng(seed)
+
+    records = np.empty((n_ttis, N_ELSE_FIELDS), dtype=np.float32)
+    records[:, 0] = (first_tti + np.arange(n_ttis)) % N_TTIS # TTI
+    records[:, 1] = rng.normal(-110, 1, size=n_ttis) # NOISE_ESTIMATE_DBM
+    records[:, 2:7] = rng.normal(20, 2, size=(n_ttis, 5)) # SNR_DB, SNR_DB_0..3
+    records[:, 7:13] = rng.normal(-90, 2, size=(n_ttis, 6)) # RSRP_DBM, RSRP_NEIGH, RSRP_DBM_0..3
+    records[:, 13:18] = rng.normal(-10, 1, size=(n_ttis, 5)) # RSRQ_DB, RSRQ_DB_0..3
+    records[:, 18] = rng.normal(-60, 2, size=n_ttis) # RSSI_DBM
+    records[:, 19] = rng.normal(0, 50, size=n_ttis) # CFO
+    records[:, 20] = rng.normal(0, 1, size=n_ttis) # SYNC_ERROR
+
+    return records.reshape((-1,))
+
+
+def generate_info_data(n_ttis, first_tti=0):
+    """Generate n_ttis records of info.txt (PCI, NOF_PRB, ...), starting at first_tti, as a flat float32 array"""
+    records = np.empty((n_ttis, N_INFO_FIELDS), dtype=np.float32)
+    records[:, 0] = PCI
+    records[:, 1] = NOF_PRB
+    records[:, 2] = N_PORTS
+    records[:, 3] = 1 # NOF_RX_ANTENNAS
+    records[:, 4] = (first_tti + np.arange(n_ttis)) % N_TTIS # TTI
+
+    return records.reshape((-1,))
+
+
+if __name__ == '__main__':
+    generate_fingerprints() # pylint: disable=no-value-for-parameter
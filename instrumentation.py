@@ -0,0 +1,131 @@
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import time
+from os.path import join, isdir
+
+INSTRUMENTATION_FILENAME = 'instrumentation'
+PROFILES_FOLDERNAME = 'profiles'
+
+_open_records = [] # records of the measure blocks currently open in this process, outermost first
+
+
+@contextlib.contextmanager
+def measure(records, stage, **fields):
+    """Measure the enclosed block, and append its record to records
+
+    The record holds the stage, the given fields (e.g. fingerprint_id) and
+        - wall_time, cpu_time: elapsed wall-clock and CPU time [s]
+        - bytes_read, bytes_written: bytes read and written by the process (None if /proc/self/io is not available)
+        - peak_rss_mb: peak resident set size [MB] of the process during the block.
+                       If the peak cannot be reset (non-Linux), this is the peak since the process started
+
+    Blocks can be nested, e.g. a per-fingerprint block within a per-command one.
+
+    Arguments:
+        records {list of dict} -- List to which the record is appended
+        stage {str} -- Name of the measured stage (e.g. 'ce_resync')
+        fields -- Extra fields of the record
+
+    Yields:
+        record [dict] -- The record, to which fields can be added within the block
+    """
+    record = {'stage': stage, **fields}
+    reset_peak_rss()
+    _open_records.append(record)
+    record['_peak_rss'] = read_peak_rss()
+
+    bytes_read, bytes_written = read_io_counters()
+    start_cpu_time = time.process_time()
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['wall_time'] = time.perf_counter() - start_time
+        record['cpu_time'] = time.process_time() - start_cpu_time
+
+        end_bytes_read, end_bytes_written = read_io_counters()
+        record['bytes_read'] = None if bytes_read is None else end_bytes_read - bytes_read
+        record['bytes_written'] = None if bytes_written is None else end_bytes_written - bytes_written
+
+        _open_records.remove(record)
+        record['peak_rss_mb'] = max(record.pop('_peak_rss'), read_peak_rss()) / 1e3
+        records.append(record)
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process, after passing it on to the open measure blocks"""
+    peak_rss = read_peak_rss()
+    for record in _open_records:
+        record['_peak_rss'] = max(record['_peak_rss'], peak_rss)
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5') # resets VmHWM (Linux >= 4.0)
+    except OSError:
+        pass
+
+
+def read_peak_rss():
+    """Return the peak RSS [kB] of the process, as reported by /proc/self/status (or getrusage if not available)"""
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def read_io_counters():
+    """Return the bytes read and written by the process so far (rchar and wchar of /proc/self/io), (None, None) if not available"""
+    try:
+        with open('/proc/self/io', 'r') as fp:
+            counters = dict(line.split(': ') for line in fp.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def write_records(dest_folderpath, records, **fields):
+    """Append the records to {dest_folderpath}/{INSTRUMENTATION_FILENAME}.jsonl, one JSON object per line
+
+    Arguments:
+        dest_folderpath {str} -- Folder holding {INSTRUMENTATION_FILENAME}.jsonl
+        records {list of dict} -- Records filled by measure
+        fields -- Fields added to each record (e.g. the command and the run's start time, to tell the runs apart)
+    """
+    with open(join(dest_folderpath, '{}.jsonl'.format(INSTRUMENTATION_FILENAME)), 'a') as fp:
+        for record in records:
+            fp.write(json.dumps({**fields, **record}) + '\n')
+
+
+@contextlib.contextmanager
+def profiled(dest_folderpath, name, enabled=True):
+    """Profile the enclosed block with cProfile, and dump the stats to {dest_folderpath}/{PROFILES_FOLDERNAME}/{name}.prof
+
+    The stats can be inspected with e.g. `python -m pstats {name}.prof` or snakeviz.
+
+    Arguments:
+        dest_folderpath {str} -- Folder holding the PROFILES_FOLDERNAME folder
+        name {str} -- Name of the .prof file
+        enabled {bool} -- Whether to profile at all
+    """
+    if not enabled:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profiles_folderpath = join(dest_folderpath, PROFILES_FOLDERNAME)
+        if not isdir(profiles_folderpath):
+            os.makedirs(profiles_folderpath, exist_ok=True) # several workers might create it at once
+        profile.dump_stats(join(profiles_folderpath, '{}.prof'.format(name)))
@@ -0,0 +1,243 @@
+import json
+import os
+
+from atomic_write import write_atomically
+from spatial_index import SpatialIndex
+
+LOCATIONS_FILENAME = 'locations'
+JOURNAL_EXTENSION = 'jsonl' # {locations_filename}.jsonl, next to the {locations_filename}.json snapshot
+SPATIAL_INDEX_SUFFIX = 'grid' # {locations_filename}_grid.npz, the spatial index saved along the snapshot
+COMPACTION_INTERVAL = 100 # Amount of journaled locations above which they are compacted into the snapshot
+
+class LocationsIndex(object):
+    def __init__(self, folderpath, locations_filename=LOCATIONS_FILENAME, compaction_interval=COMPACTION_INTERVAL):
+        """Index of the locations where the fingerprints of a campaign were taken, assigning their IDs
+
+        The index is made of a snapshot, {locations_filename}.json ("Fingerprint ID" -> [x,y]), and of an append-only journal,
+        {locations_filename}.jsonl, holding one fsync'd {"fingerprint_id": 0, "location": [x, y]} line per location added since.
+        Adding a location thus costs one append (rather than a rewrite of the whole JSON), and the next ID is kept in memory.
+        Every {compaction_interval} locations, the journal is compacted into the snapshot, which is replaced atomically.
+        The spatial index of the locations (see spatial_index.py) is kept up to date in memory, and saved along the snapshot.
+
+        A crash loses at most the location being appended: a torn last line of the journal is truncated when the index is opened again.
+
+        Arguments:
+            folderpath {str} -- Folder of the campaign, holding the snapshot and the journal
+            locations_filename {str} -- Filename (without extension) of the snapshot and the journal
+            compaction_interval {int} -- Amount of journaled locations above which they are compacted into the snapshot
+        """
+        self.snapshot_filepath, self.journal_filepath = get_locations_filepaths(folderpath, locations_filename)
+        self.compaction_interval = compaction_interval
+
+        journaled_locations, n_journaled, end = read_journal(self.journal_filepath)
+        if os.path.isfile(self.journal_filepath) and os.path.getsize(self.journal_filepath) > end:
+            print('Truncating {} torn bytes at the end of {}'.format(os.path.getsize(self.journal_filepath) - end, self.journal_filepath))
+            with open(self.journal_filepath, 'r+b') as fp:
+                fp.truncate(end)
+
+        self.folderpath = folderpath
+        self.locations_filename = locations_filename
+        self.locations = read_snapshot(self.snapshot_filepath)
+        self.spatial_index = read_spatial_index(folderpath, locations_filename)
+        if self.spatial_index is None:
+            self.spatial_index = SpatialIndex.from_locations(self.locations)
+        self.locations.update(journaled_locations)
+        self.spatial_index.update(journaled_locations)
+        self.n_journaled = n_journaled
+        self.next_fingerprint_id = max(map(int, self.locations.keys()), default=-1) + 1
+        self.fp = open(self.journal_filepath, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def add(self, x, y):
+        """Assign the next fingerprint ID to the location (x,y), and journal it
+
+        Arguments:
+            x {float} -- x-coordinate where the fingerprint was taken
+            y {float} -- y-coordinate where the fingerprint was taken
+
+        Returns:
+            fingerprint_id {int} -- Unique ID assigned to the fingerprint
+        """
+        fingerprint_id = self.next_fingerprint_id
+        location = [float(x), float(y)]
+        self.fp.write(json.dumps({'fingerprint_id': fingerprint_id, 'location': location}) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+
+        self.locations[str(fingerprint_id)] = location
+        self.spatial_index.add([fingerprint_id], [location])
+        self.next_fingerprint_id += 1
+        self.n_journaled += 1
+        if self.n_journaled >= self.compaction_interval:
+            self.compact()
+
+        return fingerprint_id
+
+    def compact(self):
+        """Replace the snapshot by the current locations (and save their spatial index), then empty the journal
+
+        A crash in between leaves journaled locations already in the snapshot, which replaying just overwrites with the same values.
+        """
+        write_snapshot(self.snapshot_filepath, self.locations)
+        self.spatial_index.rebalance()
+        write_spatial_index(self.folderpath, self.spatial_index, self.locations_filename)
+        self.fp.truncate(0)
+        os.fsync(self.fp.fileno())
+        self.n_journaled = 0
+
+    def close(self):
+        self.fp.close()
+
+
+def get_locations_filepaths(folderpath, locations_filename=LOCATIONS_FILENAME):
+    """Return the filepaths of the snapshot ({locations_filename}.json) and of the journal ({locations_filename}.jsonl)"""
+    snapshot_filepath = os.path.join(folderpath, '{}.json'.format(locations_filename))
+    journal_filepath = os.path.join(folderpath, '{}.{}'.format(locations_filename, JOURNAL_EXTENSION))
+    return snapshot_filepath, journal_filepath
+
+
+def read_snapshot(snapshot_filepath):
+    if not os.path.isfile(snapshot_filepath):
+        return {}
+
+    with open(snapshot_filepath, 'r') as fp:
+        return json.load(fp)
+
+
+def write_snapshot(snapshot_filepath, locations):
+    """Write locations to snapshot_filepath atomically, fsync'd (see write_atomically)"""
+    def dump(filepath):
+        with open(filepath, 'w') as fp:
+            json.dump(locations, fp)
+
+    write_atomically(snapshot_filepath, dump, fsync=True)
+
+
+def read_journal(journal_filepath):
+    """Read the complete lines of the journal
+
+    Returns:
+        locations [dict] -- Journaled locations ("Fingerprint ID" -> [x,y])
+        n_journaled [int] -- Amount of journaled lines
+        end [int] -- Offset [B] right after the last complete line
+    """
+    locations = {}
+    n_journaled = 0
+    end = 0
+    if not os.path.isfile(journal_filepath):
+        return locations, n_journaled, end
+
+    with open(journal_filepath, 'rb') as fp:
+        for line in fp:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entry = json.loads(line.decode())
+            except ValueError:
+                break
+            locations[str(entry['fingerprint_id'])] = entry['location']
+            n_journaled += 1
+            end += len(line)
+
+    return locations, n_journaled, end
+
+
+def load_locations(folderpath, locations_filename=LOCATIONS_FILENAME):
+    """Load the locations of the fingerprints of a campaign: its snapshot, updated by its journal
+
+    The journal is read before the snapshot. If the index is compacted in between, the snapshot read then already holds
+    the journaled locations: the view is always the complete state of the index at some point, never a mix missing some locations.
+
+    Arguments:
+        folderpath {str} -- Folder holding {locations_filename}.json (and {locations_filename}.jsonl)
+        locations_filename {str} -- Filename (without extension) of the snapshot and the journal
+
+    Returns:
+        locations [dict] -- The fingerprint IDs (str) are keys, and the [x,y] coordinates are values
+    """
+    snapshot_filepath, journal_filepath = get_locations_filepaths(folderpath, locations_filename)
+    journaled_locations, _, _ = read_journal(journal_filepath)
+    locations = read_snapshot(snapshot_filepath)
+    locations.update(journaled_locations)
+
+    return locations
+
+
+def save_locations(folderpath, locations, locations_filename=LOCATIONS_FILENAME):
+    """Replace all the locations of a campaign (e.g. to offset them), leaving it with a snapshot and an empty journal
+
+    Arguments:
+        folderpath {str} -- Folder of the campaign
+        locations {dict} -- The fingerprint IDs (str) are keys, and the [x,y] coordinates are values
+        locations_filename {str} -- Filename (without extension) of the snapshot and the journal
+    """
+    snapshot_filepath, journal_filepath = get_locations_filepaths(folderpath, locations_filename)
+    if os.path.isfile(journal_filepath): # compact first, so that a crash cannot replay stale journaled locations over the new snapshot
+        with LocationsIndex(folderpath, locations_filename) as index:
+            index.compact()
+        os.remove(journal_filepath)
+
+    write_snapshot(snapshot_filepath, locations)
+    write_spatial_index(folderpath, SpatialIndex.from_locations(locations), locations_filename)
+
+
+def get_spatial_index_filepath(folderpath, locations_filename=LOCATIONS_FILENAME):
+    return os.path.join(folderpath, '{}_{}.npz'.format(locations_filename, SPATIAL_INDEX_SUFFIX))
+
+
+def get_snapshot_state(snapshot_filepath):
+    """Return the size [B] and mtime [ns] of the snapshot (0, 0 if missing), identifying the version a spatial index was built from"""
+    if not os.path.isfile(snapshot_filepath):
+        return 0, 0
+
+    stat = os.stat(snapshot_filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_spatial_index(folderpath, spatial_index, locations_filename=LOCATIONS_FILENAME):
+    """Save the spatial index of the snapshot just written, along with its state"""
+    snapshot_filepath, _ = get_locations_filepaths(folderpath, locations_filename)
+    snapshot_size, snapshot_mtime_ns = get_snapshot_state(snapshot_filepath)
+    spatial_index.save(get_spatial_index_filepath(folderpath, locations_filename), snapshot_size=snapshot_size, snapshot_mtime_ns=snapshot_mtime_ns)
+
+
+def read_spatial_index(folderpath, locations_filename=LOCATIONS_FILENAME):
+    """Read the saved spatial index of the snapshot, None if missing or built from another version of the snapshot"""
+    spatial_index_filepath = get_spatial_index_filepath(folderpath, locations_filename)
+    if not os.path.isfile(spatial_index_filepath):
+        return None
+
+    snapshot_filepath, _ = get_locations_filepaths(folderpath, locations_filename)
+    spatial_index, metadata = SpatialIndex.load(spatial_index_filepath)
+    if (metadata.get('snapshot_size'), metadata.get('snapshot_mtime_ns')) != get_snapshot_state(snapshot_filepath):
+        return None
+
+    return spatial_index
+
+
+def load_spatial_index(folderpath, locations_filename=LOCATIONS_FILENAME):
+    """Load the spatial index of the locations of a campaign (see spatial_index.py), in their recorded coordinates
+
+    The index saved along the snapshot is read and updated with the journaled locations. It is rebuilt from the snapshot
+    if it is missing or stale (e.g. the snapshot was replaced since), so the answer always matches load_locations.
+
+    Arguments:
+        folderpath {str} -- Folder holding {locations_filename}.json (and {locations_filename}.jsonl)
+        locations_filename {str} -- Filename (without extension) of the snapshot and the journal
+
+    Returns:
+        spatial_index [SpatialIndex]
+    """
+    snapshot_filepath, journal_filepath = get_locations_filepaths(folderpath, locations_filename)
+    journaled_locations, _, _ = read_journal(journal_filepath) # read first, as in load_locations
+    spatial_index = read_spatial_index(folderpath, locations_filename)
+    if spatial_index is None:
+        spatial_index = SpatialIndex.from_locations(read_snapshot(snapshot_filepath))
+    spatial_index.update(journaled_locations)
+
+    return spatial_index
@@ -3,6 +3,8 @@ import click
 import os 
 import json
 
+from locations_index import LocationsIndex, JOURNAL_EXTENSION
+
 CE_FOLDERNAME = 'ce'
 CE_FILENAME = 'ce'
 
@@ -25,10 +27,10 @@ def move_fingerprint_clickwrapper(x, y, src_folderpath, dest_folderpath, verbose
     """
     move_fingerprint(x, y, src_folderpath, dest_folderpath, verbose)
 
-def move_fingerprint(x, y, src_folderpath, dest_folderpath, verbose):
+def move_fingerprint(x, y, src_folderpath, dest_folderpath, verbose, locations_index=None):
     """Move {CE_FILENAME}.txt, {ELSE_FILENAME}.txt and {INFO_FILENAME}.txt to dest_folderpath for safe-keeping.
     A unique ID is assigned to the three files (one ID per triplet of files).
-    The mapping between the ID and the (x,y) coordinates is logged in the {LOCATIONS_FILENAME}.json file
+    The mapping between the ID and the (x,y) coordinates is appended to the {LOCATIONS_FILENAME} index (see LocationsIndex)
 
     Arguments:
         x {float} -- x-coordinate where the fingerprint was taken
@@ -36,6 +38,10 @@ def move_fingerprint(x, y, src_folderpath, dest_folderpath, verbose):
         src_folderpath {str} -- Folderpath where the fingerprint files (ce.txt, else.txt, info.txt) are located
         dest_folderpath {str} -- Folderpath where the ce, else and info folder will be located
         verbose {bool} -- Whether or not to enable printing
+        locations_index {LocationsIndex} -- Index of dest_folderpath, kept open across the fingerprints of a survey. Opened for this fingerprint only if None
+
+    Returns:
+        fingerprint_id {int} -- Unique ID assigned to the fingerprint
     """
 
     log('', verbose=verbose)
@@ -48,46 +54,49 @@ def move_fingerprint(x, y, src_folderpath, dest_folderpath, verbose):
                             info_foldername=INFO_FOLDERNAME, 
                             locations_filename=LOCATIONS_FILENAME,
                             verbose=verbose)
-    fingerprint_id = get_fingerprint_id(dest_folderpath, LOCATIONS_FILENAME)
-    log('', verbose=verbose)
-
-    # Move {CE_FILENAME}.txt
-    log('- Move {}.txt'.format(CE_FILENAME), verbose=verbose)
-    src_ce_filename = '{}.txt'.format(CE_FILENAME)
-    src_ce_filepath = os.path.join(src_folderpath, src_ce_filename)
-    dest_ce_folderpath = os.path.join(dest_folderpath, 'ce')
-    dest_ce_filepath = os.path.join(dest_ce_folderpath, '{}_{}_raw.txt'.format(CE_FILENAME, fingerprint_id))
-    move(src_ce_filepath, dest_ce_filepath, verbose=verbose)
-
-
-    # Move {ELSE_FILENAME}.txt
-    log('- Move {}.txt'.format(ELSE_FILENAME), verbose=verbose)
-    src_else_filename = '{}.txt'.format(ELSE_FILENAME)
-    src_else_filepath = os.path.join(src_folderpath, src_else_filename)
-    dest_else_filepath = os.path.join(dest_folderpath, 'else/{}_{}_raw.txt'.format(ELSE_FILENAME, fingerprint_id))
-    move(src_else_filepath, dest_else_filepath, verbose=verbose)
-
-
-    # Move {INFO_FILENAME}.txt
-    log('- Move {}.txt'.format(INFO_FILENAME), verbose=verbose)
-    src_info_filename = '{}.txt'.format(INFO_FILENAME)
-    src_info_filepath = os.path.join(src_folderpath, src_info_filename)
-    dest_info_filepath = os.path.join(dest_folderpath, 'info/{}_{}_raw.txt'.format(INFO_FILENAME, fingerprint_id))
-    move(src_info_filepath, dest_info_filepath, verbose=verbose)
-
-
-    # Add the saved fingerprint id to the {LOCATIONS_FILENAME}.json to keep track of its locations
-    log('- Add {}: ({}, {}) to {}.json'.format(fingerprint_id, x, y, LOCATIONS_FILENAME), end='', verbose=verbose)
-    locations = {}
-    with open('{}/{}.json'.format(dest_folderpath, LOCATIONS_FILENAME), 'r') as fp:
-        locations = json.load(fp)
-
-    with open('{}/{}.json'.format(dest_folderpath, LOCATIONS_FILENAME), 'w') as fp:
-        locations[fingerprint_id] = [float(x), float(y)]
-        json.dump(locations, fp)
+    opened_locations_index = locations_index is None
+    if opened_locations_index:
+        locations_index = LocationsIndex(dest_folderpath, LOCATIONS_FILENAME)
+    try:
+        fingerprint_id = locations_index.next_fingerprint_id
+        log('', verbose=verbose)
+
+        # Move {CE_FILENAME}.txt
+        log('- Move {}.txt'.format(CE_FILENAME), verbose=verbose)
+        src_ce_filename = '{}.txt'.format(CE_FILENAME)
+        src_ce_filepath = os.path.join(src_folderpath, src_ce_filename)
+        dest_ce_folderpath = os.path.join(dest_folderpath, 'ce')
+        dest_ce_filepath = os.path.join(dest_ce_folderpath, '{}_{}_raw.txt'.format(CE_FILENAME, fingerprint_id))
+        move(src_ce_filepath, dest_ce_filepath, verbose=verbose)
+
+
+        # Move {ELSE_FILENAME}.txt
+        log('- Move {}.txt'.format(ELSE_FILENAME), verbose=verbose)
+        src_else_filename = '{}.txt'.format(ELSE_FILENAME)
+        src_else_filepath = os.path.join(src_folderpath, src_else_filename)
+        dest_else_filepath = os.path.join(dest_folderpath, 'else/{}_{}_raw.txt'.format(ELSE_FILENAME, fingerprint_id))
+        move(src_else_filepath, dest_else_filepath, verbose=verbose)
+
+
+        # Move {INFO_FILENAME}.txt
+        log('- Move {}.txt'.format(INFO_FILENAME), verbose=verbose)
+        src_info_filename = '{}.txt'.format(INFO_FILENAME)
+        src_info_filepath = os.path.join(src_folderpath, src_info_filename)
+        dest_info_filepath = os.path.join(dest_folderpath, 'info/{}_{}_raw.txt'.format(INFO_FILENAME, fingerprint_id))
+        move(src_info_filepath, dest_info_filepath, verbose=verbose)
+
+
+        # Add the saved fingerprint id to the {LOCATIONS_FILENAME} index to keep track of its locations, once its files are in place
+        log('- Add {}: ({}, {}) to {}.{}'.format(fingerprint_id, x, y, LOCATIONS_FILENAME, JOURNAL_EXTENSION), end='', verbose=verbose)
+        locations_index.add(x, y)
+    finally:
+        if opened_locations_index: # also when a move fails, not to leak the journal's file
+            locations_index.close()
 
     log('\t Done\n', verbose=verbose)
 
+    return fingerprint_id
+
 def ensure_dest_dir_structure(dest_folderpath, ce_foldername, else_foldername, info_foldername, locations_filename, verbose):
     """Ensure that the destination directory has the following structure:
     dest_folderpath/
@@ -145,25 +154,6 @@ def ensure_dest_dir_structure(dest_folderpath, ce_foldername, else_foldername, i
             json.dump(locations, fp)
         log('Created', verbose=verbose)
 
-def get_fingerprint_id(dest_folderpath, locations_filename):
-    """Lookup the {locations_filename}.json to see which fingerprint ID is available.
-    Starts with 0 and increment by 1
-
-    Arguments:
-        dest_folderpath {str} -- Folderpath to the destination folder
-        locations_filename {str} -- Filename of the JSON file holding the locations data
-
-    Returns:
-        fingerprint_id {int} -- Unique ID linked to a fingerprint
-    """
-    with open('{}/{}.json'.format(dest_folderpath, locations_filename), 'r') as fp:
-        locations = json.load(fp)
-        fingerprint_ids = sorted(map(int, list(locations.keys())))
-        if len(fingerprint_ids) > 0:
-            return int(fingerprint_ids[-1]) + 1
-        else:
-            return 0
-
 def move(src, dest, verbose):
     log('\t Move {} to {}'.format(src, dest), end='', verbose=verbose)
     shutil.move(src, dest)
@@ -1,41 +1,43 @@
-import pandas as pd 
-import numpy as np
-import shutil
-import click 
-import json
-from os import listdir, mkdir, rename
-from os.path import join, isfile, isdir
-import glob
+import click
 
-LOCATIONS_FILENAME = 'locations'
+from transforms import AffineTransform, load_transform, save_transform
 
 @click.command()
 @click.option('--src_folderpath', prompt='Folder holding the locations.json to offset', default='')
 @click.option('--x_offset', prompt='Offset [cm] to add to the x-coordinates', default=0.0)
 @click.option('--y_offset', prompt='Offset [cm] to add to the y-coordinates', default=0.0)
-def offset_origin_locations(src_folderpath, x_offset, y_offset):
+@click.option('--rotation', default=0.0, help='Rotation [deg] (counterclockwise, around the origin) applied before the offset')
+@click.option('--scale', default=1.0, help='Scale applied before the offset')
+@click.option('--inverse', is_flag=True, help='Undo the last run, given the same offset, rotation and scale')
+@click.option('--reset', is_flag=True, help='Drop the transform, going back to the recorded coordinates')
+def offset_origin_locations(src_folderpath, x_offset, y_offset, rotation=0.0, scale=1.0, inverse=False, reset=False):
     """offset the origin of the locations.JSON
 
-    Effectively adds an offset to the x and y coordinates of each positions.
+    Effectively adds an offset to the x and y coordinates of each positions (after rotating and scaling them).
+
+    locations.json is left untouched: the offset is composed with the transform of the campaign (see transforms.py),
+    which is applied whenever its locations are read (e.g. by consolidate_fingerprints, combine_fingerprint_folders or catalog).
+    Successive runs thus stack up, and can be undone with --inverse or --reset.
 
     Arguments:
         src_folderpath {str} -- Folder holding the locations.json to offset
+        x_offset {float} -- Offset [cm] to add to the x-coordinates
+        y_offset {float} -- Offset [cm] to add to the y-coordinates
+        rotation {float} -- Rotation [deg] (counterclockwise, around the origin) applied before the offset
+        scale {float} -- Scale applied before the offset
+        inverse {bool} -- Whether to undo the last run, given the same offset, rotation and scale
+        reset {bool} -- Whether to drop the transform
     """
-    # Load the locations.json
-    locations_filepath = join(src_folderpath, '{}.json'.format(LOCATIONS_FILENAME))
-    locations = {}
-    with open(locations_filepath, 'r') as fp:
-        locations = json.load(fp)
-
-    # Offset the x and y coordinates
-    for k in locations.keys():
-        locations[k][0] += x_offset
-        locations[k][1] += y_offset
+    # Compose the transform of the campaign with the new one
+    transform = AffineTransform.from_parameters(translation=(x_offset, y_offset), rotation=rotation, scale=scale)
+    if inverse:
+        transform = transform.inverse()
+    transform = AffineTransform() if reset else load_transform(src_folderpath).then(transform)
 
-    # Save the new locations.json
-    with open(locations_filepath, 'w') as fp:
-        json.dump(locations, fp)
+    # Save the new transform.json
+    save_transform(src_folderpath, transform)
+    print('Transform of {}: {}'.format(src_folderpath, transform))
 
 
 if __name__ == '__main__':
-    offset_origin_locations() # pylint: disable=no-value-for-parameter
\ No newline at end of file
+    offset_origin_locations() # pylint: disable=no-value-for-parameter
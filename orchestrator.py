@@ -0,0 +1,261 @@
+import asyncio
+import re
+import signal
+import time
+
+from capture_watcher import CaptureWatcher
+from pose_journal import load_last_pose
+from run_continuous import (SRSUE_CONF_FILEPATH, CE_FILEPATH, CE_N_TTIS, CE_FILESIZE, N_STEPS, DISTANCE_TO_TRAVEL,
+                            THYMIO_POSITIONS_FILENAME, DEST_FOLDERPATH, INITIAL_POSITION, rm_fingerprint)
+from srsue_supervisor import ATTACH_PATTERN, LINE_BUFFERED_COMMAND, kill_sudo_children
+from survey_pipeline import PostProcessingPipeline
+from thymio import ThymioSession
+
+ASEBAMEDULLA_COMMAND = ['asebamedulla', 'ser:name=Thymio-II']
+ASEBAMEDULLA_READY_PATTERN = re.compile(r'Found Thymio-II')
+SRSUE_COMMAND = ['sudo'] + LINE_BUFFERED_COMMAND + ['srsue', SRSUE_CONF_FILEPATH]
+PING_INTERVAL = 0.2 # [s] interval between the keep-alive pings sent through the LTE connection
+
+READY_TIMEOUT = 60.0 # timeout [s] for a process to be ready (e.g. srsue to attach), before it is restarted
+RECORDING_TIMEOUT = 30.0 # timeout [s] for a fingerprint to be recorded, before srsue is restarted
+DRIVING_TIMEOUT = 60.0 # timeout [s] for the Thymio to reach the next RP, before the survey is aborted
+STOPPING_TIMEOUT = 3.0 # timeout [s] for a process to exit after SIGINT, before it is terminated then killed
+MAX_RESTARTS = 5 # Amount of times a process is restarted before the survey is aborted
+RESTART_DELAY = 1.0 # [s] delay before the first restart of a process, doubled at each restart
+N_STEP_TRIES = 3 # Amount of times a fingerprint is tried to be recorded before the survey is aborted
+
+class ManagedProcess(object):
+    def __init__(self, name, command, ready_pattern=None, max_restarts=MAX_RESTARTS, restart_delay=RESTART_DELAY, verbose=False):
+        """Supervise a long-running process: restart it when it exits, and flag when it is ready from its stdout
+
+        Arguments:
+            name {str} -- Name of the process, used in the logs
+            command {list of str} -- Command starting the process
+            ready_pattern {re.Pattern} -- Pattern of the stdout line telling that the process is ready. Ready as soon as started if None
+            max_restarts {int} -- Amount of restarts after which run raises
+            restart_delay {float} -- Delay [s] before the first restart, doubled at each restart
+            verbose {bool} -- Whether to echo the stdout of the process
+        """
+        self.name = name
+        self.command = command
+        self.ready_pattern = ready_pattern
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.verbose = verbose
+
+        self.process = None
+        self.match = None # match of ready_pattern, e.g. holding srsue's IP
+        self.ready = asyncio.Event()
+        self.down = asyncio.Event()
+        self.down.set()
+        self.n_restarts = 0
+        self.stopping = False
+
+    async def run(self):
+        """Run the process until stop is called, restarting it whenever it exits"""
+        while not self.stopping:
+            start_time = time.perf_counter()
+            self.process = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.DEVNULL,
+                                                                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            self.down.clear()
+            log('{} started (pid {})'.format(self.name, self.process.pid))
+            if self.ready_pattern is None:
+                self.ready.set()
+
+            async for line in self.process.stdout:
+                line = line.decode(errors='replace')
+                if self.verbose:
+                    print('[{}] {}'.format(self.name, line), end='')
+                if not self.ready.is_set():
+                    match = self.ready_pattern.search(line)
+                    if match is not None:
+                        self.match = match
+                        self.ready.set()
+                        log('{} ready in {:.2f}s'.format(self.name, time.perf_counter() - start_time))
+
+            returncode = await self.process.wait()
+            self.ready.clear()
+            self.down.set()
+            if self.stopping:
+                return
+
+            self.n_restarts += 1
+            if self.n_restarts > self.max_restarts:
+                raise RuntimeError('{} exited (code {}) more than {} times'.format(self.name, returncode, self.max_restarts))
+            delay = self.restart_delay * 2**(self.n_restarts - 1)
+            log('{} exited (code {}), restarting it in {:.1f}s ({}/{})'.format(self.name, returncode, delay, self.n_restarts, self.max_restarts))
+            await asyncio.sleep(delay)
+
+    async def wait_ready(self, timeout=READY_TIMEOUT):
+        """Wait for the process to be ready, restarting it if it is not within timeout [s]"""
+        while not self.ready.is_set():
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                log('{} not ready after {:.0f}s'.format(self.name, timeout))
+                await self.restart()
+
+    async def restart(self):
+        """Interrupt the process, which run then restarts"""
+        await self.interrupt()
+
+    async def stop(self):
+        """Stop the process for good"""
+        self.stopping = True
+        await self.interrupt()
+
+    async def interrupt(self):
+        """Send SIGINT to the process (then SIGTERM, then SIGKILL), and wait for it to exit
+
+        sudo cannot relay SIGKILL: the children of a process run through sudo are killed through sudo first (see kill_sudo_children).
+        If they cannot be (e.g. without a NOPASSWD rule for `kill`, see README), sudo is killed and a RuntimeError raised, aborting the survey
+        """
+        for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGKILL]:
+            if self.process is None or self.process.returncode is not None:
+                break
+            if sig == signal.SIGKILL and self.command[0] == 'sudo':
+                if not await asyncio.get_event_loop().run_in_executor(None, kill_sudo_children, self.process.pid):
+                    self.process.kill()
+                    raise RuntimeError('{} is left running as root: kill it by hand (sudo kill -KILL)'.format(self.name))
+            try:
+                self.process.send_signal(sig)
+            except ProcessLookupError:
+                break
+            try:
+                await asyncio.wait_for(self.down.wait(), STOPPING_TIMEOUT)
+            except asyncio.TimeoutError:
+                continue
+
+
+def orchestrate():
+    """Run a continuous survey from a single command, supervising everything the README's continuous mode runs by hand:
+        - asebamedulla, connecting to the Thymio II
+        - srsue, restarted if it exits or does not attach within READY_TIMEOUT
+        - ping, keeping the LTE connection alive (restarted along with srsue, as its IP may change)
+        - the survey itself: recording (see CaptureWatcher), post-processing (see PostProcessingPipeline) and driving
+
+    The constants of the survey are the ones of run_continuous.py.
+    """
+    asyncio.run(run_survey())
+
+
+async def run_survey():
+    asebamedulla = ManagedProcess('asebamedulla', ASEBAMEDULLA_COMMAND, ready_pattern=ASEBAMEDULLA_READY_PATTERN)
+    srsue = ManagedProcess('srsue', SRSUE_COMMAND, ready_pattern=ATTACH_PATTERN)
+    processes = [asebamedulla, srsue]
+
+    tasks = [asyncio.ensure_future(process.run()) for process in processes]
+    tasks.append(asyncio.ensure_future(keep_alive(srsue)))
+    survey_task = asyncio.ensure_future(survey(asebamedulla, srsue))
+    try:
+        done, _ = await asyncio.wait(tasks + [survey_task], return_when=asyncio.FIRST_COMPLETED) # a supervising task only ends by raising
+        for task in done:
+            task.result()
+    finally:
+        survey_task.cancel()
+        for process in processes:
+            await process.stop()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, survey_task, return_exceptions=True)
+
+
+async def keep_alive(srsue):
+    """Ping the IP assigned at srsue's attach whenever srsue is attached, so that the connection does not time out
+
+    Raises the RuntimeError of ping exiting more than MAX_RESTARTS times, which aborts the survey (see run_survey)
+    """
+    while True:
+        await srsue.ready.wait()
+        ping = ManagedProcess('ping', ['ping', '-i', str(PING_INTERVAL), srsue.match.group(1)])
+        ping_task = asyncio.ensure_future(ping.run())
+        down_task = asyncio.ensure_future(srsue.down.wait())
+        try:
+            await asyncio.wait([down_task, ping_task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            down_task.cancel()
+            await ping.stop()
+            ping_task.cancel()
+            result, = await asyncio.gather(ping_task, return_exceptions=True)
+        if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError): # e.g. ping exceeding its restarts
+            raise result
+
+
+async def survey(asebamedulla, srsue):
+    """Record N_STEPS fingerprints, moving the Thymio by DISTANCE_TO_TRAVEL cm between each"""
+    loop = asyncio.get_event_loop()
+    start_time = time.time()
+    last_position, last_heading = INITIAL_POSITION, 0.0
+    n_stops = 0 # Amount of stops already journaled
+    last_pose = load_last_pose(DEST_FOLDERPATH, THYMIO_POSITIONS_FILENAME)
+    if last_pose is not None:
+        last_position, last_heading = [last_pose['x'], last_pose['y']], last_pose['heading'] or 0.0
+        n_stops = last_pose['stop_id'] + 1
+        log('Already {} fingerprints found in {}/'.format(n_stops, DEST_FOLDERPATH))
+
+    pipeline = PostProcessingPipeline(DEST_FOLDERPATH)
+    thymio = None
+    try:
+        for step in range(N_STEPS):
+            log('Fingerprint #{} in [{:.2f}, {:.2f}]'.format(step + n_stops, last_position[0], last_position[1]))
+            for n_try in range(1, N_STEP_TRIES + 1):
+                await srsue.wait_ready()
+                rm_fingerprint()
+                progress = await loop.run_in_executor(None, wait_for_capture, RECORDING_TIMEOUT)
+                if progress.reached_criterion is not None:
+                    break
+                log('Fingerprint not recorded after {:.0f}s ({}/{}), restarting srsue'.format(RECORDING_TIMEOUT, n_try, N_STEP_TRIES))
+                await srsue.restart()
+            else:
+                raise RuntimeError('Fingerprint #{} could not be recorded'.format(step + n_stops))
+
+            log('{} limit reached: {} intact records, {} TTIs ({:.2f}s)'.format(progress.reached_criterion, progress.n_records, progress.n_ttis, progress.duration))
+            await loop.run_in_executor(None, pipeline.submit, last_position[0], last_position[1], './') # blocks if the post-processing is behind
+
+            await asebamedulla.wait_ready()
+            if thymio is None: # connect once asebamedulla is up, then keep the session (and the Thymio's pose) for the whole survey
+                thymio = await loop.run_in_executor(None, connect_thymio, last_position, last_heading)
+            try:
+                last_position = await asyncio.wait_for(asyncio.wrap_future(thymio.advance(DISTANCE_TO_TRAVEL)), DRIVING_TIMEOUT)
+            except asyncio.TimeoutError:
+                log('Thymio not arrived after {:.0f}s, stopping it'.format(DRIVING_TIMEOUT))
+                await stop_thymio(thymio)
+                raise RuntimeError('The Thymio did not travel {} cm within {:.0f}s'.format(DISTANCE_TO_TRAVEL, DRIVING_TIMEOUT))
+            log('Thymio moved to [{:.2f}, {:.2f}]'.format(last_position[0], last_position[1]))
+    finally:
+        if thymio is not None:
+            await stop_thymio(thymio) # the motors would otherwise keep their last targets, e.g. when the survey is aborted while driving
+            await loop.run_in_executor(None, thymio.close, STOPPING_TIMEOUT) # does not wait for a Thymio stuck before its goal
+        await loop.run_in_executor(None, pipeline.close)
+
+    log('Survey took {}'.format(time.strftime('%H:%M:%S', time.gmtime(time.time() - start_time))))
+
+
+async def stop_thymio(thymio):
+    """Set the Thymio's motor targets to 0 (see ThymioSession.stop), logging rather than raising if it cannot be reached"""
+    try:
+        await asyncio.get_event_loop().run_in_executor(None, thymio.stop)
+    except Exception as e: # pylint: disable=broad-except
+        log('Could not stop the Thymio: {}: {}'.format(type(e).__name__, e))
+
+
+def wait_for_capture(timeout):
+    """Block until ce.txt holds enough intact records (see CaptureWatcher.wait_for_capture), or until timeout [s]"""
+    with CaptureWatcher(CE_FILEPATH) as watcher:
+        return watcher.wait_for_capture(n_ttis=CE_N_TTIS, filesize=CE_FILESIZE * 1e6, timeout=timeout)
+
+
+def connect_thymio(last_position, last_heading):
+    """Start a ThymioSession from last_position and last_heading, through asebamedulla (blocking)"""
+    return ThymioSession(initial_position=last_position,
+                         positions_filename=THYMIO_POSITIONS_FILENAME,
+                         dest_folderpath=DEST_FOLDERPATH,
+                         initial_heading=last_heading)
+
+
+def log(string):
+    print('[{}] {}'.format(time.strftime('%H:%M:%S'), string))
+
+
+if __name__ == '__main__':
+    orchestrate()
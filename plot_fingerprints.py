@@ -1,54 +1,77 @@
 import click 
 import seaborn as sns 
-import pandas as pd 
 import matplotlib.pyplot as plt
 
 from os.path import join
-from os import listdir
+from os import listdir, getpid
+from datetime import datetime
+
+from instrumentation import measure, profiled, write_records
+from radio_map import RadioMap
 
 CE_FOLDERNAME = 'ce'
 CE_FILENAME = 'ce'
 
 N_TTI_TO_PLOT = 5 # # of TTIs to plot
+PLOT_COLUMNS = ['TTI', 'SC_ID', 'CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE'] # only columns read from the .parquet
 
 @click.command()
 @click.option('--src_folderpath', prompt='Folder where the ce, else and info folder are located', default='')
 @click.option('--force', '-f', is_flag=True, help='Whether to replot already plotted files')
-def plot_fingerprints(src_folderpath, force):
+@click.option('--profile', is_flag=True, help='Whether to dump a cProfile of the plotting')
+def plot_fingerprints(src_folderpath, force, profile):
     """Plot a sample of the channel estimates located in src_folderpath/CE_FOLDERNAME
     The plot is saved in src_folderpath 
 
     If --force is set, then the already plotted .parquet are replotted
 
+    The wall time, bytes read/written and peak memory of the reading and plotting of each .parquet are appended to 
+    src_folderpath/instrumentation.jsonl (see instrumentation.py).
+    If --profile is set, the plotting is also profiled to src_folderpath/profiles/plot_fingerprints.prof
+
     Arguments:
         src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
+        profile {bool} -- Whether to profile the plotting
     """
+    records = []
+    with measure(records, 'total'), profiled(src_folderpath, 'plot_fingerprints', enabled=profile):
+        plot(src_folderpath, force, records)
+
+    write_records(src_folderpath, records, command='plot_fingerprints', run_started_at=datetime.now().isoformat(timespec='seconds'), pid=getpid())
+
+def plot(src_folderpath, force, records):
+    """Body of plot_fingerprints, measuring the reading and plotting of each .parquet in records"""
 
     src_ce_folderpath = join(src_folderpath, CE_FOLDERNAME)
+    radio_map = RadioMap(src_folderpath, cache_size=0) # each fingerprint is read once
 
-    cleaned_ce_files = [f.split('.')[0] for f in listdir(src_ce_folderpath) if f.split('.')[-1] == 'parquet'] # list all .parquet file in ce_folderpath
+    fingerprint_ids = radio_map.list_fingerprint_ids(located_only=False) # fingerprints whose ce .parquet is in ce_folderpath, with or without a location
     
     if not force:
-        ce_pngs = [f.split('.')[0] for f in listdir(src_ce_folderpath) if f.split('.')[-1] == 'png'] # list all .png file in ce_folderpath
-        cleaned_ce_files = sorted(list(set(cleaned_ce_files) - set(ce_pngs)))
+        ce_pngs = set(f.split('.')[0] for f in listdir(src_ce_folderpath) if f.split('.')[-1] == 'png') # list all .png file in ce_folderpath
+        fingerprint_ids = [fingerprint_id for fingerprint_id in fingerprint_ids if '{}_{}'.format(CE_FILENAME, fingerprint_id) not in ce_pngs]
 
     print('')
-    print('Plot {} .parquet files in {}/\n'.format(len(cleaned_ce_files), src_ce_folderpath))
-    for f in cleaned_ce_files:
+    print('Plot {} .parquet files in {}/\n'.format(len(fingerprint_ids), src_ce_folderpath))
+    for fingerprint_id in fingerprint_ids:
+        f = '{}_{}'.format(CE_FILENAME, fingerprint_id)
         print('\t {}.parquet: '.format(f), end='')
-        ce_df = pd.read_parquet(join(src_ce_folderpath, '{}.parquet'.format(f)))
+        with measure(records, 'plot_read', filename=f):
+            ce_df = radio_map.load_ce(fingerprint_id, columns=PLOT_COLUMNS, cache=False)
         ttis = sorted(ce_df.TTI.unique())[:N_TTI_TO_PLOT] # list of TTIs to plot
         
         # Plot
-        _, axes = plt.subplots(4, 1, figsize=(5, 15), sharex=True)
+        with measure(records, 'plot_draw', filename=f):
+            _, axes = plt.subplots(4, 1, figsize=(5, 15), sharex=True)
 
-        for ax, y in zip(axes, ['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']):
-            sns.lineplot(x='SC_ID', y=y, hue='TTI', data=ce_df[ce_df.TTI.apply(lambda tti: tti in ttis)], legend=False, ax=ax)
+            for ax, y in zip(axes, ['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']):
+                sns.lineplot(x='SC_ID', y=y, hue='TTI', data=ce_df[ce_df.TTI.apply(lambda tti: tti in ttis)], legend=False, ax=ax)
 
-        plt.suptitle('{}\n {} TTIs'.format(f, len(ttis)))
+            plt.suptitle('{}\n {} TTIs'.format(f, len(ttis)))
 
-        plot_filename = '{}.png'.format(f.split('.')[0])
-        plt.savefig(join(src_ce_folderpath, plot_filename))
+        with measure(records, 'plot_save', filename=f):
+            plot_filename = '{}.png'.format(f.split('.')[0])
+            plt.savefig(join(src_ce_folderpath, plot_filename))
         print('Plotted')
 
 if __name__ == '__main__':
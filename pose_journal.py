@@ -0,0 +1,202 @@
+import ast
+import click
+import json
+import os
+import time
+
+from atomic_write import write_atomically
+
+JOURNAL_EXTENSION = 'jsonl' # {positions_filename}.jsonl, as opposed to the legacy {positions_filename}.txt
+TAIL_BLOCKSIZE = 4096 # [B] size of the blocks read backwards from the end of the journal, to find its last pose
+
+class PoseJournal(object):
+    def __init__(self, filepath):
+        """Append-only journal of the poses where the Thymio stopped, one JSON record per line:
+            {"stop_id": 0, "timestamp": 1600000000.0, "x": 1.02, "y": 0.0, "heading": 0.0}
+
+        Each record is fsync'd as soon as it is appended, so that a crash loses at most the record being written.
+        Such a torn last line is truncated when the journal is opened again.
+
+        Arguments:
+            filepath {str} -- Filepath of the journal (e.g. dev/thymio_positions.jsonl), created if missing
+        """
+        self.filepath = filepath
+        last_pose = truncate_torn_tail(filepath) if os.path.isfile(filepath) else None
+        self.n_stops = 0 if last_pose is None else last_pose['stop_id'] + 1
+        self.fp = open(filepath, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def append(self, position, heading, timestamp=None):
+        """Append the pose of the next stop, and flush it to disk
+
+        Arguments:
+            position {List of 2 floats} -- (x,y) coordinates [cm] of the stop
+            heading {float} -- Heading [rad] of the Thymio at the stop
+            timestamp {float} -- Time [s since epoch] of the stop. Now if None
+
+        Returns:
+            pose [dict] -- The appended record
+        """
+        pose = {'stop_id': self.n_stops,
+                'timestamp': time.time() if timestamp is None else timestamp,
+                'x': float(position[0]),
+                'y': float(position[1]),
+                'heading': None if heading is None else float(heading)}
+        self.fp.write(json.dumps(pose) + '\n')
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.n_stops += 1
+
+        return pose
+
+    def close(self):
+        self.fp.close()
+
+
+def get_journal_filepath(dest_folderpath, positions_filename):
+    return os.path.join(dest_folderpath, '{}.{}'.format(positions_filename, JOURNAL_EXTENSION))
+
+
+def read_last_pose(filepath):
+    """Read the last complete record of the journal, reading its tail only (i.e. in O(1) of the amount of stops)
+
+    Arguments:
+        filepath {str} -- Filepath of the journal
+
+    Returns:
+        last_pose [dict] -- Last record (see PoseJournal), None if the journal holds none
+    """
+    last_pose, _ = find_last_pose(filepath)
+    return last_pose
+
+
+def find_last_pose(filepath):
+    """Read blocks backwards from the end of the journal, until a complete and valid record is found
+
+    Returns:
+        last_pose [dict] -- Last record, None if the journal holds none
+        end [int] -- Offset [B] right after the last record (i.e. where a torn line starts), 0 if there is none
+    """
+    with open(filepath, 'rb') as fp:
+        end = fp.seek(0, os.SEEK_END)
+        tail = b''
+        while end > 0:
+            start = max(end - TAIL_BLOCKSIZE, 0)
+            fp.seek(start)
+            tail = fp.read(end - start) + tail
+            end = start
+
+            # The part after the last newline is a torn line (or b''), and the first line is cut unless the start of the file is reached
+            lines = tail.split(b'\n')
+            line_end = start + len(tail) - len(lines[-1]) # offset right after the newline ending the line
+            for line in reversed(lines[(0 if start == 0 else 1):-1]):
+                try:
+                    return json.loads(line.decode()), line_end
+                except ValueError:
+                    line_end -= len(line) + 1
+
+    return None, 0
+
+
+def truncate_torn_tail(filepath):
+    """Truncate whatever follows the last complete record of the journal (e.g. a line torn by a crash)
+
+    Returns:
+        last_pose [dict] -- Last record, None if the journal holds none
+    """
+    last_pose, end = find_last_pose(filepath)
+    if os.path.getsize(filepath) > end:
+        print('Truncating {} torn bytes at the end of {}'.format(os.path.getsize(filepath) - end, filepath))
+        with open(filepath, 'r+b') as fp:
+            fp.truncate(end)
+
+    return last_pose
+
+
+def load_poses(filepath):
+    """Load every complete record of the journal
+
+    Returns:
+        poses [List of dict] -- Records (see PoseJournal), in the order of the stops
+    """
+    poses = []
+    with open(filepath, 'r') as fp:
+        for line in fp:
+            if not line.endswith('\n'):
+                break
+            try:
+                poses.append(json.loads(line))
+            except ValueError:
+                continue
+
+    return poses
+
+
+def load_last_pose(dest_folderpath, positions_filename):
+    """Infer where the Thymio last stopped, from {positions_filename}.jsonl in dest_folderpath
+    The legacy {positions_filename}.txt is converted first if it is the only one there
+
+    Returns:
+        last_pose [dict] -- Last record (see PoseJournal), None if the Thymio never stopped
+    """
+    journal_filepath = get_journal_filepath(dest_folderpath, positions_filename)
+    legacy_filepath = os.path.join(dest_folderpath, '{}.txt'.format(positions_filename))
+    if not os.path.isfile(journal_filepath):
+        if not os.path.isfile(legacy_filepath):
+            return None
+        convert_positions(legacy_filepath, journal_filepath)
+
+    return read_last_pose(journal_filepath)
+
+
+@click.command()
+@click.argument('src_filepath')
+@click.option('--dest_filepath', default=None, help='Filepath of the journal to write. {src_filepath} with a .jsonl extension if None')
+def convert_positions_clickwrapper(src_filepath, dest_filepath):
+    """ Wrapper for click functionality
+    """
+    convert_positions(src_filepath, dest_filepath)
+
+def convert_positions(src_filepath, dest_filepath=None):
+    """Convert a legacy positions file (one "[x, y]" per line, e.g. thymio_positions.txt) into a journal (see PoseJournal),
+    or compact a journal (dropping its torn and invalid lines, and renumbering its stops)
+
+    The legacy format holds neither the time nor the heading of the stops: their timestamp and heading are set to None.
+
+    Arguments:
+        src_filepath {str} -- Filepath of the legacy positions file, or of a journal
+        dest_filepath {str} -- Filepath of the journal to write. {src_filepath} with a .jsonl extension if None
+
+    Returns:
+        n_stops [int] -- Amount of stops written
+    """
+    if dest_filepath is None:
+        dest_filepath = '{}.{}'.format(os.path.splitext(src_filepath)[0], JOURNAL_EXTENSION)
+
+    if src_filepath.endswith('.{}'.format(JOURNAL_EXTENSION)):
+        poses = load_poses(src_filepath)
+    else:
+        with open(src_filepath, 'r') as fp:
+            positions = [ast.literal_eval(line) for line in fp if line.strip()]
+        poses = [{'x': x, 'y': y, 'timestamp': None, 'heading': None} for x, y in positions]
+
+    def write(filepath):
+        with open(filepath, 'w') as fp:
+            for stop_id, pose in enumerate(poses):
+                fp.write(json.dumps({'stop_id': stop_id, 'timestamp': pose['timestamp'], 'x': float(pose['x']), 'y': float(pose['y']),
+                                     'heading': pose['heading']}) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+    write_atomically(dest_filepath, write)
+    print('{} stops written to {}'.format(len(poses), dest_filepath))
+
+    return len(poses)
+
+
+if __name__ == '__main__':
+    convert_positions_clickwrapper() # pylint: disable=no-value-for-parameter
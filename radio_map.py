@@ -0,0 +1,178 @@
+import os
+import pandas as pd
+import numpy as np
+from collections import OrderedDict
+from os.path import join, isdir
+
+from consolidate_fingerprints import (list_cleaned_filepaths, load_cleaned_fingerprint, CE_FOLDERNAME, CE_FILENAME,
+                                      ELSE_FILENAME, INFO_FILENAME, LOCATIONS_FILENAME)
+from locations_index import load_locations, load_spatial_index
+from spatial_index import SpatialIndex
+from transforms import load_transform, load_transformed_locations
+
+CACHE_SIZE = 256 # [MB] memory held by the decoded fingerprints cached by a RadioMap
+BATCH_SIZE = 32 # Amount of fingerprints per batch of RadioMap.iter_batches
+
+class RadioMap(object):
+    def __init__(self, folderpath, cache_size=CACHE_SIZE, transformed=True):
+        """Read access to the cleaned fingerprints of a campaign folder (its ce, else and info folders and its locations.json),
+        for scripts and notebooks to stop listing and re-reading the files themselves
+
+        Nothing is read when the radio map is created: the locations are read at the first call needing them, and each
+        cleaned file when it is loaded. The decoded files are kept in a least-recently-used cache of at most {cache_size} MB,
+        so that loading a fingerprint again does not read it again.
+        The cached DataFrames are shared with the caller: copy them before modifying them in place.
+
+        Arguments:
+            folderpath {str} -- Folder of the campaign
+            cache_size {float} -- Maximum memory [MB] held by the cached DataFrames. 0 to disable the cache
+            transformed {bool} -- Whether the locations have the campaign's transform applied (see transforms.py)
+        """
+        self.folderpath = folderpath
+        self.cache_size = cache_size * 1e6
+        self.transformed = transformed
+        self.locations = None
+        self.spatial_index = None
+        self.cache = OrderedDict() # (filename, fingerprint_id, columns) -> DataFrame, least recently used first
+        self.cache_nbytes = 0
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def get_locations(self):
+        """Return the "Fingerprint ID" -> [x,y] mapping, read once"""
+        if self.locations is None:
+            self.locations = (load_transformed_locations if self.transformed else load_locations)(self.folderpath, LOCATIONS_FILENAME)
+        return self.locations
+
+    def get_spatial_index(self):
+        """Return the spatial index of the locations (see spatial_index.py), in the same coordinates as get_locations, loaded once
+
+        The index saved with the campaign holds the recorded coordinates: it is rebuilt in memory if the campaign has a transform.
+        """
+        if self.spatial_index is None:
+            if self.transformed and not load_transform(self.folderpath).is_identity():
+                self.spatial_index = SpatialIndex.from_locations(self.get_locations())
+            else:
+                self.spatial_index = load_spatial_index(self.folderpath, LOCATIONS_FILENAME)
+        return self.spatial_index
+
+    def get_location(self, fingerprint_id):
+        return self.get_locations()[str(fingerprint_id)]
+
+    def list_fingerprint_ids(self, cleaned_only=True, located_only=True):
+        """List the fingerprint IDs, without loading any of them
+
+        Arguments:
+            cleaned_only {bool} -- Whether to only list the fingerprints whose ce file is cleaned (from a single listing of the ce folder)
+            located_only {bool} -- Whether to only list the fingerprints of locations.json. If False, the IDs are listed from the
+                                   cleaned ce files alone, without reading locations.json (e.g. for a ce folder copied without it)
+
+        Returns:
+            fingerprint_ids [list of int] -- Sorted (ascending)
+        """
+        if located_only:
+            fingerprint_ids = sorted(map(int, self.get_locations().keys()))
+            if not cleaned_only:
+                return fingerprint_ids
+
+        ce_folderpath = join(self.folderpath, CE_FOLDERNAME)
+        filenames = set(os.listdir(ce_folderpath)) if isdir(ce_folderpath) else set()
+        if not located_only:
+            return sorted(parse_fingerprint_id(filename) for filename in filenames if parse_fingerprint_id(filename) is not None)
+
+        return [fingerprint_id for fingerprint_id in fingerprint_ids if '{}_{}.parquet'.format(CE_FILENAME, fingerprint_id) in filenames]
+
+    def load_ce(self, fingerprint_id, columns=None, cache=True):
+        return self.load(fingerprint_id, CE_FILENAME, columns, cache)
+
+    def load_else(self, fingerprint_id, columns=None, cache=True):
+        return self.load(fingerprint_id, ELSE_FILENAME, columns, cache)
+
+    def load_info(self, fingerprint_id, columns=None, cache=True):
+        return self.load(fingerprint_id, INFO_FILENAME, columns, cache)
+
+    def load(self, fingerprint_id, filename=CE_FILENAME, columns=None, cache=True):
+        """Load one cleaned file of the fingerprint {fingerprint_id}, from the cache if it holds it
+
+        Arguments:
+            fingerprint_id {int} -- ID of the fingerprint
+            filename {str} -- Which file to load (CE_FILENAME, ELSE_FILENAME or INFO_FILENAME)
+            columns {list of str} -- Columns to load (only those are read from a .parquet). All of them if None
+            cache {bool} -- Whether to cache the loaded DataFrame (e.g. False when going once through the whole campaign)
+
+        Returns:
+            [pd.DataFrame]
+        """
+        fingerprint_id = int(fingerprint_id)
+        key = (filename, fingerprint_id, None if columns is None else tuple(columns))
+        for cached_key in [key, (filename, fingerprint_id, None)]: # the columns can be projected from the whole cached DataFrame
+            df = self.cache.get(cached_key)
+            if df is not None:
+                self.cache.move_to_end(cached_key)
+                self.n_hits += 1
+                return df if cached_key == key else df[list(columns)]
+
+        self.n_misses += 1
+        filepath = list_cleaned_filepaths(self.folderpath, fingerprint_id)[[CE_FILENAME, ELSE_FILENAME, INFO_FILENAME].index(filename)]
+        df = load_cleaned_fingerprint(filepath, None if columns is None else list(columns))
+        if cache:
+            self.add_to_cache(key, df)
+
+        return df
+
+    def add_to_cache(self, key, df):
+        """Cache df, evicting the least recently used DataFrames beyond cache_size"""
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.cache_size:
+            return
+
+        self.cache[key] = df
+        self.cache_nbytes += nbytes
+        while self.cache_nbytes > self.cache_size:
+            _, evicted_df = self.cache.popitem(last=False)
+            self.cache_nbytes -= int(evicted_df.memory_usage(deep=True).sum())
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.cache_nbytes = 0
+
+    def get_cache_info(self):
+        """Return the hits, misses, amount of cached DataFrames and their size [MB]"""
+        return {'n_hits': self.n_hits, 'n_misses': self.n_misses, 'n_cached': len(self.cache), 'cache_mb': self.cache_nbytes / 1e6}
+
+    def iter_batches(self, batch_size=BATCH_SIZE, fingerprint_ids=None, filename=CE_FILENAME, columns=None):
+        """Iterate over the fingerprints by batches, each as a single DataFrame with the FINGERPRINT_ID, X and Y columns
+        (like the consolidated radio map, see consolidate_fingerprints.py)
+
+        The fingerprints already cached are taken from the cache, the others are read without being cached,
+        so that going through the whole campaign does not evict the cache.
+
+        Arguments:
+            batch_size {int} -- Amount of fingerprints per batch
+            fingerprint_ids {list of int} -- Fingerprints to iterate over. All the cleaned ones if None
+            filename {str} -- Which file to load (CE_FILENAME, ELSE_FILENAME or INFO_FILENAME)
+            columns {list of str} -- Columns to load. All of them if None
+
+        Yields:
+            [pd.DataFrame] -- One row per record of the batch's fingerprints
+        """
+        fingerprint_ids = self.list_fingerprint_ids() if fingerprint_ids is None else list(fingerprint_ids)
+        for start in range(0, len(fingerprint_ids), batch_size):
+            dfs = []
+            for fingerprint_id in fingerprint_ids[start:start + batch_size]:
+                df = self.load(fingerprint_id, filename, columns, cache=False)
+                x, y = self.get_location(fingerprint_id)
+                dfs.append(df.assign(FINGERPRINT_ID=np.int64(fingerprint_id), X=np.float64(x), Y=np.float64(y)))
+
+            batch_df = pd.concat(dfs, ignore_index=True)
+            yield batch_df[['FINGERPRINT_ID', 'X', 'Y'] + [column for column in batch_df.columns if column not in ['FINGERPRINT_ID', 'X', 'Y']]]
+
+
+def parse_fingerprint_id(filename):
+    """Return the fingerprint ID of a cleaned ce filename ({CE_FILENAME}_{id}.parquet), None for any other file"""
+    prefix, suffix = '{}_'.format(CE_FILENAME), '.parquet'
+    if not (filename.startswith(prefix) and filename.endswith(suffix)):
+        return None
+
+    fingerprint_id = filename[len(prefix):-len(suffix)]
+    return int(fingerprint_id) if fingerprint_id.isdigit() else None
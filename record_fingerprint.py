@@ -1,64 +1,80 @@
-import os
 import subprocess
 import time
-from threading import Timer
+
+from capture_watcher import CaptureWatcher
+from srsue_supervisor import SrsueSupervisor
 
 RECORDING_TIMEOUT = 30.0 # timeout [s] afterwhich the fingerprint recording process is killed
-CLOSING_SRSLTE_TIMEOUT = 3.0 # timeout [s] to wait for srsLTE to close
+CLOSING_SRSLTE_TIMEOUT = 3.0 # timeout [s] to wait for srsLTE to exit after SIGINT, before terminating it
+EXIT_CHECK_INTERVAL = 1.0 # [s] interval at which to check whether srsue exited early, while recording
 N_RECORDING_TRY_UPPER_LIMIT = 10 # Amount of time we try recording a fingerprint before giving up
 
-def record_fingerprint(conf_filepath, ce_filepath, ce_filesize, verbose=False):
-    """Record a fingerprint by running `sudo srsue {conf_filepath}` for {duration} seconds
+def record_fingerprint(conf_filepath, ce_filepath, ce_filesize=None, verbose=False, n_records=None, n_ttis=None, duration=None, srsue_command=None):
+    """Record a fingerprint by running `sudo srsue {conf_filepath}` until {ce_filepath} holds enough intact records
+
+    The growing ce file is parsed incrementally (see CaptureWatcher.wait_for_capture), and the recording stops
+    as soon as one of the given criteria (n_records, n_ttis, duration or ce_filesize) is met.
+
+    srsue is run by a SrsueSupervisor: its network attach is detected from its stdout, 
+    and it is stopped as soon as the fingerprint is recorded (or srsue exits), waiting for its actual exit rather than a fixed time.
     
     Arguments:
         conf_filepath [str] -- Filepath to `ue.conf`
         ce_filepath [str] -- Filename to the file holding the ce fingerprint (typically ce.txt)
-        ce_filesize [float] -- Size [MB] of the ce.txt before stopping the fingerprint's recording
+        ce_filesize [float] -- Size [MB] of the ce.txt before stopping the fingerprint's recording, regardless of its content
         verbose [bool] -- whether to be verbose
+        n_records [int] -- Amount of intact ce records before stopping the fingerprint's recording
+        n_ttis [int] -- Amount of distinct TTIs before stopping the fingerprint's recording
+        duration [float] -- Time [s] spanned by the TTIs of the intact records before stopping the fingerprint's recording
+        srsue_command [list of str] -- Command running srsue (see SrsueSupervisor), e.g. simulation.FAKE_SRSUE_COMMAND
+
+    Returns:
+        attempts [list of dict] -- One dict per recording try, with its attach latency [s] (None if not attached) and stopping time [s]
     """
 
     subprocess.run('touch ./ce.txt', shell=True)
     subprocess.run('touch ./else.txt', shell=True)
     subprocess.run('touch ./info.txt', shell=True)
 
+    supervisor = SrsueSupervisor(conf_filepath, verbose=verbose, command=srsue_command)
     fingerprint_is_recorded = False
     give_up = False
     n_recording_try = 0
-    start_time = time.perf_counter()
     while (not fingerprint_is_recorded) and (not give_up):
-        start_recording(conf_filepath=conf_filepath, verbose=verbose)
+        supervisor.start()
         n_recording_try += 1
+        start_time = time.perf_counter()
 
-        while True:
-            if time.perf_counter() - start_time > RECORDING_TIMEOUT: # check if RECORDING_TIMEOUT has elapsed since we last started to try recording a fingerprint
-                print(f'\t \t Timeout ({RECORDING_TIMEOUT}s) reached')
-                if n_recording_try < N_RECORDING_TRY_UPPER_LIMIT:
-                    start_time = time.perf_counter()
-                    print('\t \t Trying again...')  
-                else:
-                    print('\t \t Giving up...')  
-                    give_up = True
-                break
-
-            time.sleep(0.5)
-
-            if os.path.isfile(ce_filepath): # check if ce.txt has reached {ce_filesize} MB
-                size = os.stat(ce_filepath).st_size # size of filepath in Bytes
-                if size > ce_filesize * 1e6: # ce_filesize in is MB, size in B
-                    print('\t \t ce.txt filesize ({:.2f} MB) limit ({} MB) reached'.format(size/1e6, ce_filesize))
-                    fingerprint_is_recorded = True
+        progress = None
+        with CaptureWatcher(ce_filepath) as watcher: # sleeps until srsue writes to ce.txt, instead of polling every 0.5s
+            while supervisor.is_running() and time.perf_counter() - start_time < RECORDING_TIMEOUT:
+                progress = watcher.wait_for_capture(n_records=n_records, n_ttis=n_ttis, duration=duration, 
+                                                    filesize=None if ce_filesize is None else ce_filesize * 1e6, # ce_filesize in is MB, filesize in B
+                                                    timeout=min(EXIT_CHECK_INTERVAL, RECORDING_TIMEOUT - (time.perf_counter() - start_time)), 
+                                                    progress=progress)
+                if progress.reached_criterion is not None:
                     break
-        
-        stop_recording()
-        time.sleep(CLOSING_SRSLTE_TIMEOUT)
 
-def start_recording(conf_filepath, verbose=False):
-    command = f'sudo ./record_fingerprint.sh {conf_filepath}'
-    if verbose:
-        subprocess.run(command, shell=True)
-    else:
-        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
+        if progress is not None and progress.reached_criterion is not None:
+            print('\t \t {} limit reached: {} intact records, {} TTIs ({:.2f}s), {:.2f} MB, growing at {:.2f} MB/s'.format(
+                progress.reached_criterion, progress.n_records, progress.n_ttis, progress.duration, progress.filesize/1e6, watcher.growth_rate/1e6))
+            fingerprint_is_recorded = True
+        else:
+            if supervisor.is_running(): # RECORDING_TIMEOUT has elapsed since we last started to try recording a fingerprint
+                print(f'\t \t Timeout ({RECORDING_TIMEOUT}s) reached')
+            else:
+                print('\t \t srsue exited early (code {})'.format(supervisor.process.returncode))
+            if n_recording_try < N_RECORDING_TRY_UPPER_LIMIT:
+                print('\t \t Trying again...')  
+            else:
+                print('\t \t Giving up...')  
+                give_up = True
+
+        supervisor.stop(timeout=CLOSING_SRSLTE_TIMEOUT)
+        attempt = supervisor.attempts[-1]
+        print('\t \t Attempt #{}: {}, srsue stopped in {:.2f}s'.format(
+            n_recording_try, 
+            'not attached' if attempt['attach_latency'] is None else 'attached in {:.2f}s'.format(attempt['attach_latency']),
+            attempt['stopping_time']))
 
-def stop_recording():
-    command = 'sudo pkill -INT srsue'
-    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=True)
+    return supervisor.attempts
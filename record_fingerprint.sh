@@ -1,3 +0,0 @@
-#!/bin/bash
-
-sudo srsue $1 &
\ No newline at end of file
@@ -2,67 +2,89 @@ import os
 import time
 import subprocess
 
+from capture_watcher import CaptureWatcher
 from move_fingerprint import move_fingerprint
 from record_fingerprint import record_fingerprint
-from thymio import Thymio
+from survey_pipeline import PostProcessingPipeline
+from simulation import SimulatedAsebaNetwork, SimulatedMainLoop
+from pose_journal import load_last_pose
+from thymio import ThymioSession
 
 STARTING_TIMER = 20 # Timer [s] before starting, in case you need to exit the room
 SRSUE_CONF_FILEPATH = '../srsLTE-modified/srsue/ue-digital-lab.conf'
 CE_FILEPATH = 'ce.txt'
-CE_FILESIZE = 20 # Filesize [MB] above which the recording is stopped
+CE_N_TTIS = 1000 # Amount of distinct TTIs (i.e. ms) of intact ce records above which the recording is stopped
+CE_FILESIZE = 40 # Filesize [MB] above which the recording is stopped, even if CE_N_TTIS is not reached
 N_STEPS = 5 # Amount of RPs to gather
 DISTANCE_TO_TRAVEL = 1 # [cm] distance between each RP
 THYMIO_POSITIONS_FILENAME = 'thymio_positions'
+PIPELINED = True # Whether to move and clean each fingerprint in the background, while the Thymio drives to the next RP
 DEST_FOLDERPATH = 'line-7'
+SIMULATION = False # Whether to drive a simulated Thymio (see simulation.py) instead of the real one
 
 INITIAL_POSITION = [0,0]
 
 def run():
     start_time = time.time()
     last_position = INITIAL_POSITION # (x,y) coordinates of the position where the Thymio last stopped
+    last_heading = 0.0 # [rad] heading of the Thymio at that position
+    n_stops = 0 # Amount of stops already journaled
 
-    # Inspect {THYMIO_POSITIONS_FILENAME}.txt to infer the Thymio's absolute position    
-    thymio_positions_filepath = os.path.join(DEST_FOLDERPATH, f'{THYMIO_POSITIONS_FILENAME}.txt')    
-    positions = []
-
-    if os.path.isfile(thymio_positions_filepath):
-        with open(thymio_positions_filepath, 'r') as fp:
-            positions = [line.rstrip() for line in fp.readlines()]
-        last_position = eval(positions[-1])
-        print('Already {} fingerprints found in {}/ \n'.format(len(positions), DEST_FOLDERPATH))
+    # Resume from the last pose of the {THYMIO_POSITIONS_FILENAME}.jsonl journal, to infer the Thymio's absolute position
+    last_pose = load_last_pose(DEST_FOLDERPATH, THYMIO_POSITIONS_FILENAME)
+    if last_pose is not None:
+        last_position, last_heading = [last_pose['x'], last_pose['y']], last_pose['heading'] or 0.0 # the legacy .txt has no heading
+        n_stops = last_pose['stop_id'] + 1
+        print('Already {} fingerprints found in {}/ \n'.format(n_stops, DEST_FOLDERPATH))
 
     print('Gathering {} fingerprints over {}cm \n'.format(N_STEPS, DISTANCE_TO_TRAVEL * N_STEPS))
     print(f'Wait {STARTING_TIMER}s before starting... \n')
     time.sleep(STARTING_TIMER)
 
+    network, mainloop = None, None # the real Thymio, through asebamedulla
+    if SIMULATION:
+        network, mainloop = SimulatedAsebaNetwork(initial_position=last_position, initial_heading=last_heading), SimulatedMainLoop()
+
+    # A single session for the whole survey: the D-Bus connection and the Thymio's pose are kept from one RP to the next
+    thymio = ThymioSession(initial_position=last_position,
+                           positions_filename=THYMIO_POSITIONS_FILENAME,
+                           dest_folderpath=DEST_FOLDERPATH,
+                           network=network,
+                           mainloop=mainloop,
+                           initial_heading=last_heading)
+
+    pipeline = PostProcessingPipeline(DEST_FOLDERPATH) if PIPELINED else None
     for step in range(N_STEPS):
-        print('Fingerprint #{} in [{:.2f}, {:.2f}]'.format(step + len(positions), last_position[0], last_position[1]))
+        print('Fingerprint #{} in [{:.2f}, {:.2f}]'.format(step + n_stops, last_position[0], last_position[1]))
 
         rm_fingerprint()
 
-        while True:
-            if os.path.isfile('ce.txt'): # check if ce.txt has reached {ce_filesize} MB
-                size = os.stat('ce.txt').st_size # size of filepath in Bytes
-                if size > CE_FILESIZE * 1e6: # ce_filesize in is MB, size in B
-                    print('\t \t ce.txt filesize ({:.2f} MB) limit ({} MB) reached'.format(size/1e6, CE_FILESIZE))
-                    break
-
-        print('\t- Move fingerprint')
-        move_fingerprint(x=last_position[0],
-                         y=last_position[1], 
-                         src_folderpath='./',
-                         dest_folderpath=DEST_FOLDERPATH,
-                         verbose=False)
+        with CaptureWatcher(CE_FILEPATH) as watcher: # sleeps until srsue writes to ce.txt, instead of spinning on os.stat
+            progress = watcher.wait_for_capture(n_ttis=CE_N_TTIS, filesize=CE_FILESIZE * 1e6) # CE_FILESIZE in is MB, filesize in B
+        print('\t \t {} limit reached: {} intact records, {} TTIs ({:.2f}s), {:.2f} MB, growing at {:.2f} MB/s'.format(
+            progress.reached_criterion, progress.n_records, progress.n_ttis, progress.duration, progress.filesize/1e6, watcher.growth_rate/1e6))
+
+        if pipeline is not None:
+            print('\t- Queue fingerprint for post-processing')
+            pipeline.submit(x=last_position[0], y=last_position[1], src_folderpath='./')
+        else:
+            print('\t- Move fingerprint')
+            move_fingerprint(x=last_position[0],
+                             y=last_position[1], 
+                             src_folderpath='./',
+                             dest_folderpath=DEST_FOLDERPATH,
+                             verbose=False)
 
         print('\t- Move Thymio to ', end='')
-        thymio = Thymio(initial_position=last_position, 
-                        distance_to_travel=DISTANCE_TO_TRAVEL, 
-                        positions_filename=THYMIO_POSITIONS_FILENAME,
-                        dest_folderpath=DEST_FOLDERPATH)
-        thymio.run()
-        last_position = fetch_last_position(filepath=os.path.join(DEST_FOLDERPATH, f'{THYMIO_POSITIONS_FILENAME}.txt'))
+        last_position = thymio.advance(DISTANCE_TO_TRAVEL).result()
         print('[{:.2f}, {:.2f}]'.format(last_position[0], last_position[1]))
         print('')
+    thymio.close()
+
+    if pipeline is not None:
+        print('Wait for the post-processing of the last fingerprints...\n')
+        pipeline.close()
+        print('')
 
     elapsed_time = time.time() - start_time
     print('Script took {}'.format(time.strftime('%H:%M:%S', time.gmtime(elapsed_time))))
@@ -77,22 +99,5 @@ def rm_fingerprint():
     subprocess.run('rm -f else.txt', shell=True)
     subprocess.run('rm -f info.txt', shell=True)
 
-def fetch_last_position(filepath):
-    """Inspect {filepath}.txt to infer the Thymio's last absolute position, i.e. the last one appended    
-
-    Args:
-        filepath (str): Name of the file holding the positions where the Thymio stopped
-
-    Returns:
-        [List of floats]: (x,y) absolute coordinates of the Thymio's last stop
-    """
-
-    positions = []
-    with open(filepath, 'r') as fp:
-        positions = [line.rstrip() for line in fp.readlines()]
-    last_position = eval(positions[-1])
-    return last_position
-
-
 if __name__ == '__main__':
     run()
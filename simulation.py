@@ -0,0 +1,212 @@
+import click
+import heapq
+import math
+import numpy as np
+import os
+import signal
+import sys
+import threading
+import time
+
+from clean_fingerprints import N_SUBCARRIERS, CE_DT
+from generate_fingerprints import generate_ce_data, generate_else_data, generate_info_data, CE_FILENAME, ELSE_FILENAME, INFO_FILENAME
+from thymio import WHEEL_RADIUS, AXLE_LENGTH, SPEED_UNIT_TO_RADS_CONVERTION, MOTORS_EVENT
+
+LINE_WIDTH = 4.0 # [cm] width of the black line
+LINE_AMPLITUDE = 0.0 # [cm] amplitude of the line's sinusoidal wiggle (straight line if 0)
+LINE_PERIOD = 100.0 # [cm] period of the line's sinusoidal wiggle
+GROUND_SENSORS_OFFSET = [7.0, 1.1] # [cm] position of the ground sensors, forward of the wheels' axle and to its sides
+GROUND_BLACK = 100 # prox.ground.delta over the black line
+GROUND_WHITE = 1000 # prox.ground.delta elsewhere
+GROUND_NOISE = 20 # standard deviation of prox.ground.delta
+INTEGRATION_STEP = 1e-3 # [s] step of the integration of the simulated Thymio's motion
+
+FAKE_SRSUE_IP = '10.45.0.2'
+FAKE_SRSUE_COMMAND = [sys.executable, os.path.abspath(__file__)] # to be followed by the ue.conf filepath, like srsue
+FAKE_SRSUE_RATE = N_SUBCARRIERS * CE_DT.itemsize * 1e3 / 1e6 # [MB/s] rate at which srsue writes to ce.txt: one record per subcarrier per ms
+WRITE_INTERVAL = 0.01 # [s] interval between two writes of the fake srsue
+
+class SimulatedAsebaNetwork(object):
+    def __init__(self, initial_position=(0, 0), initial_heading=0.0, latency=0.0, seed=0):
+        """Simulated Thymio-II on a virtual black line y = LINE_AMPLITUDE * sin(2*pi*x / LINE_PERIOD),
+        exposed through the SetVariable/GetVariable methods of asebamedulla's ch.epfl.mobots.AsebaNetwork D-Bus interface
+
+        The Thymio moves in real time: whenever the network is called, its pose is integrated up to now,
+        with the wheel speeds last set through motor.left.target and motor.right.target.
+        The ground sensors (prox.ground.delta) read GROUND_BLACK over the line, and GROUND_WHITE elsewhere.
+
+        Arguments:
+            initial_position {tuple of 2 floats} -- (x,y) true coordinates [cm] of the Thymio
+            initial_heading {float} -- True heading [rad] of the Thymio (0 being along the x-axis)
+            latency {float} -- Time [s] taken by each call, as a D-Bus round-trip would
+            seed {int} -- Seed of the ground sensors' noise
+        """
+        self.position = list(map(float, initial_position)) # true position, as opposed to the one estimated by odometry
+        self.heading = float(initial_heading)
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        self.variables = {'motor.left.target': [0], 'motor.right.target': [0]}
+        self.last_update_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.n_calls = 0
+        self.loaded_scripts = []
+
+    def SetVariable(self, node, name, values, reply_handler=None, error_handler=None): # pylint: disable=invalid-name
+        with self.lock:
+            self.call()
+            self.variables[name] = list(values)
+        if reply_handler is not None:
+            reply_handler()
+
+    def GetVariable(self, node, name, reply_handler=None, error_handler=None): # pylint: disable=invalid-name
+        with self.lock:
+            self.call()
+            if name == 'prox.ground.delta':
+                values = self.read_ground_sensors()
+            else:
+                values = self.variables.get(name)
+
+        if values is None:
+            error = KeyError('Unknown variable {} on {}'.format(name, node))
+            if error_handler is None:
+                raise error
+            error_handler(error)
+        elif reply_handler is None:
+            return values
+        else:
+            reply_handler(values)
+
+    def SendEventName(self, name, args, reply_handler=None, error_handler=None): # pylint: disable=invalid-name
+        """Emit the Aseba event {name}. Only the one defined by thymio_motors.aesl (see Thymio's motors_event) is simulated"""
+        with self.lock:
+            self.call()
+            if name == MOTORS_EVENT and self.loaded_scripts:
+                self.variables['motor.left.target'], self.variables['motor.right.target'] = [args[0]], [args[1]]
+
+        if reply_handler is not None:
+            reply_handler()
+
+    def LoadScripts(self, filepath, reply_handler=None, error_handler=None): # pylint: disable=invalid-name
+        with self.lock:
+            self.call()
+            self.loaded_scripts.append(filepath)
+
+        if reply_handler is not None:
+            reply_handler()
+
+    def call(self):
+        """Simulate the cost of a D-Bus call, and bring the Thymio's pose up to date"""
+        self.n_calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.update()
+
+    def update(self):
+        """Integrate the Thymio's motion since the last update"""
+        now = time.perf_counter()
+        elapsed_time = now - self.last_update_time
+        self.last_update_time = now
+
+        left_speed = self.variables['motor.left.target'][0] * SPEED_UNIT_TO_RADS_CONVERTION * WHEEL_RADIUS # [cm/s]
+        right_speed = self.variables['motor.right.target'][0] * SPEED_UNIT_TO_RADS_CONVERTION * WHEEL_RADIUS
+        n_steps = max(int(math.ceil(elapsed_time / INTEGRATION_STEP)), 1)
+        dt = elapsed_time / n_steps
+        for _ in range(n_steps):
+            self.position[0] += math.cos(self.heading) * (left_speed + right_speed) / 2 * dt
+            self.position[1] += math.sin(self.heading) * (left_speed + right_speed) / 2 * dt
+            self.heading += (right_speed - left_speed) / AXLE_LENGTH * dt
+
+    def read_ground_sensors(self):
+        """Return the [left, right] prox.ground.delta"""
+        forward, side = GROUND_SENSORS_OFFSET
+        values = []
+        for sign in [1, -1]: # left, then right
+            x = self.position[0] + math.cos(self.heading) * forward - math.sin(self.heading) * side * sign
+            y = self.position[1] + math.sin(self.heading) * forward + math.cos(self.heading) * side * sign
+            is_over_line = abs(y - LINE_AMPLITUDE * math.sin(2 * math.pi * x / LINE_PERIOD)) < LINE_WIDTH / 2
+            values.append(int((GROUND_BLACK if is_over_line else GROUND_WHITE) + self.rng.normal(0, GROUND_NOISE)))
+
+        return values
+
+
+class SimulatedMainLoop(object):
+    def __init__(self):
+        """Stand-in for GObject's timeout_add and MainLoop, for when GLib is not available (see Thymio's mainloop argument)
+
+        Like GLib, a callback scheduled with timeout_add is called every {interval} ms after its previous call returned,
+        until it returns a falsy value.
+        """
+        self.timers = [] # heap of (due time, id, interval [s], callback)
+        self.n_timers = 0
+        self.is_running = False
+
+    def timeout_add(self, interval, callback):
+        self.n_timers += 1
+        heapq.heappush(self.timers, (time.perf_counter() + interval / 1e3, self.n_timers, interval / 1e3, callback))
+        return self.n_timers
+
+    def MainLoop(self): # pylint: disable=invalid-name
+        return self
+
+    def run(self):
+        """Call the due callbacks until quit is called (or no callback is left)"""
+        self.is_running = True
+        while self.is_running and self.timers:
+            due_time, timer_id, interval, callback = heapq.heappop(self.timers)
+            delay = due_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if callback():
+                heapq.heappush(self.timers, (time.perf_counter() + interval, timer_id, interval, callback))
+
+    def quit(self):
+        self.is_running = False
+
+
+@click.command()
+@click.argument('conf_filepath', required=False)
+@click.option('--dest_folderpath', default='./', help='Folder where to write ce.txt, else.txt and info.txt')
+@click.option('--rate', default=FAKE_SRSUE_RATE, help='Rate [MB/s] at which ce.txt grows')
+@click.option('--attach_delay', default=2.0, help='Time [s] before printing the network attach')
+@click.option('--error_rate', default=1e-4, help='Ratio of ce records with a framing error')
+@click.option('--n_subcarriers', default=N_SUBCARRIERS, help='Amount of subcarriers recorded per TTI')
+@click.option('--seed', default=0, help='Seed of the random generator')
+def fake_srsue(conf_filepath, dest_folderpath, rate, attach_delay, error_rate, n_subcarriers, seed):
+    """Stand-in for `srsue {conf_filepath}`: print the network attach, then append synthetic records
+    (see generate_fingerprints.py) to ce.txt, else.txt and info.txt at {rate} MB/s, until interrupted by SIGINT
+
+    Like srsue, the files are reopened at each write, so that they can be moved or removed while it runs.
+
+    Arguments:
+        conf_filepath {str} -- Ignored, for the command line to match srsue's
+        dest_folderpath {str} -- Folder where to write ce.txt, else.txt and info.txt
+        rate {float} -- Rate [MB/s] at which ce.txt grows
+        attach_delay {float} -- Time [s] before printing the network attach
+        error_rate {float} -- Ratio of ce records with a framing error
+        n_subcarriers {int} -- Amount of subcarriers recorded per TTI
+        seed {int} -- Seed of the random generator
+    """
+    signal.signal(signal.SIGINT, lambda *_: sys.exit(0))
+
+    print('Attaching UE...', flush=True)
+    time.sleep(attach_delay)
+    print('Network attach successful. IP: {}'.format(FAKE_SRSUE_IP), flush=True)
+
+    tti_size = n_subcarriers * CE_DT.itemsize # [B] size of the ce records of one TTI
+    tti = 0
+    start_time = time.perf_counter()
+    while True:
+        n_ttis = int((time.perf_counter() - start_time) * rate * 1e6 / tti_size) - tti # TTIs due since the last write
+        if n_ttis > 0:
+            ce_data = generate_ce_data((n_ttis * tti_size + 0.5) / 1e6, n_subcarriers=n_subcarriers, error_rate=error_rate, seed=seed, first_tti=tti)
+            for data, filename in [(ce_data, CE_FILENAME), (generate_else_data(n_ttis, seed=seed, first_tti=tti), ELSE_FILENAME),
+                                   (generate_info_data(n_ttis, first_tti=tti), INFO_FILENAME)]:
+                with open(os.path.join(dest_folderpath, '{}.txt'.format(filename)), 'ab') as fp:
+                    data.tofile(fp)
+            tti += n_ttis
+
+        time.sleep(WRITE_INTERVAL)
+
+
+if __name__ == '__main__':
+    fake_srsue() # pylint: disable=no-value-for-parameter
@@ -0,0 +1,186 @@
+import numpy as np
+
+from atomic_write import write_atomically
+
+DEFAULT_CELL_SIZE = 10.0 # [cm] Size of the cells when it cannot be chosen from the locations (e.g. less than 2 of them)
+POINTS_PER_CELL = 4 # Average amount of locations per cell targeted when the cell size is chosen from the locations
+REBALANCE_RATIO = 2 # Ratio between the cell size and the one chosen from the locations above which rebalance rebuilds the grid
+KEY_OFFSET = 2 ** 31 # Offset of the cell row in a cell key, so that negative rows sort before the positive ones
+
+class SpatialIndex(object):
+    def __init__(self, fingerprint_ids=(), xy=None, cell_size=None):
+        """Uniform grid over the locations of the fingerprints, answering box, radius and k-nearest-neighbours queries
+        without scanning all of them
+
+        The locations are kept sorted by cell key (column << 32 | row), so that the locations of a column of cells are contiguous:
+        a query only searches (np.searchsorted) the columns it overlaps, then filters the locations of its cells exactly.
+
+        Arguments:
+            fingerprint_ids {array-like of int} -- IDs of the fingerprints
+            xy {array-like of shape (n, 2)} -- (x,y) coordinates [cm] of the fingerprints, in the same order
+            cell_size {float} -- Size [cm] of the cells. Chosen from the locations if None (see choose_cell_size)
+        """
+        fingerprint_ids = np.asarray(fingerprint_ids, dtype=np.int64).reshape(-1)
+        xy = np.empty((0, 2)) if xy is None else np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = choose_cell_size(xy) if cell_size is None else float(cell_size)
+
+        keys = self.get_cell_keys(xy)
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.fingerprint_ids, self.xy = keys[order], fingerprint_ids[order], xy[order]
+        self.xy_min, self.xy_max = (xy.min(axis=0), xy.max(axis=0)) if len(xy) else (None, None) # bounding box of the locations
+
+    @classmethod
+    def from_locations(cls, locations, cell_size=None):
+        """Build the index of locations ("Fingerprint ID" -> [x,y], see locations_index.load_locations)"""
+        fingerprint_ids = list(locations.keys())
+        return cls([int(fingerprint_id) for fingerprint_id in fingerprint_ids], [locations[fingerprint_id] for fingerprint_id in fingerprint_ids], cell_size)
+
+    def __len__(self):
+        return len(self.fingerprint_ids)
+
+    def get_cell_keys(self, xy):
+        cells = np.floor(np.asarray(xy, dtype=np.float64).reshape(-1, 2) / self.cell_size).astype(np.int64)
+        return (cells[:, 0] << 32) + (cells[:, 1] + KEY_OFFSET)
+
+    def add(self, fingerprint_ids, xy):
+        """Insert the locations of new fingerprints, in place (the fingerprints already indexed are skipped)
+
+        Arguments:
+            fingerprint_ids {array-like of int} -- IDs of the fingerprints
+            xy {array-like of shape (n, 2)} -- (x,y) coordinates [cm] of the fingerprints, in the same order
+        """
+        fingerprint_ids = np.asarray(fingerprint_ids, dtype=np.int64).reshape(-1)
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        is_new = ~np.isin(fingerprint_ids, self.fingerprint_ids)
+        fingerprint_ids, xy = fingerprint_ids[is_new], xy[is_new]
+        if not len(fingerprint_ids):
+            return
+
+        keys = self.get_cell_keys(xy)
+        order = np.argsort(keys, kind='stable')
+        positions = np.searchsorted(self.keys, keys[order], side='right')
+        self.keys = np.insert(self.keys, positions, keys[order])
+        self.fingerprint_ids = np.insert(self.fingerprint_ids, positions, fingerprint_ids[order])
+        self.xy = np.insert(self.xy, positions, xy[order], axis=0)
+        self.xy_min = xy.min(axis=0) if self.xy_min is None else np.minimum(self.xy_min, xy.min(axis=0))
+        self.xy_max = xy.max(axis=0) if self.xy_max is None else np.maximum(self.xy_max, xy.max(axis=0))
+
+    def rebalance(self):
+        """Rebuild the grid in place if its cell size is REBALANCE_RATIO away from the one chosen from the current locations,
+        e.g. for an index started empty (with DEFAULT_CELL_SIZE) and grown by add
+
+        Returns:
+            [bool] -- Whether the grid was rebuilt
+        """
+        cell_size = choose_cell_size(self.xy)
+        if 1 / REBALANCE_RATIO <= self.cell_size / cell_size <= REBALANCE_RATIO:
+            return False
+
+        self.__init__(self.fingerprint_ids, self.xy, cell_size)
+        return True
+
+    def update(self, locations):
+        """Insert the new fingerprints of locations ("Fingerprint ID" -> [x,y]), e.g. the journaled ones"""
+        if locations:
+            fingerprint_ids = list(locations.keys())
+            self.add([int(fingerprint_id) for fingerprint_id in fingerprint_ids], [locations[fingerprint_id] for fingerprint_id in fingerprint_ids])
+
+    def get_candidates(self, x_min, y_min, x_max, y_max):
+        """Return the positions (in self.keys) of the locations within the cells overlapping the box"""
+        if not len(self.keys):
+            return np.empty(0, dtype=np.int64)
+
+        (column_min, row_min), (column_max, row_max) = np.floor(np.array([[x_min, y_min], [x_max, y_max]]) / self.cell_size).astype(np.int64)
+        column_min = max(column_min, self.keys[0] >> 32) # the keys being sorted, the columns of the locations are within those of the first and last ones
+        column_max = min(column_max, self.keys[-1] >> 32)
+        if column_min > column_max or row_min > row_max:
+            return np.empty(0, dtype=np.int64)
+
+        columns = np.arange(column_min, column_max + 1, dtype=np.int64) << 32
+        starts = np.searchsorted(self.keys, columns + (row_min + KEY_OFFSET), side='left')
+        lengths = np.searchsorted(self.keys, columns + (row_max + KEY_OFFSET), side='right') - starts
+        return np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+
+    def query_box(self, x_min, y_min, x_max, y_max):
+        """Return the IDs of the fingerprints within the box [x_min, x_max] x [y_min, y_max] [cm]"""
+        candidates = self.get_candidates(x_min, y_min, x_max, y_max)
+        xy = self.xy[candidates]
+        is_inside = (xy[:, 0] >= x_min) & (xy[:, 0] <= x_max) & (xy[:, 1] >= y_min) & (xy[:, 1] <= y_max)
+        return self.fingerprint_ids[candidates[is_inside]]
+
+    def query_radius(self, x, y, radius):
+        """Return the fingerprints within radius [cm] of (x,y)
+
+        Returns:
+            fingerprint_ids [np.ndarray of int] -- IDs of the fingerprints, from the nearest to the farthest
+            distances [np.ndarray of float] -- Their distance [cm] to (x,y)
+        """
+        candidates = self.get_candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = np.hypot(self.xy[candidates, 0] - x, self.xy[candidates, 1] - y)
+        is_inside = distances <= radius
+        candidates, distances = candidates[is_inside], distances[is_inside]
+
+        order = np.argsort(distances, kind='stable')
+        return self.fingerprint_ids[candidates[order]], distances[order]
+
+    def query_knn(self, x, y, k=1):
+        """Return the k fingerprints nearest to (x,y), searching within a radius doubled until it holds k of them
+
+        Returns:
+            fingerprint_ids [np.ndarray of int] -- IDs of the fingerprints, from the nearest to the farthest
+            distances [np.ndarray of float] -- Their distance [cm] to (x,y)
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # Start from the radius holding k locations at the targeted density, at least reaching the locations' bounding box
+        distance_to_bounds = np.hypot(*np.maximum(np.maximum(self.xy_min - [x, y], [x, y] - self.xy_max), 0))
+        radius = max(self.cell_size * np.sqrt(k / POINTS_PER_CELL), distance_to_bounds + self.cell_size)
+        while True:
+            fingerprint_ids, distances = self.query_radius(x, y, radius)
+            if len(fingerprint_ids) >= k: # all the locations within radius being found, the k nearest ones are among them
+                return fingerprint_ids[:k], distances[:k]
+            radius *= 2
+
+    def save(self, filepath, **metadata):
+        """Save the index to the .npz filepath atomically, fsync'd (see write_atomically)
+
+        Arguments:
+            filepath {str} -- Filepath of the .npz
+            metadata {int or float} -- Values saved along the index (e.g. the state of the locations it was built from)
+        """
+        def save(temp_filepath):
+            with open(temp_filepath, 'wb') as fp: # np.savez would append .npz to the temporary filepath
+                np.savez(fp, fingerprint_ids=self.fingerprint_ids, xy=self.xy, cell_size=self.cell_size, **metadata)
+
+        write_atomically(filepath, save, fsync=True)
+
+    @classmethod
+    def load(cls, filepath):
+        """Load an index saved by save
+
+        Returns:
+            spatial_index [SpatialIndex]
+            metadata [dict] -- Values saved along the index
+        """
+        with np.load(filepath) as npz:
+            metadata = {key: npz[key].item() for key in npz.files if key not in ['fingerprint_ids', 'xy', 'cell_size']}
+            return cls(npz['fingerprint_ids'], npz['xy'], npz['cell_size'].item()), metadata
+
+
+def choose_cell_size(xy):
+    """Choose the cell size [cm] holding POINTS_PER_CELL locations on average, whether they cover an area or lie along a line
+
+    Arguments:
+        xy {np.ndarray of shape (n, 2)} -- (x,y) coordinates [cm] of the locations
+
+    Returns:
+        cell_size [float]
+    """
+    if len(xy) < 2:
+        return DEFAULT_CELL_SIZE
+
+    width, height = xy.max(axis=0) - xy.min(axis=0)
+    cell_size = max(np.sqrt(POINTS_PER_CELL * width * height / len(xy)), POINTS_PER_CELL * max(width, height) / len(xy))
+    return float(cell_size) if cell_size > 0 else DEFAULT_CELL_SIZE
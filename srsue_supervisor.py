@@ -0,0 +1,175 @@
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+ATTACH_PATTERN = re.compile(r'Network attach.*?(\d+\.\d+\.\d+\.\d+)') # e.g. "Network attach successful. IP: 10.45.0.2"
+STOPPING_TIMEOUT = 3.0 # timeout [s] to wait for srsue to exit after SIGINT, before terminating then killing it
+LINE_BUFFERED_COMMAND = ['stdbuf', '-oL'] # prefix making srsue flush its stdout at each line, so that its attach is seen when printed
+
+class SrsueSupervisor(object):
+    def __init__(self, conf_filepath, sudo=True, verbose=False, command=None):
+        """Run srsue as a child process, holding its Popen handle rather than going through a shell and pkill
+
+        The stdout of srsue is parsed by a reader thread, to detect the network attach (see ATTACH_PATTERN)
+        and measure its latency. Each start/stop is logged as an attempt in self.attempts.
+
+        Arguments:
+            conf_filepath {str} -- Filepath to `ue.conf`
+            sudo {bool} -- Whether to run srsue through sudo (required to access the SDR)
+            verbose {bool} -- Whether to echo the stdout of srsue
+            command {list of str} -- Command running srsue, to which conf_filepath is appended (e.g. simulation.FAKE_SRSUE_COMMAND).
+                                     `srsue`, line-buffered (through sudo if sudo is set) if None
+        """
+        if command is None:
+            command = (['sudo'] if sudo else []) + LINE_BUFFERED_COMMAND + ['srsue']
+        self.command = command + [conf_filepath]
+        self.sudo = self.command[0] == 'sudo'
+        self.verbose = verbose
+        self.process = None
+        self.reader = None
+        self.attached = threading.Event()
+        self.ip = None # IP address assigned at the network attach
+        self.attempts = [] # one dict per start: start_time, attach_latency [s] (None if not attached), returncode, stopping_time [s]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        """Start srsue, and a thread reading its stdout"""
+        if self.is_running():
+            raise RuntimeError('srsue is already running (pid {})'.format(self.process.pid))
+
+        self.attached.clear()
+        self.ip = None
+        self.attempts.append({'start_time': time.time(), 'attach_latency': None, 'returncode': None, 'stopping_time': None})
+        self.start_time = time.perf_counter()
+        self.process = subprocess.Popen(self.command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, bufsize=1)
+        self.reader = threading.Thread(target=self.read_stdout, args=(self.process, self.attempts[-1]), daemon=True)
+        self.reader.start()
+
+    def read_stdout(self, process, attempt):
+        """Read the stdout of process until it exits, flagging the network attach"""
+        for line in process.stdout:
+            if self.verbose:
+                print(line, end='')
+            if not self.attached.is_set():
+                match = ATTACH_PATTERN.search(line)
+                if match is not None:
+                    attempt['attach_latency'] = time.perf_counter() - self.start_time
+                    self.ip = match.group(1)
+                    self.attached.set()
+        process.stdout.close()
+
+    def wait_for_attach(self, timeout=None):
+        """Block until srsue is attached to the network, it exits or timeout [s] elapses
+
+        Returns:
+            [bool] -- Whether srsue is attached
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while not self.attached.is_set() and self.is_running():
+            remaining_time = None if deadline is None else deadline - time.perf_counter()
+            if remaining_time is not None and remaining_time <= 0:
+                break
+            self.attached.wait(0.1 if remaining_time is None else min(0.1, remaining_time)) # also checks every 0.1s whether srsue exited
+
+        return self.attached.is_set()
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=STOPPING_TIMEOUT):
+        """Stop srsue with SIGINT (letting it flush its files), and wait for it to actually exit
+
+        If it is still running after timeout [s], it is terminated, then killed. sudo relays SIGINT and SIGTERM to srsue, but not SIGKILL:
+        srsue itself is then killed through sudo (see kill_sudo_children), not to be left running as an orphan holding the SDR.
+        Raises a RuntimeError if it is left running all the same (e.g. without a NOPASSWD rule for `kill`, see README).
+
+        Returns:
+            returncode [int] -- Return code of srsue, None if it was not started
+        """
+        if self.process is None:
+            return None
+
+        start_time = time.perf_counter()
+        for send_signal in [lambda: self.process.send_signal(signal.SIGINT), self.process.terminate, self.kill]:
+            if self.process.poll() is not None:
+                break
+            try:
+                send_signal() # sudo relays SIGINT and SIGTERM to srsue
+            except ProcessLookupError:
+                break
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                continue
+
+        self.process.wait()
+        self.reader.join(timeout) # the reader ends with srsue's stdout, which an orphaned srsue (see kill) keeps open
+
+        attempt = self.attempts[-1]
+        attempt['returncode'] = self.process.returncode
+        attempt['stopping_time'] = time.perf_counter() - start_time
+        self.process = None
+
+        if self.reader.is_alive():
+            raise RuntimeError('srsue is left running as root: kill it by hand (sudo kill -KILL)')
+
+        return attempt['returncode']
+
+    def kill(self):
+        """Kill srsue, through sudo if it runs as root, then the process started (e.g. the sudo wrapper)"""
+        if self.sudo:
+            kill_sudo_children(self.process.pid)
+        self.process.kill()
+
+
+def list_descendants(pid):
+    """Return the pids of the descendants of the process {pid} (e.g. srsue and the monitor process of sudo), children first"""
+    result = subprocess.run(['pgrep', '-P', str(pid)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    child_pids = [int(child_pid) for child_pid in result.stdout.split()]
+    return child_pids + [descendant_pid for child_pid in child_pids for descendant_pid in list_descendants(child_pid)]
+
+
+def kill_sudo_children(pid):
+    """SIGKILL the descendants of the sudo process {pid}, which run as root
+
+    sudo cannot relay SIGKILL: killing it alone would orphan its child. sudo is run non-interactively (-n), so that a missing
+    NOPASSWD rule for `kill` (see README) makes the kill fail rather than hang on a password prompt. Its error is then printed.
+
+    Returns:
+        [bool] -- Whether the descendants are killed (False if any of them is left running)
+    """
+    descendant_pids = list_descendants(pid)
+    if not descendant_pids:
+        return True
+
+    result = subprocess.run(['sudo', '-n', 'kill', '-KILL'] + [str(descendant_pid) for descendant_pid in descendant_pids],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode == 0:
+        return True
+
+    running_pids = [descendant_pid for descendant_pid in descendant_pids if is_running(descendant_pid)] # kill also fails if one of them exited meanwhile
+    if not running_pids:
+        return True
+
+    print('Could not kill {} through sudo (returncode {}): {}\nAllow `kill` without password (see README)'.format(running_pids, result.returncode, result.stderr.strip()))
+    return False
+
+
+def is_running(pid):
+    """Return whether the process {pid} exists, even if it belongs to another user (e.g. root)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,176 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from os.path import join, isdir
+
+from clean_fingerprints import (STREAMING_CHUNKSIZE, clean_fingerprint, load_manifest, record_report,
+                                save_summaries, print_cleaning_summary)
+from instrumentation import measure
+from locations_index import LocationsIndex
+from move_fingerprint import move_fingerprint, CE_FILENAME, ELSE_FILENAME, INFO_FILENAME
+
+QUEUE_SIZE = 2 # Amount of captures waiting to be post-processed before the survey loop blocks
+POLLING_INTERVAL = 1 # [s] Interval at which a blocked submit checks that the worker thread is still alive
+STAGING_FOLDERNAME = 'staging'
+
+class PostProcessingPipeline(object):
+    def __init__(self, dest_folderpath, queue_size=QUEUE_SIZE, streaming=True, chunksize=STREAMING_CHUNKSIZE, dense=False):
+        """Post-process the captures in the background, while the Thymio drives to the next reference point
+
+        submit rotates the capture out (ce.txt, else.txt and info.txt are renamed into {dest_folderpath}/{STAGING_FOLDERNAME}/)
+        and queues it. A worker thread then moves it to dest_folderpath (see move_fingerprint, through a single LocationsIndex) and cleans it
+        (see clean_fingerprint) in a separate process, so that the cleaning does not hold the GIL needed by the Thymio's control.
+
+        The queue holds at most {queue_size} captures: if the post-processing falls behind, submit blocks until a capture is done.
+        A capture failing to be cleaned or recorded is reported as a failed fingerprint (with no pid), and the worker goes on with the next one.
+        If the worker thread dies nonetheless (e.g. the LocationsIndex cannot be opened), submit raises instead of blocking forever.
+        Once closed, the summaries are saved and the campaign is cleaned, as if clean_fingerprints had been run.
+
+        Arguments:
+            dest_folderpath {str} -- Folderpath where the ce, else and info folder are located
+            queue_size {int} -- Amount of captures waiting to be post-processed before submit blocks
+            streaming {bool} -- Whether to clean the ce files by chunks (see clean_ce_streaming)
+            chunksize {float} -- Size [MB] of the chunks read when streaming
+            dense {bool} -- Whether to also save the ce files as dense arrays
+        """
+        self.dest_folderpath = dest_folderpath
+        self.streaming = streaming
+        self.chunksize = chunksize
+        self.dense = dense
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.reports = [] # reports of clean_fingerprint, in submission order
+        self.run_fields = {'command': 'survey_pipeline', 'run_started_at': datetime.now().isoformat(timespec='seconds')}
+        self.executor = ProcessPoolExecutor(max_workers=1)
+        self.error = None # exception which killed the worker thread
+        self.closed = False
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def submit(self, x, y, src_folderpath='./'):
+        """Rotate the capture out of src_folderpath, and queue it for post-processing. Blocks if the queue is full
+
+        Arguments:
+            x {float} -- x-coordinate where the fingerprint was taken
+            y {float} -- y-coordinate where the fingerprint was taken
+            src_folderpath {str} -- Folderpath where the fingerprint files (ce.txt, else.txt, info.txt) are located
+        """
+        self.check_worker()
+        staging_folderpath = join(self.dest_folderpath, STAGING_FOLDERNAME)
+        if not isdir(staging_folderpath):
+            os.makedirs(staging_folderpath)
+        capture_folderpath = tempfile.mkdtemp(dir=staging_folderpath)
+
+        for filename in [CE_FILENAME, ELSE_FILENAME, INFO_FILENAME]:
+            shutil.move(join(src_folderpath, '{}.txt'.format(filename)), join(capture_folderpath, '{}.txt'.format(filename))) # a rename, if on the same filesystem
+
+        if self.queue.full():
+            print('\t \t Post-processing is behind ({} captures queued): waiting...'.format(self.queue.qsize()))
+        start_time = time.perf_counter()
+        self.put((x, y, capture_folderpath))
+        waiting_time = time.perf_counter() - start_time
+        if waiting_time > 0.1:
+            print('\t \t Waited {:.1f}s for the post-processing'.format(waiting_time))
+
+    def put(self, item):
+        """Queue item, blocking while the queue is full, unless the worker thread dies in the meantime (see check_worker)"""
+        while True:
+            try:
+                self.queue.put(item, timeout=POLLING_INTERVAL)
+                return
+            except queue.Full:
+                self.check_worker()
+
+    def check_worker(self):
+        """Raise a RuntimeError if the worker thread died"""
+        if not self.thread.is_alive():
+            raise RuntimeError('The post-processing of {} stopped: {}'.format(self.dest_folderpath, self.error))
+
+    def work(self):
+        """Body of the worker thread, recording the exception which killed it (if any) in self.error"""
+        try:
+            self.process_queue()
+        except Exception as e: # pylint: disable=broad-except
+            self.error = '{}: {}'.format(type(e).__name__, e)
+            print('\t \t Post-processing stopped: {}'.format(self.error))
+
+    def process_queue(self):
+        """Move then clean the queued captures, until None is queued"""
+        manifest = load_manifest(self.dest_folderpath)
+        if not isdir(self.dest_folderpath):
+            os.makedirs(self.dest_folderpath)
+        locations_index = LocationsIndex(self.dest_folderpath)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                locations_index.compact()
+                locations_index.close()
+                return
+
+            x, y, capture_folderpath = item
+            records = []
+            try:
+                with measure(records, 'pipeline_move'):
+                    fingerprint_id = move_fingerprint(x=x, y=y, src_folderpath=capture_folderpath, dest_folderpath=self.dest_folderpath, verbose=False,
+                                                      locations_index=locations_index)
+                shutil.rmtree(capture_folderpath)
+            except Exception as e: # pylint: disable=broad-except
+                print('\t \t Failed to move the capture at ({}, {}), left in {}: {}: {}'.format(x, y, capture_folderpath, type(e).__name__, e))
+                continue
+
+            records[-1]['fingerprint_id'] = fingerprint_id
+            try:
+                report = self.executor.submit(clean_fingerprint, fingerprint_id, self.dest_folderpath,
+                                              streaming=self.streaming, chunksize=self.chunksize, dense=self.dense).result()
+                report['records'] = records + report['records']
+                record_report(report, self.dest_folderpath, manifest, self.run_fields)
+            except Exception as e: # pylint: disable=broad-except
+                print('\t \t Failed to clean fingerprint #{}: {}: {}'.format(fingerprint_id, type(e).__name__, e))
+                report = {'fingerprint_id': fingerprint_id, 'pid': None, 'lines': [], 'n_bytes': 0, 'elapsed_time': 0.0,
+                          'files': {}, 'summaries': {}, 'records': records, 'error': '{}: {}'.format(type(e).__name__, e)}
+                if isinstance(e, BrokenProcessPool): # the worker process died: replace it for the next captures
+                    self.executor.shutdown(wait=False)
+                    self.executor = ProcessPoolExecutor(max_workers=1)
+            self.reports.append(report)
+
+    def close(self):
+        """Wait for the queued captures to be post-processed, save the summaries and print the cleaning summary
+
+        Returns:
+            reports [list of dict] -- Reports returned by clean_fingerprint
+        """
+        if self.closed:
+            return self.reports
+        self.closed = True
+
+        if self.thread.is_alive():
+            try:
+                self.put(None)
+            except RuntimeError:
+                pass # the worker died while the queue was full: there is nothing left to wait for
+            self.thread.join()
+        self.executor.shutdown()
+        if self.error is not None:
+            print('Post-processing stopped early ({}): the captures left are in {}'.format(self.error, join(self.dest_folderpath, STAGING_FOLDERNAME)))
+
+        if self.reports:
+            save_summaries(self.dest_folderpath, self.reports)
+        print_cleaning_summary(self.reports)
+
+        staging_folderpath = join(self.dest_folderpath, STAGING_FOLDERNAME)
+        if isdir(staging_folderpath) and not os.listdir(staging_folderpath):
+            os.rmdir(staging_folderpath)
+
+        return self.reports
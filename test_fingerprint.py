@@ -5,14 +5,15 @@ from record_fingerprint import record_fingerprint
 
 SRSUE_CONF_FILEPATH = '../srsLTE-modified/srsue/ue-digital-lab.conf'
 CE_FILEPATH = 'ce.txt'
-CE_FILESIZE = 10 # Filesize [MB] above which the recording is stopped
+CE_N_TTIS = 500 # Amount of distinct TTIs (i.e. ms) of intact ce records above which the recording is stopped
+CE_FILESIZE = 20 # Filesize [MB] above which the recording is stopped, even if CE_N_TTIS is not reached
 DEST_FOLDERPATH = 'test_fingerprint'
 
 FAKE_POSITION = [0,0]
 
 def test_fingerprint():
     print('- Record fingerprint')
-    record_fingerprint(SRSUE_CONF_FILEPATH, CE_FILEPATH, CE_FILESIZE, verbose=True)
+    record_fingerprint(SRSUE_CONF_FILEPATH, CE_FILEPATH, CE_FILESIZE, verbose=True, n_ttis=CE_N_TTIS)
 
     print('- Move fingerprint')
     move_fingerprint(x=FAKE_POSITION[0],
@@ -1,11 +1,22 @@
-import dbus
-import dbus.mainloop.glib
-from gi.repository import GObject as gobject
+try:
+    import dbus
+    import dbus.mainloop.glib
+    from gi.repository import GObject as gobject
+except ImportError: # only the simulated backend is available (see simulation.py)
+    dbus = None
+    gobject = None
+import bisect
 import math
 import time
 import copy
 import pickle
 import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from instrumentation import write_records
+from pose_journal import PoseJournal, get_journal_filepath
 
 SPEED = 100
 TIMESTEP = 10 # [ms]
@@ -15,52 +26,117 @@ SPEED_UNIT_TO_RADS_CONVERTION = 9.53/500 # 500 in motor speed corresponds to 9.5
 MOTOR_LEFT_TRESH = 300
 MOTOR_RIGHT_TRESH = 300
 P_GAIN = 1.0
+DEADLINE = 1.5 * TIMESTEP # [ms] loop period above which a tick counts as a missed deadline
+HISTOGRAM_BINS = [0, 1, 2, 5, 8, 9, 10, 11, 12, 15, 20, 30, 50, 100, float('inf')] # [ms] bin edges of the loop period and D-Bus latency histograms
+MOTORS_EVENT = 'set_motors' # Aseba event setting both motor targets at once (see MOTORS_SCRIPT_FILEPATH)
+MOTORS_SCRIPT_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thymio_motors.aesl')
 
 class Thymio(object):
-    def __init__(self, initial_position, distance_to_travel, positions_filename, dest_folderpath):
+    def __init__(self, initial_position, distance_to_travel, positions_filename, dest_folderpath, network=None, mainloop=None, motors_event=False,
+                 initial_heading=0.0):
         """Initialize the Thymio instance with its initial position
 
         Arguments:
             initial_position {List of 2 floats} -- (x,y) coordinates of the initial position
             distance_to_travel (float): distance [cm] forward the Thymio must travel
-            positions_filename (str): filename of the .txt holding the Thymio's past locations where it stopped
-            dest_folderpath (str): folderpath where to store {positions_filename}.txt
+            positions_filename (str): filename of the .jsonl journal of the Thymio's past poses where it stopped (see pose_journal.py)
+            dest_folderpath (str): folderpath where to store {positions_filename}.jsonl
+            network (object): Aseba network, with the SetVariable/GetVariable methods of ch.epfl.mobots.AsebaNetwork.
+                              The one exposed by asebamedulla on the D-Bus session bus if None (see simulation.py for a simulated one)
+            mainloop (object): Provider of timeout_add and MainLoop, like GObject (the default). See simulation.SimulatedMainLoop
+            motors_event (bool): Whether to set both motor targets with a single Aseba event (loading MOTORS_SCRIPT_FILEPATH on the Thymio),
+                                 rather than with one SetVariable per motor
+            initial_heading (float): heading [rad] at the initial position (e.g. the one journaled at the last stop)
         """
 
-        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-
-        bus = dbus.SessionBus()
+        if network is None:
+            dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
-        self.network = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/'), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+            bus = dbus.SessionBus()
 
-        # Schedule controller
-        gobject.timeout_add(TIMESTEP, self.followLine)
+            # Follow asebamedulla across its restarts, as the Thymio may outlive it (see ThymioSession)
+            network = dbus.Interface(bus.get_object('ch.epfl.mobots.Aseba', '/', follow_name_owner_changes=True), dbus_interface='ch.epfl.mobots.AsebaNetwork')
+        self.network = network
+        self.mainloop = gobject if mainloop is None else mainloop
+        self.motors_event = motors_event
+        if motors_event:
+            self.network.LoadScripts(MOTORS_SCRIPT_FILEPATH)
 
         # Ensure {dest_folderpath}/ exists
         if not os.path.isdir(dest_folderpath):
             os.mkdir(dest_folderpath)
 
-        # Ensure {dest_folderpath/positions_filename}.txt exists
-        self.positions_filepath = os.path.join(dest_folderpath, '{}.txt'.format(positions_filename))
-        if not os.path.isfile(self.positions_filepath):
-            with open(self.positions_filepath, 'w') as _:
-                pass
+        self.dest_folderpath = dest_folderpath
+        self.journal = PoseJournal(get_journal_filepath(dest_folderpath, positions_filename))
 
         self.ground_sensors = [0, 0]
         self.last_stopped_position = copy.copy(initial_position) # position when the Thymio last stopped
         self.current_position = copy.copy(initial_position)
-        self.current_heading = 0.0 # start with 0 heading
+        self.current_heading = initial_heading
         self.distance_to_travel = distance_to_travel
 
+        self.motor_targets = [0, 0] # motor targets last sent to the Thymio
+        self.last_command_time = None # time [s] at which they were sent
+        self.ground_sensors_request_time = None # time [s] at which the pending prox.ground.delta was requested, None if no request is pending
+        self.stats = ControlLoopStats()
+        self.stopped = False # set by stopMotors, after which the Thymio does not move anymore
+
     def run(self):
-        self.loop = gobject.MainLoop()
+        """Follow the line for the distance_to_travel given at construction, blocking until arrival"""
+        self.advance(self.distance_to_travel)
+
+    def advance(self, distance_to_travel):
+        """Follow the line for distance_to_travel [cm] from the current position, blocking until arrival
+
+        The pose (position and heading) carries over from one call to the next.
+
+        Arguments:
+            distance_to_travel (float): distance [cm] forward the Thymio must travel
+
+        Returns:
+            [List of 2 floats]: (x,y) coordinates where the Thymio stopped
+
+        Raises:
+            RuntimeError: If the Thymio is stopped (see stopMotors) before arrival
+        """
+        if self.stopped:
+            raise RuntimeError('The Thymio was stopped at [{:.2f}, {:.2f}]'.format(*self.current_position))
+        self.last_stopped_position = copy.copy(self.current_position)
+        self.distance_to_travel = distance_to_travel
+        self.motor_targets = [0, 0]
+        self.last_command_time = None
+        self.stats = ControlLoopStats()
+
+        # Schedule controller, until it returns on arrival
+        self.mainloop.timeout_add(TIMESTEP, self.followLine)
+        self.loop = self.mainloop.MainLoop()
         self.loop.run()
+        write_records(self.dest_folderpath, [self.stats.toRecord()], command='thymio', speed=SPEED, timestep=TIMESTEP, motors_event=self.motors_event)
+        if self.stopped:
+            raise RuntimeError('The Thymio was stopped at [{:.2f}, {:.2f}], before travelling {} cm'.format(
+                self.current_position[0], self.current_position[1], distance_to_travel))
+
+        return copy.copy(self.current_position)
 
     def followLine(self):
-        """Follow the line for one TIMESTEP"""
+        """Follow the line for one TIMESTEP
+
+        The ground sensors are requested asynchronously, one tick ahead: the controller uses the latest reply,
+        while the next one is in flight. The motor targets are sent without waiting for their reply either.
+        The odometry is integrated over the measured time elapsed since the previous motor targets were sent.
+        """
+        if self.stopped: # see stopMotors
+            self.loop.quit()
+            return False
+
+        now = time.perf_counter()
+        self.stats.addTick(now)
+        if self.last_command_time is not None:
+            self.updatePose(self.motor_targets[0], self.motor_targets[1], dt=now - self.last_command_time)
+            self.last_command_time = now
 
         if self.hasReachedDistance():
-            self.saveCurrentPosition(self.positions_filepath)
+            self.saveCurrentPosition()
 
             self.network.SetVariable("thymio-II", "motor.left.target", [0])
             self.network.SetVariable("thymio-II", "motor.right.target", [0])
@@ -82,14 +158,42 @@ class Thymio(object):
             motor_left_target -= delta_speed
             motor_right_target += delta_speed
 
-        self.network.SetVariable("thymio-II", "motor.left.target", [motor_left_target])
-        self.network.SetVariable("thymio-II", "motor.right.target", [motor_right_target])
-
-        self.updatePose(motor_left_target, motor_right_target)
+        self.setMotors(motor_left_target, motor_right_target)
+        self.motor_targets = [motor_left_target, motor_right_target]
+        if self.last_command_time is None:
+            self.last_command_time = now
 
         return True
 
-    def updatePose(self, motor_left_target, motor_right_target):
+    def stopMotors(self):
+        """Set both motor targets to 0, and end the running advance (if any) at its next tick
+
+        Meant to be called from another thread than the main loop's, e.g. when giving up on a goal: the motor targets are set
+        synchronously, even if the main loop is stuck.
+        """
+        self.stopped = True
+        self.network.SetVariable("thymio-II", "motor.left.target", [0])
+        self.network.SetVariable("thymio-II", "motor.right.target", [0])
+
+    def setMotors(self, motor_left_target, motor_right_target):
+        """Send the motor targets asynchronously, recording the D-Bus latency of the tick once its call(s) are all replied"""
+        send_time = time.perf_counter()
+        n_pending_replies = 1 if self.motors_event else 2
+
+        def reply_handler(*_):
+            nonlocal n_pending_replies
+            n_pending_replies -= 1
+            if n_pending_replies == 0: # a single latency per tick, until its last reply
+                self.stats.addLatency(time.perf_counter() - send_time)
+
+        if self.motors_event:
+            self.network.SendEventName(MOTORS_EVENT, [motor_left_target, motor_right_target], reply_handler=reply_handler, error_handler=self.dbusError)
+        else:
+            self.network.SetVariable("thymio-II", "motor.left.target", [motor_left_target], reply_handler=reply_handler, error_handler=self.dbusError)
+            self.network.SetVariable("thymio-II", "motor.right.target", [motor_right_target], reply_handler=reply_handler, error_handler=self.dbusError)
+
+    def updatePose(self, motor_left_target, motor_right_target, dt=TIMESTEP / 1e3):
+        """Integrate the pose over dt [s], during which the motor targets were applied"""
         # Convert motor speeds to [rad/s]
         motor_left_target_rads = motor_left_target * SPEED_UNIT_TO_RADS_CONVERTION
         motor_right_target_rads = motor_right_target * SPEED_UNIT_TO_RADS_CONVERTION
@@ -103,21 +207,29 @@ class Thymio(object):
         yI_dot = math.sin(self.current_heading) * xR_dot
 
         # Update current pose
-        self.current_position[0] += xI_dot * TIMESTEP / 1e3 # /1e3 since TIMESTEP is in [ms]
-        self.current_position[1] += yI_dot * TIMESTEP / 1e3
-        self.current_heading += heading_dot * TIMESTEP / 1e3
+        self.current_position[0] += xI_dot * dt
+        self.current_position[1] += yI_dot * dt
+        self.current_heading += heading_dot * dt
 
     def updateGroundSensors(self):
+        if self.ground_sensors_request_time is not None: # the previous request is still in flight: do not pile up requests
+            self.stats.n_skipped_requests += 1
+            return
+
+        self.ground_sensors_request_time = time.perf_counter()
         self.network.GetVariable("thymio-II", 'prox.ground.delta', reply_handler=self.variablesReply, error_handler=self.variablesError)
 
     def variablesReply(self, r):
         # print('Reply:', r)
         self.ground_sensors = list(map(int, r))
+        self.stats.addLatency(time.perf_counter() - self.ground_sensors_request_time)
+        self.ground_sensors_request_time = None
 
     def variablesError(self, e):
+        self.ground_sensors_request_time = None
         print('Error:', e)
 
-    def dbusReply(self, r):
+    def dbusReply(self, *_):
         pass
 
     def dbusError(self, e):
@@ -134,12 +246,150 @@ class Thymio(object):
     def getCurrentPosition(self):
         return self.current_position
 
-    def saveCurrentPosition(self, filepath):
-        positions = []
-        with open(filepath, 'r') as fp:
-            positions = [line.rstrip() for line in fp.readlines()]
+    def saveCurrentPosition(self):
+        """Append the current pose to the journal (O(1), fsync'd)"""
+        self.journal.append(self.current_position, self.current_heading)
+
+
+class ThymioSession(object):
+    def __init__(self, initial_position, positions_filename, dest_folderpath, **thymio_kwargs):
+        """Long-lived Thymio, taking a sequence of "advance by d cm" goals
+
+        A single Thymio (hence a single D-Bus connection and pose) is kept across the goals, 
+        and driven by a background thread owning the main loop. The goals are queued and run in order.
+
+        Arguments:
+            initial_position {List of 2 floats} -- (x,y) coordinates of the initial position
+            positions_filename (str): filename of the .jsonl journal of the Thymio's past poses where it stopped (see pose_journal.py)
+            dest_folderpath (str): folderpath where to store {positions_filename}.jsonl
+            thymio_kwargs -- Passed to Thymio (e.g. network, mainloop, motors_event, initial_heading)
+        """
+        self.goals = queue.Queue()
+        self.thymio = None
+        started = Future()
+        self.thread = threading.Thread(target=self.work, args=(started, initial_position, positions_filename, dest_folderpath, thymio_kwargs), daemon=True)
+        self.thread.start()
+        started.result() # raises if the Thymio could not be reached
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def work(self, started, initial_position, positions_filename, dest_folderpath, thymio_kwargs):
+        """Create the Thymio, then run the queued goals until None is queued"""
+        try:
+            self.thymio = Thymio(initial_position=initial_position, distance_to_travel=0, positions_filename=positions_filename,
+                                 dest_folderpath=dest_folderpath, **thymio_kwargs)
+        except Exception as e: # pylint: disable=broad-except
+            started.set_exception(e)
+            return
+        started.set_result(None)
+
+        while True:
+            goal = self.goals.get()
+            if goal is None:
+                self.thymio.journal.close()
+                return
+
+            distance_to_travel, future = goal
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.thymio.advance(distance_to_travel))
+            except Exception as e: # pylint: disable=broad-except
+                future.set_exception(e)
 
-        with open(filepath, 'w') as fp:
-            x, y = self.current_position
-            positions.append([float(x), float(y)])
-            fp.writelines("{}\n".format(position) for position in positions)
+    def advance(self, distance_to_travel, callback=None):
+        """Queue the goal of following the line for distance_to_travel [cm], from where the previous goal ended
+
+        Arguments:
+            distance_to_travel (float): distance [cm] forward the Thymio must travel
+            callback (callable): Called (from the session's thread) with the (x,y) coordinates where the Thymio stopped
+
+        Returns:
+            [concurrent.futures.Future]: Resolved with the (x,y) coordinates where the Thymio stopped
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(lambda future: callback(future.result()) if future.exception() is None else None)
+        self.goals.put((distance_to_travel, future))
+        return future
+
+    def getCurrentPosition(self):
+        return self.thymio.getCurrentPosition()
+
+    def stop(self):
+        """Stop the Thymio where it is (see Thymio.stopMotors): the running goal raises RuntimeError, and the queued ones are cancelled"""
+        closing = False
+        while True:
+            try:
+                goal = self.goals.get_nowait()
+            except queue.Empty:
+                break
+            if goal is None:
+                closing = True
+            else:
+                goal[1].cancel()
+        if closing:
+            self.goals.put(None)
+
+        self.thymio.stopMotors()
+
+    def close(self, timeout=None):
+        """Wait for the queued goals, then stop the session's thread
+
+        The motors keep their last targets: call stop first, so that a Thymio stuck before its goal does not keep driving.
+
+        Arguments:
+            timeout (float): Time [s] after which to stop waiting (the thread being a daemon), None to wait until the goals are reached
+        """
+        if self.thread.is_alive():
+            self.goals.put(None)
+            self.thread.join(timeout)
+
+
+class ControlLoopStats(object):
+    def __init__(self):
+        """Histograms (over HISTOGRAM_BINS) of the period of the control loop and of the latency of its D-Bus calls"""
+        self.period_counts = [0] * (len(HISTOGRAM_BINS) - 1)
+        self.latency_counts = [0] * (len(HISTOGRAM_BINS) - 1)
+        self.periods = [] # [ms]
+        self.latencies = [] # [ms]
+        self.n_missed_deadlines = 0
+        self.n_skipped_requests = 0 # sensor requests skipped because the previous one was still in flight
+        self.last_tick_time = None
+
+    def addTick(self, now):
+        if self.last_tick_time is not None:
+            period = (now - self.last_tick_time) * 1e3
+            self.periods.append(period)
+            self.period_counts[bisect.bisect_right(HISTOGRAM_BINS, period) - 1] += 1
+            self.n_missed_deadlines += period > DEADLINE
+        self.last_tick_time = now
+
+    def addLatency(self, latency):
+        latency *= 1e3
+        self.latencies.append(latency)
+        self.latency_counts[bisect.bisect_right(HISTOGRAM_BINS, latency) - 1] += 1
+
+    def toRecord(self):
+        """Return the statistics as an instrumentation record (see instrumentation.write_records)"""
+        record = {'stage': 'thymio_control', 'n_ticks': len(self.periods) + (self.last_tick_time is not None),
+                  'n_missed_deadlines': self.n_missed_deadlines, 'n_skipped_requests': self.n_skipped_requests,
+                  'histogram_bins_ms': HISTOGRAM_BINS[:-1], 'period_counts': self.period_counts, 'latency_counts': self.latency_counts}
+        for name, values in [('period', self.periods), ('latency', self.latencies)]:
+            values = sorted(values)
+            for statistic, value in [('mean', sum(values) / max(len(values), 1)), ('p50', percentile(values, 50)),
+                                     ('p99', percentile(values, 99)), ('max', values[-1] if values else 0.0)]:
+                record['{}_{}_ms'.format(name, statistic)] = value
+
+        return record
+
+
+def percentile(sorted_values, q):
+    """Return the q-th percentile of sorted_values (nearest rank), 0 if empty"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(int(math.ceil(q / 100 * len(sorted_values))) - 1, 0)]
@@ -0,0 +1,108 @@
+import json
+import math
+import numpy as np
+from os.path import join, isfile
+
+from atomic_write import write_atomically
+from locations_index import load_locations, LOCATIONS_FILENAME
+
+TRANSFORM_FILENAME = 'transform'
+
+class AffineTransform(object):
+    def __init__(self, matrix=None):
+        """2D affine transform of the locations, as a 3x3 matrix acting on homogeneous coordinates [x, y, 1]
+
+        Arguments:
+            matrix {array-like of shape (3, 3)} -- Matrix of the transform. The identity if None
+        """
+        self.matrix = np.eye(3) if matrix is None else np.asarray(matrix, dtype=np.float64)
+
+    @classmethod
+    def from_parameters(cls, translation=(0.0, 0.0), rotation=0.0, scale=1.0):
+        """Transform scaling by scale and rotating by rotation [deg] (counterclockwise) around the origin, then translating by translation [cm]"""
+        cos, sin = math.cos(math.radians(rotation)), math.sin(math.radians(rotation))
+        return cls([[scale * cos, -scale * sin, translation[0]],
+                    [scale * sin, scale * cos, translation[1]],
+                    [0.0, 0.0, 1.0]])
+
+    def then(self, other):
+        """Return the transform applying self, then other"""
+        return AffineTransform(other.matrix @ self.matrix)
+
+    def inverse(self):
+        return AffineTransform(np.linalg.inv(self.matrix))
+
+    def is_identity(self):
+        return np.allclose(self.matrix, np.eye(3))
+
+    def apply(self, xy):
+        """Transform the locations xy, all at once
+
+        Arguments:
+            xy {array-like of shape (n, 2)} -- (x,y) coordinates [cm]
+
+        Returns:
+            [np.ndarray of shape (n, 2)] -- Transformed (x,y) coordinates [cm]
+        """
+        xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        return xy @ self.matrix[:2, :2].T + self.matrix[:2, 2]
+
+    def get_parameters(self):
+        """Return the translation [cm], rotation [deg] and scale of the transform (exact if it has no shear nor reflection)"""
+        translation = [float(self.matrix[0, 2]), float(self.matrix[1, 2])]
+        rotation = math.degrees(math.atan2(self.matrix[1, 0], self.matrix[0, 0]))
+        scale = math.sqrt(abs(np.linalg.det(self.matrix[:2, :2])))
+        return translation, rotation, scale
+
+    def __repr__(self):
+        translation, rotation, scale = self.get_parameters()
+        return 'AffineTransform(translation=[{:.2f}, {:.2f}], rotation={:.2f}, scale={:.4f})'.format(translation[0], translation[1], rotation, scale)
+
+
+def load_transform(folderpath):
+    """Load the transform of a campaign from {folderpath}/{TRANSFORM_FILENAME}.json, the identity if there is none
+
+    Arguments:
+        folderpath {str} -- Folder of the campaign
+
+    Returns:
+        transform [AffineTransform]
+    """
+    transform_filepath = join(folderpath, '{}.json'.format(TRANSFORM_FILENAME))
+    if not isfile(transform_filepath):
+        return AffineTransform()
+
+    with open(transform_filepath, 'r') as fp:
+        return AffineTransform(json.load(fp)['matrix'])
+
+
+def save_transform(folderpath, transform):
+    """Atomically save the transform of a campaign to {folderpath}/{TRANSFORM_FILENAME}.json (along with its parameters, for reading)"""
+    translation, rotation, scale = transform.get_parameters()
+    def dump(filepath):
+        with open(filepath, 'w') as fp:
+            json.dump({'matrix': transform.matrix.tolist(), 'translation': translation, 'rotation': rotation, 'scale': scale}, fp)
+
+    write_atomically(join(folderpath, '{}.json'.format(TRANSFORM_FILENAME)), dump)
+
+
+def load_transformed_locations(folderpath, locations_filename=LOCATIONS_FILENAME):
+    """Load the locations of a campaign (see locations_index.load_locations), with its transform applied
+
+    The raw locations are left untouched: the transform is only applied when reading them.
+
+    Arguments:
+        folderpath {str} -- Folder of the campaign
+        locations_filename {str} -- Filename (without extension) of the locations index
+
+    Returns:
+        locations [dict] -- The fingerprint IDs (str) are keys, and the transformed [x,y] coordinates are values
+    """
+    locations = load_locations(folderpath, locations_filename)
+    transform = load_transform(folderpath)
+    if transform.is_identity() or not locations:
+        return locations
+
+    fingerprint_ids = list(locations.keys())
+    xy = transform.apply([locations[fingerprint_id] for fingerprint_id in fingerprint_ids])
+    return dict(zip(fingerprint_ids, xy.tolist()))
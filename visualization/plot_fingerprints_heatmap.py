@@ -4,11 +4,12 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-from os.path import join
+from os.path import join, isfile
 from os import listdir
 
 CE_FOLDERNAME = 'ce'
 CE_FILENAME = 'ce'
+CE_SUMMARY_FILENAME = 'ce_summary'
 
 N_TTI_TO_PLOT = 5 # # of TTIs to plot
 N_SUBCARRIERS = 400 
@@ -20,6 +21,9 @@ def plot_fingerprints_heatmap(src_folderpath, n_fingerprints):
     """Plot a {N_TTI_TO_PLOT} samples of the channel estimates' amplitude located in src_folderpath/CE_FOLDERNAME as a heatmap
     The plot is saved in src_folderpath 
 
+    The per-subcarrier mean amplitudes are read from {CE_SUMMARY_FILENAME}.parquet (written by clean_fingerprints.py) when it holds the fingerprint,
+    instead of loading the whole .parquet
+
     Arguments:
         src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
         n_fingerprints {int} -- How many fingerprints to plot
@@ -38,11 +42,23 @@ def plot_fingerprints_heatmap(src_folderpath, n_fingerprints):
     cleaned_ce_files = cleaned_ce_files[:n_fingerprints] # only keep n_fingerprints
     fingerprint_ids = fingerprint_ids[:n_fingerprints]
     
+    summary_df = None
+    summary_filepath = join(src_folderpath, '{}.parquet'.format(CE_SUMMARY_FILENAME))
+    if isfile(summary_filepath):
+        summary_df = pd.read_parquet(summary_filepath)
+        if 'AMPLITUDE_MEAN' not in summary_df: # summary written before the mean amplitude was gathered
+            summary_df = None
+
     # Average each fingerprint over its recording time
     ce_space = np.full((N_SUBCARRIERS, 4, len(cleaned_ce_files)), np.nan) # will hold the ce as it changes through space
-    for i, f in enumerate(cleaned_ce_files):
-        ce_df = pd.read_parquet(join(src_ce_folderpath, '{}.parquet'.format(f)))
-        ce_mean_amplitude = ce_df.groupby('SC_ID').mean()[['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']].to_numpy() # shape [400, 4]
+    for i, (f, fingerprint_id) in enumerate(zip(cleaned_ce_files, fingerprint_ids)):
+        fingerprint_summary_df = None if summary_df is None else summary_df[summary_df.FINGERPRINT_ID == fingerprint_id]
+        if fingerprint_summary_df is not None and not fingerprint_summary_df.empty and fingerprint_summary_df.AMPLITUDE_MEAN.notna().all():
+            ce_mean_amplitude_df = fingerprint_summary_df.pivot(index='SC_ID', columns='PORT', values='AMPLITUDE_MEAN')
+        else:
+            ce_df = pd.read_parquet(join(src_ce_folderpath, '{}.parquet'.format(f)))
+            ce_mean_amplitude_df = ce_df.groupby('SC_ID').mean()[['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']]
+        ce_mean_amplitude = ce_mean_amplitude_df.reindex(range(N_SUBCARRIERS)).to_numpy() # shape [400, 4], NaN for the missing subcarriers
         ce_space[:,:,i] = 20 * np.log10(ce_mean_amplitude)
     
     # Plot one heatmap per port
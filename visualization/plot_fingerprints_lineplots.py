@@ -4,11 +4,12 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-from os.path import join
+from os.path import join, isfile
 from os import listdir
 
 CE_FOLDERNAME = 'ce'
 CE_FILENAME = 'ce'
+CE_SUMMARY_FILENAME = 'ce_summary'
 
 N_TTI_TO_PLOT = 50 # # of TTIs to plot
 
@@ -21,6 +22,9 @@ def plot_fingerprints_lineplots(src_folderpath, force):
 
     If --force is set, then the already plotted .parquet are replotted
 
+    The per-subcarrier mean/std are read from {CE_SUMMARY_FILENAME}.parquet (written by clean_fingerprints.py) when it holds the fingerprint,
+    instead of loading the whole .parquet
+
     Arguments:
         src_folderpath {str} -- Source folder where the CE_FOLDERNAME, ELSE_FOLDERNAME and INFO_FOLDERNAME folder are located
     """
@@ -43,24 +47,36 @@ def plot_fingerprints_lineplots(src_folderpath, force):
     fingerprint_ids = np.sort(fingerprint_ids)
     cleaned_ce_files = list(np.array(cleaned_ce_files)[argsort])   
 
-    for f in cleaned_ce_files:
-        print('\t {}.parquet: '.format(f), end='')
-        ce_df = pd.read_parquet(join(src_ce_folderpath, '{}.parquet'.format(f)))
+    summary_df = None
+    summary_filepath = join(src_folderpath, '{}.parquet'.format(CE_SUMMARY_FILENAME))
+    if isfile(summary_filepath):
+        summary_df = pd.read_parquet(summary_filepath, columns=['FINGERPRINT_ID', 'SC_ID', 'PORT', 'N', 'AMPLITUDE_DB_MEAN', 'AMPLITUDE_DB_STD'])
 
-        ce_df[['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']] = 20 * np.log10(ce_df[['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']])
+    for f, fingerprint_id in zip(cleaned_ce_files, fingerprint_ids):
+        print('\t {}.parquet: '.format(f), end='')
+        
+        if summary_df is not None and (summary_df.FINGERPRINT_ID == fingerprint_id).any():
+            fingerprint_summary_df = summary_df[summary_df.FINGERPRINT_ID == fingerprint_id]
+            mean_df = fingerprint_summary_df.pivot(index='SC_ID', columns='PORT', values='AMPLITUDE_DB_MEAN').reset_index()
+            std_df = fingerprint_summary_df.pivot(index='SC_ID', columns='PORT', values='AMPLITUDE_DB_STD').reset_index()
+            mean_df.columns = std_df.columns = ['SC_ID', 'CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']
+            n_ttis = fingerprint_summary_df.N.max() # a subcarrier is recorded at most once per TTI
+        else:
+            ce_df = pd.read_parquet(join(src_ce_folderpath, '{}.parquet'.format(f)))
+            ce_df[['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']] = 20 * np.log10(ce_df[['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']])
+            mean_df = ce_df.groupby('SC_ID').mean().reset_index()
+            std_df = ce_df.groupby('SC_ID').std().reset_index()
+            n_ttis = ce_df.TTI.nunique()
         
         # Plot
         _, axes = plt.subplots(4, 1, figsize=(5, 15), sharex=True)
 
-        if not ce_df.empty: # the fingerprint might be empty if the gathering timed out
-            mean_df = ce_df.groupby('SC_ID').mean().reset_index()
-            std_df = ce_df.groupby('SC_ID').std().reset_index()
-            
+        if not mean_df.empty: # the fingerprint might be empty if the gathering timed out
             for ax, col in zip(axes, ['CE_0_AMPLITUDE', 'CE_1_AMPLITUDE', 'CE_2_AMPLITUDE', 'CE_3_AMPLITUDE']):
                 sns.lineplot(x='SC_ID', y=col, data=mean_df, legend=False, ax=ax)
                 ax.fill_between(x=std_df['SC_ID'], y1=mean_df[col] - std_df[col], y2=mean_df[col] + std_df[col], alpha=0.2)
                 
-        plt.suptitle('{}\n {} TTIs \n ||CSI|| [dB]'.format(f, ce_df.TTI.nunique()))
+        plt.suptitle('{}\n {} TTIs \n ||CSI|| [dB]'.format(f, n_ttis))
 
         plot_filename = '{}_lineplot.png'.format(f.split('.')[0])
         plt.savefig(join(src_ce_folderpath, plot_filename))